@@ -433,6 +433,13 @@ class Assembler:
 
             output_file.write('\n:00000001FF\n')
 
+        # Write the jump labels next to the image so the emulator can name routines.
+        # A label holds the address before its instruction (jmp lands on label + 1).
+        symbol_file = os.path.splitext(self.output_file)[0] + ".sym"
+        with open(symbol_file, 'w') as output_file:
+            for label, address in sorted(self.labels.items(), key=lambda item: item[1]):
+                output_file.write(f"{address + 1:04X} {label}\n")
+
         print(f"Assembly complete. Output written to '{self.output_file}'.")
 
 
@@ -8,36 +8,19 @@ import threading
 import signal
 import sys
 import queue  # Import the queue module
+from concurrent import futures
 from utils import logger
-
-VERSION = '8.0.0'
-
-# Define system call constants as class attributes
-SYS_PRINT = 1
-SYS_EXIT = 0
-
-# File I/O
-SYS_OPEN = 2
-SYS_READ = 3
-SYS_WRITE = 4
-SYS_CLOSE = 5
-SYS_SEEK = 8
-
-# Memory Management
-SYS_MALLOC = 92
-SYS_FREE = 93
-
-# Time and Date
-SYS_GETTIMEOFDAY = 96
-SYS_SLEEP = 11
-
-# File and Directory Operations
-SYS_MKDIR = 83
-SYS_RMDIR = 84
-SYS_RENAME = 82
-
-# System Information
-SYS_UNAME = 63
+from emulator.snapshot import read_snapshot_file, SnapshotError
+from emulator.hexfile import read_hex_file
+from emulator.emulator import VERSION, INPUT_STORE, INPUT_PC, INPUT_RECORD, INPUT_STEP, INPUT_BACK, INPUT_REVERSE, INPUT_BANK
+from emulator.emulator import INPUT_SAVE, INPUT_RESTORE, INPUT_LOAD, INPUT_FREE, INPUT_MAP, INPUT_HEAP
+from emulator.disassembler import disassemble
+from emulator.replay import Recorder
+from emulator.bus import PAGE_WORDS
+from emulator.devices import MAP_RAM, MAP_SERIAL, MAP_ROM
+from emulator.syscalls import SYS_PRINT, SYS_EXIT, SYS_UNAME
+
+DEBUG_TIMEOUT = 60  # Seconds to wait for a step or a reverse command to finish, or an input to be applied
 
 END_MARKER_ADDRESS = 0xFF # Define an address as the end marker
 
@@ -61,6 +44,7 @@ class CommandLineInterface:
         # Change the prompt to reflect the current directory
         os.environ['PWD'] = self.current_directory
         self.step_mode = False  # Initialize step mode as False
+        self.recording = None  # Name of the replay file being recorded, if any
         self.system_call_queue = queue.Queue()  # Create a queue for system call requests
 
     def handle_syscalls(self):
@@ -82,8 +66,8 @@ class CommandLineInterface:
             return 0  # Success
         elif syscall_number == SYS_EXIT:
             #print(f"CLI SYS_EXIT =>{syscall_number}")
-            # Execute the exit system call
-            self.emulator.pc_register = END_MARKER_ADDRESS
+            # Execute the exit system call; the PC change is an input, applied between quanta
+            self.emulator.post_input(INPUT_PC, END_MARKER_ADDRESS)
             return sys.exit()  # Terminate the CLI
         elif syscall_number == SYS_UNAME:
             #print(f"CLI SYS_UNAME =>{syscall_number}")
@@ -97,7 +81,7 @@ class CommandLineInterface:
             os.makedirs("harddrive")
 
     def start(self):
-        breakpoints = set()  # Store user-defined breakpoints
+        breakpoints = self.emulator.breakpoints  # Store user-defined breakpoints
 
         # Start a separate thread to handle system call requests
         syscall_handler_thread = threading.Thread(target=self.handle_syscalls)
@@ -113,13 +97,36 @@ class CommandLineInterface:
 
         while not self.emulator.exit_event.is_set():
             command = input(f"{self.current_directory} $ ")
-            if (command == "start" or command == "run"):
-                self.emulator.interrupt_flag = False
+            if (command == "start" or command == "run" or command == "continue" or command == "c"):
+                self.step_mode = False
+                self.emulator.resume()
+            elif command == "step" or command.startswith("step ") or command == "s":
+                self.debug_command(INPUT_STEP, command.split()[1:], "step")
+            elif command == "back" or command.startswith("back "):
+                self.debug_command(INPUT_BACK, command.split()[1:], "back")
+            elif command == "reverse-continue" or command == "rc":
+                self.debug_command(INPUT_REVERSE, [], "reverse-continue")
+            elif command == "break" or command == "b":
+                print("Breakpoints: " + (" ".join(f"0x{address:04X}" for address in sorted(breakpoints)) or "None"))
+            elif command.startswith("break ") or command.startswith("clear "):
+                try:
+                    address = int(command.split()[1], 16)
+                except ValueError:
+                    print("Usage: break <address> | clear <address>")
+                    continue
+                if command.startswith("break "):
+                    breakpoints.add(address)
+                    print(f"Breakpoint set at 0x{address:04X}.")
+                else:
+                    breakpoints.discard(address)
+                    print(f"Breakpoint at 0x{address:04X} cleared.")
             elif command == "auto":
                 self.auto_run = not self.auto_run
                 print(f"Auto run {'enabled' if self.auto_run else 'disabled'}.")
             elif command == "log" or command == "l":
                 self.logging_enabled = not self.logging_enabled
+                # Switch the emulator between the logging interpreter and the quiet traced one
+                self.emulator.logging_enabled = self.logging_enabled
                 if self.logging_enabled:
                     print("Logging mode enabled.")
                 else:
@@ -160,21 +167,46 @@ class CommandLineInterface:
 
 
 
+            elif command == "trace" or command.startswith("trace "):
+                self.trace_command(command.split()[1:])
+            elif command == "fusion":
+                self.display_fusion_stats()
+            elif command == "profile" or command.startswith("profile "):
+                self.profile_command(command.split()[1:])
             elif command == "registers":
                 self.display_register_info()
             elif command == "sysinfo":
                 self.display_system_info()
+            elif command == "record" or command.startswith("record "):
+                self.record_command(command.split()[1:])
+            elif command == "bank" or command.startswith("bank "):
+                self.bank_command(command.split()[1:])
+            elif command == "map" or command.startswith("map "):
+                self.map_command(command.split()[1:])
+            elif command == "free" or command.startswith("free "):
+                self.free_command(command.split()[1:])
+            elif command == "heap" or command.startswith("heap "):
+                self.heap_command(command.split()[1:])
             elif command.startswith("load "):
                 filename = command.split(" ")[1]
                 success = self.load_hex_file(filename)
                 print("PC: {}".format(success))
-                if success is not None:
+                if success >= 0:
                     # If loading was successful and auto_run is True, set the PC to the starting address and run the program
-                    if self.auto_run:
-                        self.emulator.pc_register = success  # Set PC to the desired starting address
-                        self.emulator.interrupt_flag = False  # Unset the interrupt flag to start the emulator
+                    if self.auto_run and not self.step_mode:
+                        self.emulator.post_input(INPUT_PC, success)  # Set PC to the desired starting address
+                        self.emulator.resume()  # Unset the interrupt flag and wake the emulator
                     else:
                         print("Program loaded. To run, type 'start' or 'run'.")
+            elif command.startswith("save "):
+                filename = command.split(" ")[1]
+                self.save_state(filename)
+            elif command.startswith("restore "):
+                if self.recording:
+                    print("Stop the recording before restoring a machine state.")
+                    continue
+                filename = command.split(" ")[1]
+                self.restore_state(filename)
             elif command.startswith("cd "):
                 directory = command.split(" ")[1]
                 self.change_directory(directory)
@@ -195,10 +227,35 @@ class CommandLineInterface:
         print("Available commands:")
         print("\tstart - Start the emulator")
         print("\tlog or l - Toggle logging mode")
+        print("\tbreak <address> / clear <address> - Set or clear a breakpoint (break alone lists them)")
+        print("\tstep [count] or s - Execute one or more instructions, then halt")
+        print("\tcontinue or c - Run on from a breakpoint or step")
+        print("\tback [count] - Go back one or more instructions")
+        print("\treverse-continue or rc - Go back to the last breakpoint hit")
+        print("\ttrace [count] - Display the last instructions executed (default 20)")
+        print("\ttrace save <filename> - Save the execution trace (.bin for binary, text otherwise)")
         print("\tmem <start_address> <end_address> - Display memory information for the specified region")
         print("\tregisters - Display register information")
+        print("\tmap - Display the devices mapped over RAM")
+        print("\tmap serial|ram <page> - Map the serial port at a page (16 words; page 0F is 0x00F0), or make it RAM again")
+        print("\tmap rom <page> [eprom_page] - Map a page of the EPROM image, read-only")
+        print("\tfree - Display the free extents of the selected RAM bank")
+        print("\tfree <address> <size> - Give size words from address back to the loader")
+        print("\theap - Display the heap of the selected RAM bank and its use per program")
+        print("\theap <address> <size> - Move the heap (SYS_MALLOC/SYS_FREE) to size words from address")
+        print("\tbank [number] - Select a RAM bank for the program, memory commands and loads (bank alone shows it)")
+        print("\tfusion - Display the instruction pairs fused in the loaded program")
+        print("\tprofile on|off|reset - Enable, disable or clear the execution profiler")
+        print("\tprofile [count] - Display the most executed instructions (default 20)")
+        print("\tprofile save <filename> - Export the profile (.csv for CSV, JSON otherwise)")
+        print("\tprofile calls - Display instruction counts per guest routine")
+        print("\tprofile flame <filename> - Save collapsed call stacks for flamegraph.pl or speedscope")
         print("\tsysinfo - Display system information")
         print("\tload <filename> - Load a binary file into memory and run it")
+        print("\tsave <filename> - Save the whole machine state to a file")
+        print("\trecord <filename> - Record the machine state and every input for emulator_replay.py")
+        print("\trecord stop - Finish the recording")
+        print("\trestore <filename> - Restore the machine state saved with 'save'")
         print("\tcd <directory> - Change the current directory")
         print("\tls - List files in the current directory")
         print("\thelp or ? - Display this help message")
@@ -221,10 +278,14 @@ class CommandLineInterface:
                             raise ValueError("Invalid hexadecimal format")
                     else:
                         data_values.append(data_str)
+                if not all(0 <= value <= 0xFFFF for value in data_values):
+                    print("Values must be 0-FFFF.")
+                    return
 
-                # Store each data value at the specified address
+                # Store each data value at the specified address; pokes are inputs,
+                # applied by the emulator thread between quanta
                 for i, value in enumerate(data_values):
-                    self.emulator.write_memory(address + i, value)
+                    self.emulator.post_input(INPUT_STORE, address + i, value)
 
                 print(f"Stored data at memory address {hex(address)}.")
             else:
@@ -242,9 +303,8 @@ class CommandLineInterface:
 
         print("Memory Info:")
         # Display memory contents within the specified range
-        for address in range(start_address, end_address + 1):
-            data = self.emulator.read_memory(address)
-            print(f"Address 0x{address:04X}: 0x{data:04X}")
+        words = self.emulator.ram_memory[start_address:end_address + 1]
+        print("\n".join(f"Address 0x{address:04X}: 0x{data:04X}" for address, data in enumerate(words, start_address)))
 
 
 
@@ -265,11 +325,103 @@ class CommandLineInterface:
         print(f"Interrupt Flag: {self.emulator.interrupt_flag}")
  
 
+    def trace_command(self, arguments):
+        if self.emulator.trace is None:
+            print("Execution trace is disabled.")
+            return
+        if arguments and arguments[0] == "save":
+            if len(arguments) != 2:
+                print("Usage: trace save <filename>")
+                return
+            try:
+                count = self.emulator.dump_trace(arguments[1])
+                print(f"Saved {count} trace records to '{arguments[1]}'.")
+            except OSError as e:
+                print(f"Error saving trace to '{arguments[1]}': {str(e)}")
+            return
+        try:
+            count = int(arguments[0]) if arguments else 20
+        except ValueError:
+            print("Usage: trace [count] | trace save <filename>")
+            return
+        print("Execution Trace:")
+        for line in self.emulator.trace.format_records(count):
+            print(line)
+
+    def profile_command(self, arguments):
+        emulator = self.emulator
+        if arguments and arguments[0] in ("on", "off", "reset"):
+            if arguments[0] == "on":
+                emulator.enable_profiler()
+                print("Profiler enabled.")
+            elif arguments[0] == "off":
+                emulator.disable_profiler()
+                print("Profiler disabled.")
+            elif emulator.profiler is not None:
+                emulator.profiler.reset()
+                print("Profile cleared.")
+            return
+        if emulator.profiler is None:
+            print("Profiler is disabled. Use 'profile on' to enable it.")
+            return
+        if arguments and arguments[0] == "save":
+            if len(arguments) != 2:
+                print("Usage: profile save <filename>")
+                return
+            try:
+                count = emulator.profiler.export(arguments[1], emulator.ram_memory)
+                print(f"Saved the profile of {count} addresses to '{arguments[1]}'.")
+            except OSError as e:
+                print(f"Error saving profile to '{arguments[1]}': {str(e)}")
+            return
+        if arguments and arguments[0] == "flame":
+            if len(arguments) != 2:
+                print("Usage: profile flame <filename>")
+                return
+            try:
+                count = emulator.profiler.call_graph.export(arguments[1])
+                print(f"Saved {count} call stacks to '{arguments[1]}'.")
+            except OSError as e:
+                print(f"Error saving call stacks to '{arguments[1]}': {str(e)}")
+            return
+        if arguments and arguments[0] == "calls":
+            routines = emulator.profiler.call_graph.routines()
+            print("Routine                  Inclusive   Exclusive")
+            for name, (inclusive, exclusive) in sorted(routines.items(), key=lambda item: -item[1][0]):
+                print(f"{name:24s} {inclusive:10d}  {exclusive:10d}")
+            return
+        try:
+            count = int(arguments[0]) if arguments else 20
+        except ValueError:
+            print("Usage: profile [on|off|reset|calls|count] | profile save|flame <filename>")
+            return
+        profiler = emulator.profiler
+        print(f"Execution Profile: {profiler.total()} instructions")
+        for spot in profiler.hot_spots(emulator.ram_memory, count):
+            line = (f"0x{spot['address']:04X}  {spot['count']:10d}  {spot['percent']:5.1f}%  "
+                    f"0x{spot['instruction']:04X}  {spot['disassembly']:24s}")
+            if spot['taken'] or spot['not_taken']:
+                line += f"  taken {spot['taken']}, not taken {spot['not_taken']}"
+            print(line.rstrip())
+        print("Opcodes: " + ", ".join(f"{mnemonic} {count}" for mnemonic, count in
+                                      sorted(profiler.opcode_profile().items(), key=lambda item: -item[1])))
+
+    def display_fusion_stats(self):
+        pairs = self.emulator.fusions.stats()
+        print("Fused Instruction Pairs:")
+        if not pairs:
+            print("None")
+        for name, addresses in sorted(pairs.items()):
+            print(f"{name:8s} {len(addresses):4d}  " + " ".join(f"0x{address:04X}" for address in addresses))
+        print(f"Total: {sum(len(addresses) for addresses in pairs.values())}")
+
     def display_system_info(self):
         now = datetime.datetime.now()
         print("System Info:")
         for i, value in enumerate(self.registers):
             print(f"R{i}  0x{value:02X}  {value}")
+        print(f"RAM bank {self.emulator.current_ram_bank} of {len(self.emulator.ram_banks)}")
+        print(f"EPROM {len(self.emulator.eprom_memory) * 2} bytes")
         print(now.strftime("%Y-%m-%d %H:%M"))
 
 
@@ -283,60 +435,201 @@ class CommandLineInterface:
             print(f"File not found: {filename}")
             return -1
 
-        # Determine the memory location where you want to load the binary data
-        memory_address = self.emulator.find_empty_memory_slot(128 // 2)  # Divide by 2 for 16-bit instructions
-
         try:
-            # Open the Intel Hex file in text mode for reading
-            with open(filename, "r") as hex_file:
-                for line in hex_file:
-                    line = line.strip()  # Remove leading/trailing whitespace
-                    if line.startswith(":"):
-                        # Remove the start code ':' from the line
-                        line = line[1:]
-                        # Parse the Intel Hex record
-                        byte_count = int(line[0:2], 16)
-                        address = int(line[2:6], 16)
-                        record_type = int(line[6:8], 16)
-                        #print(f"byte_count = {byte_count}")
-                        #print(f"address = {address}")
-                        #print(f"record_type = {record_type}")
-
-                        # Check if it's an end-of-file record
-                        if record_type == 1:
-                            #print("EOF")
-                            break  # End of file, exit the loop
-
-                        if record_type == 0:
-                            # Data record (00)
-                            #print("Data record (00)")
-                            data_bytes = [int(line[i:i+2], 16) for i in range(8, len(line), 2)]
-                            # Load data into the specified memory address
-                            for data_byte in data_bytes:
-                                self.emulator.ram_memory[address] = data_byte
-                                #print(f"data_byte:{hex(data_byte)} => {hex(address)}")
-                                address += 1
-
-                        elif record_type == 17:
-                            # Instruction record (11)
-                            # print("Instruction record (11)")
-                            instructions_hex = line[8:]
-                            # Split the instructions into 16-bit chunks and load them into memory
-                            for i in range(0, len(instructions_hex), 4):  # Change the range to 4 characters
-                                instruction_chunk = instructions_hex[i:i + 4]  # Change to 4 characters
-                                instruction = int(instruction_chunk, 16)
-                                self.emulator.ram_memory[memory_address] = instruction
-                                #print(f"instruction = {instruction}")
-                                memory_address += 1
-
-            print(f"Loaded Intel Hex file '{filename}' into memory.")
-            return 0  # Success
+            # Read and checked here, written into RAM by the emulator thread between quanta
+            address = self.apply(INPUT_LOAD, read_hex_file(filename))
+            print(f"Loaded Intel Hex file '{filename}' into memory at 0x{address:04X}.")
+            return address  # Success
 
         except Exception as e:
             print(f"Error loading Intel Hex file '{filename}': {str(e)}")
             return -1
 
+    def debug_command(self, kind, arguments, name):
+        # Step or go back, then show where the program stopped
+        try:
+            count = int(arguments[0]) if arguments else 1
+        except ValueError:
+            print(f"Usage: {name} [count]")
+            return
+        if kind != INPUT_STEP and self.emulator.history is None:
+            print("History is disabled.")
+            return
+        self.step_mode = True
+        self.emulator.post_input(kind, count)
+        if not self.emulator.wait_until_halted(DEBUG_TIMEOUT):
+            print("Still running.")
+            return
+        if kind != INPUT_STEP:
+            print(self.emulator.history.status)
+        pc = self.emulator.pc_register
+        instruction = self.emulator.read_memory(pc) if 0 <= pc < len(self.emulator.ram_memory) else 0
+        print(f"PC 0x{pc:04X}  0x{instruction:04X}  {disassemble(instruction)}")
+
+    def bank_command(self, arguments):
+        banks = len(self.emulator.ram_banks)
+        if not arguments:
+            print(f"RAM bank {self.emulator.current_ram_bank} selected (banks 0-{banks - 1}).")
+            return
+        try:
+            bank = int(arguments[0])
+        except ValueError:
+            bank = -1
+        if len(arguments) != 1 or not 0 <= bank < banks:
+            print(f"Usage: bank [0-{banks - 1}]")
+            return
+        # Switched by the emulator thread between quanta, like any other input
+        self.emulator.post_input(INPUT_BANK, bank)
+        print(f"RAM bank {bank} selected.")
+
+    def map_command(self, arguments):
+        bus = self.emulator.bus
+        if not arguments:
+            devices = bus.devices()
+            for device in devices:
+                last = device.base + device.pages * PAGE_WORDS - 1
+                print(f"0x{device.base:04X}-0x{last:04X}  {device.name}")
+            if not devices:
+                print("All RAM.")
+            return
+        try:
+            kind = arguments[0]
+            page = int(arguments[1], 16)
+            eprom_page = int(arguments[2], 16) if len(arguments) > 2 else 0
+            if kind not in ("serial", "rom", "ram") or len(arguments) > (3 if kind == "rom" else 2) or eprom_page < 0:
+                raise ValueError
+        except (IndexError, ValueError):
+            print("Usage: map | map serial|ram <page> | map rom <page> [eprom_page]")
+            return
+        if not 0 <= page < len(bus.pages):
+            print("Invalid page specified.")
+            return
+        code = {"ram": MAP_RAM, "serial": MAP_SERIAL}.get(kind, MAP_ROM + eprom_page)
+        try:
+            # Mapped by the emulator thread between quanta, and recorded
+            device = self.apply(INPUT_MAP, page, code)
+        except (OSError, ValueError) as e:
+            print(f"Error mapping {kind}: {e}")
+            return
+        if kind == "ram":
+            print(f"Page 0x{page:03X} is RAM." if device is None else f"Unmapped {device.name} from 0x{device.base:04X}.")
+        else:
+            print(f"Mapped {device.name} at 0x{device.base:04X}.")
+
+    def free_command(self, arguments):
+        extents = self.emulator.extents
+        if not arguments:
+            for start, end in extents.extents():
+                print(f"0x{start:04X}-0x{end - 1:04X}  {end - start} words")
+            print(f"{extents.free_words()} of {extents.size} words free in RAM bank {self.emulator.current_ram_bank}.")
+            return
+        try:
+            address = int(arguments[0], 16)
+            size = int(arguments[1])
+            if len(arguments) != 2 or size <= 0:
+                raise ValueError
+        except (IndexError, ValueError):
+            print("Usage: free | free <address> <size>")
+            return
+        if not 0 <= address < len(self.emulator.ram_memory):
+            print("Invalid address specified.")
+            return
+        try:
+            self.apply(INPUT_FREE, address, size)
+        except OSError as e:
+            print(f"Error freeing memory: {e}")
+            return
+        print(f"Freed {size} words at 0x{address:04X}.")
+
+    def heap_command(self, arguments):
+        if arguments:
+            try:
+                base = int(arguments[0], 16)
+                words = int(arguments[1])
+                if len(arguments) != 2:
+                    raise ValueError
+            except (IndexError, ValueError):
+                print("Usage: heap | heap <address> <size>")
+                return
+            try:
+                # Moved by the emulator thread between quanta, and recorded
+                self.apply(INPUT_HEAP, base, words)
+            except (OSError, ValueError) as e:
+                print(f"Error moving the heap: {e}")
+                return
+            print(f"Heap of {words} words at 0x{base:04X}.")
+            return
+        heap = self.emulator.heap
+        print(f"Heap 0x{heap.base:04X}-0x{heap.base + heap.words - 1:04X}: {heap.used_words()} of {heap.words} words "
+              f"in use, largest free block {heap.largest_free()} words, {heap.fragmentation():.0%} fragmented")
+        if not heap.stats:
+            return
+        # Words of the live blocks per program, to show what rounding to block sizes wastes
+        block_words = {}
+        for order, _, owner in heap.blocks.values():
+            block_words[owner] = block_words.get(owner, 0) + (1 << order)
+        print(f"{'Program':<20}{'Allocs':>8}{'Frees':>8}{'Failed':>8}{'In use':>8}{'Peak':>8}{'Waste':>7}")
+        for owner, stats in sorted(heap.stats.items()):
+            program = self.emulator.programs.get(owner)
+            name = program[1] if program else f"0x{owner:04X}"
+            blocks = block_words.get(owner, 0)
+            waste = 1 - stats.in_use / blocks if blocks else 0.0
+            print(f"{name:<20}{stats.allocations:>8}{stats.frees:>8}{stats.failures:>8}"
+                  f"{stats.in_use:>8}{stats.peak:>8}{waste:>7.0%}")
+
+    def record_command(self, arguments):
+        if arguments == ["stop"]:
+            if self.recording is None:
+                print("Not recording.")
+                return
+            self.emulator.post_input(INPUT_RECORD, None)
+            print(f"Recording to '{self.recording}' stopped.")
+            self.recording = None
+            return
+        if len(arguments) != 1:
+            print("Usage: record <filename> | record stop")
+            return
+        if self.recording is not None:
+            print(f"Already recording to '{self.recording}'.")
+            return
+        try:
+            recorder = Recorder(arguments[0])
+        except OSError as e:
+            print(f"Error creating recording '{arguments[0]}': {str(e)}")
+            return
+        # The emulator thread starts the recording at the next quantum boundary
+        self.emulator.post_input(INPUT_RECORD, recorder)
+        self.recording = arguments[0]
+        print(f"Recording to '{arguments[0]}'.")
+
+    def apply(self, kind, a=0, b=0):
+        # Hand the emulator thread an input and wait until it has been applied, between
+        # two quanta; returns what applying it returned, raises what it raised
+        try:
+            return self.emulator.post_input(kind, a, b).result(DEBUG_TIMEOUT)
+        except futures.TimeoutError:
+            raise OSError("The emulator did not respond")
 
+    def save_state(self, filename):
+        # Taken by the emulator thread, so the registers and RAM are from the same instant
+        try:
+            self.apply(INPUT_SAVE, filename)
+            print(f"Saved machine state to '{filename}'.")
+        except OSError as e:
+            print(f"Error saving machine state to '{filename}': {str(e)}")
+
+    def restore_state(self, filename):
+        if not os.path.exists(filename):
+            print(f"File not found: {filename}")
+            return
+        # Read here, restored by the emulator thread between quanta; a state saved
+        # while running runs on from there
+        try:
+            self.apply(INPUT_RESTORE, read_snapshot_file(filename))
+        except (OSError, SnapshotError) as e:
+            print(f"Error restoring machine state from '{filename}': {str(e)}")
+            return
+        print(f"Restored machine state from '{filename}'.")
 
     def change_directory(self, directory):
         # Implement changing directories here
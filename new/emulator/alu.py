@@ -0,0 +1,225 @@
+# alu.py
+
+# Precomputed 8-bit ALU tables.
+#
+# Each table has 65536 16-bit entries indexed by (a << 8) | b, where a is the
+# first operand (Rn, or Rd for the logical operations) and b the second. An
+# entry packs the 8-bit result with the flags the operation produces:
+#
+#   bits 0-7  result
+#   bit 8     zero flag      (ZERO_BIT)
+#   bit 9     carry flag     (CARRY_BIT)
+#   bit 10    overflow flag  (OVERFLOW_BIT)
+#
+# The tables are built once per process, or read back from a cache file, and
+# shared by every emulator that turns them on with Emulator.use_alu_tables().
+# A cache file of the wrong size or with the wrong magic is rebuilt; a new one
+# is written next to it and renamed into place, so processes starting together
+# never read a partly written cache.
+# Operands wider than 8 bits (registers loaded from 16-bit memory words) fall
+# back to the ordinary turbo handlers.
+
+import os
+import sys
+import tempfile
+from array import array
+from collections import namedtuple
+
+from emulator import turbo
+from emulator.decoder import decode, INSTRUCTION_WORDS
+from emulator.flags import FLAGS_PACKED, ZERO_BIT, CARRY_BIT, OVERFLOW_BIT
+
+TABLE_ENTRIES = 65536
+TABLE_NAMES = ('add', 'sub', 'shl', 'shr', 'and_', 'or_', 'xor')
+CACHE_MAGIC = f"ALU1{sys.byteorder[0]}".encode()  # Entries are stored in native byte order
+ALU_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "alu_tables.bin")
+
+AluTables = namedtuple('AluTables', TABLE_NAMES)
+
+_loaded_tables = None  # Tables shared by every emulator in this process
+_decode_table = None   # Turbo decode table using the shared tables
+
+
+def pack(result, carry=False, overflow=False):
+    # Pack an unmasked result and its flags into one table entry
+    value = result & 0xFF
+    entry = value
+    if value == 0:
+        entry |= ZERO_BIT
+    if carry:
+        entry |= CARRY_BIT
+    if overflow:
+        entry |= OVERFLOW_BIT
+    return entry
+
+
+def build_alu_tables():
+    # Work out every entry using the same rules as the turbo handlers
+    tables = AluTables(*(array('H', bytes(2 * TABLE_ENTRIES)) for _ in TABLE_NAMES))
+    for a in range(256):
+        for b in range(256):
+            index = a << 8 | b
+            result = a + b
+            tables.add[index] = pack(result, result > 255, result > 127)
+            result = a - b
+            tables.sub[index] = pack(result, (result & 0xFF) < a, result > 127 or result < -128)
+            result = a << b
+            tables.shl[index] = pack(result, False, result & 0x100 != 0)
+            tables.shr[index] = pack(a >> b, False, a & 0x80 != 0)
+            tables.and_[index] = pack(a & b)
+            tables.or_[index] = pack(a | b)
+            tables.xor[index] = pack(a ^ b)
+    return tables
+
+
+def load_alu_tables(cache_file=ALU_CACHE_FILE):
+    """
+    Return the ALU tables, reading them from cache_file when it holds a valid copy.
+
+    Args:
+        cache_file (str): Where the tables are cached, or None to always build them.
+
+    Returns:
+        AluTables: One array('H') of 65536 packed entries per operation.
+    """
+    if cache_file is not None:
+        tables = read_alu_cache(cache_file)
+        if tables is not None:
+            return tables
+
+    tables = build_alu_tables()
+    if cache_file is not None:
+        write_alu_cache(cache_file, tables)
+    return tables
+
+
+def read_alu_cache(cache_file):
+    # The tables in cache_file, or None if it is missing, unreadable or not a complete copy
+    expected_size = len(CACHE_MAGIC) + 2 * TABLE_ENTRIES * len(TABLE_NAMES)
+    try:
+        with open(cache_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size != expected_size or f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            tables = AluTables(*(array('H') for _ in TABLE_NAMES))
+            for table in tables:
+                table.fromfile(f, TABLE_ENTRIES)
+    except (OSError, EOFError):
+        return None
+    return tables
+
+
+def write_alu_cache(cache_file, tables):
+    # Write the tables to a temporary file next to cache_file and rename it into place, so
+    # another process never reads half a cache; a directory that cannot be written is skipped
+    directory = os.path.dirname(cache_file)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(prefix=".alu_tables.", dir=directory)
+    except OSError:
+        return  # The cache is only an optimisation
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(CACHE_MAGIC)
+            for table in tables:
+                table.tofile(f)
+        os.replace(temporary, cache_file)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def make_alu_handlers(tables):
+    # Turbo-compatible handlers (emu, Rd, Rn, operands) that read the tables
+    add_table, sub_table, shl_table, shr_table = tables.add, tables.sub, tables.shl, tables.shr
+    and_table, or_table, xor_table = tables.and_, tables.or_, tables.xor
+
+    def add(emu, Rd, Rn, operands):
+        cpu = emu.cpu
+        registers = cpu.registers
+        a = registers[Rn]
+        if a > 0xFF:
+            return turbo.add(emu, Rd, Rn, operands)
+        entry = add_table[a << 8 | operands]
+        cpu._cv_source = (FLAGS_PACKED, entry, 0)
+        cpu._zero_result = registers[Rd] = entry & 0xFF
+
+    def subtract(emu, Rd, Rn, operands):
+        cpu = emu.cpu
+        registers = cpu.registers
+        a = registers[Rn]
+        if a > 0xFF:
+            return turbo.subtract(emu, Rd, Rn, operands)
+        entry = sub_table[a << 8 | operands]
+        if Rd == Rn:
+            # The borrow compares the result with Rn after the write, i.e. with itself
+            entry &= ~CARRY_BIT
+        cpu._cv_source = (FLAGS_PACKED, entry, 0)
+        cpu._zero_result = registers[Rd] = entry & 0xFF
+
+    def shift_left(emu, Rd, Rn, operands):
+        cpu = emu.cpu
+        registers = cpu.registers
+        a = registers[Rn]
+        if a > 0xFF:
+            return turbo.shift_left(emu, Rd, Rn, operands)
+        entry = shl_table[a << 8 | operands]
+        cpu._cv_source = (FLAGS_PACKED, entry, 0)
+        cpu._zero_result = registers[Rd] = entry & 0xFF
+
+    def shift_right(emu, Rd, Rn, operands):
+        cpu = emu.cpu
+        registers = cpu.registers
+        a = registers[Rn]
+        if a > 0xFF:
+            return turbo.shift_right(emu, Rd, Rn, operands)
+        entry = shr_table[a << 8 | operands]
+        cpu._cv_source = (FLAGS_PACKED, entry, 0)
+        cpu._zero_result = registers[Rd] = entry & 0xFF
+
+    def make_logical(table, fallback):
+        def logical(emu, Rd, Rn, operands):
+            cpu = emu.cpu
+            registers = cpu.registers
+            a = registers[Rd]
+            b = operands if Rn == 0 else registers[Rn]
+            if a > 0xFF or b > 0xFF:
+                return fallback(emu, Rd, Rn, operands)
+            cpu._zero_result = registers[0] = table[a << 8 | b] & 0xFF
+        return logical
+
+    return {
+        0x3: add,
+        0x4: subtract,
+        0x9: make_logical(and_table, turbo.logical_and),
+        0xA: make_logical(or_table, turbo.logical_or),
+        0xB: make_logical(xor_table, turbo.logical_xor),
+        0xC: shift_left,
+        0xD: shift_right,
+    }
+
+
+def get_alu_decode_table():
+    """
+    Return the turbo decode table whose ALU handlers read the shared tables.
+
+    The tables and the decode table are only built the first time this is called.
+    """
+    global _loaded_tables, _decode_table
+    if _decode_table is None:
+        _loaded_tables = load_alu_tables()
+        handlers = make_alu_handlers(_loaded_tables)
+        table = list(turbo.TURBO_DECODE_TABLE)
+        for instruction in range(INSTRUCTION_WORDS):
+            opcode, Rd, Rn, operands = decode(instruction)
+            if opcode in handlers:
+                table[instruction] = (handlers[opcode], Rd, Rn, operands)
+        _decode_table = table
+    return _decode_table
+
+
+def get_alu_tables():
+    # The shared tables (loaded together with the decode table)
+    get_alu_decode_table()
+    return _loaded_tables
@@ -0,0 +1,115 @@
+# banks.py
+
+# Bank-switched RAM.
+#
+# The machine has RAM_BANKS banks of RAM, each a full 64K word address space;
+# one of them at a time is mapped in (CPUState.current_ram_bank) and every
+# load, store and instruction fetch goes to it. A program that switches banks
+# carries on at the next address of the newly selected bank.
+#
+# Each bank keeps everything the engines derive from its contents: predecoded
+# entries, fused pairs and translated blocks, and its own free extents (see
+# extents.py), heap (see heap.py) and list of loaded programs.
+# Emulator.select_ram_bank() points the emulator's ram_memory, predecoded,
+# fusions, block_cache, extents, heap and programs at the chosen bank's
+# objects, so a switch copies nothing and decodes nothing. A bank whose
+# memory was replaced while it was not selected (a snapshot restore, a change
+# of decode table) is marked stale and rebuilt when it is next selected.
+#
+# Emulator.fork() shares the words of every bank with the new machine page by
+# page, copy-on-write. The banks are written once into a BankImage, an
+# anonymous file, and the child's banks are views of a private (MAP_PRIVATE)
+# mapping of it, so the OS copies a page of a child's bank on its first write.
+# Each bank has a flag per bus page, shared_pages, set while the page still
+# holds the image's words; both machines point the page table entries of their
+# RAM at write_shared (see bus.py), which clears the flag of the selected
+# bank's page on the first store to it and hands the page back to its RAM
+# handler once no bank shares it any more. Only the pages written after a fork
+# are duplicated, by the parent or the child, and a parent that has not
+# written since its last fork hands its next fork the same image. Other writes
+# to a bank (devices publishing, snapshot restores, loading an image) clear
+# the flags of what they write. Predecoded entries and fused pairs are copied,
+# translated blocks hold their machine and are never shared.
+#
+# Guest code switches with the SYS_BANK syscall, the CLI with the 'bank' command.
+
+import mmap
+import os
+import tempfile
+
+from emulator.bus import PAGE_SHIFT, PAGES
+
+RAM_BANKS = 3  # Banks 0-2
+
+
+class BankImage:
+    # The words of every RAM bank of a machine at the time of a fork, for the forks to map
+
+    def __init__(self, banks):
+        try:
+            fd = os.memfd_create("ram-banks")
+        except (AttributeError, OSError):
+            # No memfd (not Linux): an unlinked temporary file does the same
+            self.file = tempfile.TemporaryFile()
+        else:
+            self.file = open(fd, "w+b", buffering=0)
+        for bank in banks:
+            self.file.write(memoryview(bank.memory).cast('B'))
+        self.file.flush()
+        self.bank_words = [len(bank.memory) for bank in banks]
+
+    def map(self):
+        # A private copy-on-write mapping of the image: the words of each bank as a memoryview('H')
+        words = memoryview(mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)).cast('H')
+        views = []
+        start = 0
+        for count in self.bank_words:
+            views.append(words[start:start + count])
+            start += count
+        return views
+
+
+class RamBank:
+    __slots__ = ('memory', 'predecoded', 'fusions', 'block_cache', 'extents', 'heap', 'programs', 'stale',
+                 'image', 'shared_pages')
+
+    def __init__(self, memory, predecoded, fusions, block_cache, extents, heap):
+        self.memory = memory  # array('H') of the bank's words, or a memoryview('H') of a mapped BankImage
+        self.predecoded = predecoded  # Turbo entry for every word of the program area, see Emulator.predecode()
+        self.fusions = fusions  # FusionTable of the bank's program area
+        self.block_cache = block_cache  # BlockCache of translations of the bank's code
+        self.extents = extents  # FreeExtents: the words nothing has been loaded into
+        self.heap = heap  # Heap serving the bank's SYS_MALLOC and SYS_FREE
+        self.programs = {}  # Load address -> (end, name) of the images loaded into the bank
+        self.stale = False  # memory changed without the rest being rebuilt
+        self.image = None  # The BankImage the bank was last shared through
+        self.shared_pages = bytearray(PAGES)  # Bus page -> 1 while it holds the image's words
+
+    def share(self, image):
+        # The bank's words were just written into image: every page is shared
+        self.image = image
+        self.shared_pages = bytearray(b'\x01') * PAGES
+
+    def fork(self, memory):
+        """
+        Make the bank for a forked machine.
+
+        Args:
+            memory (memoryview): The bank's words in a mapping of self.image.
+
+        Returns:
+            RamBank: The new bank, without a block cache, sharing every page
+                with this one; its predecoded entries, fused pairs, allocation
+                state and program list are copies.
+        """
+        bank = RamBank(memory, list(self.predecoded), self.fusions.copy(), None, self.extents.copy(),
+                       self.heap.copy())
+        bank.programs = dict(self.programs)
+        bank.stale = self.stale
+        bank.image = self.image
+        bank.shared_pages = bytearray(self.shared_pages)
+        return bank
+
+    def unshare(self):
+        # All of the bank's words were written other than through the page table
+        self.shared_pages = bytearray(PAGES)
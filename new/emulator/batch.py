@@ -0,0 +1,96 @@
+# batch.py
+
+# Headless batch runs: every .hex image gets its own Emulator in a worker
+# process, with no CLI and no interactive loop. Syscalls are serviced by a
+# HeadlessHost (see host.py) instead of the CLI: SYS_PRINT output is captured,
+# SYS_EXIT ends the run.
+
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from emulator.emulator import Emulator
+from emulator.host import HeadlessHost
+from emulator.hexfile import load_hex_file
+
+DEFAULT_MAX_INSTRUCTIONS = 10_000_000
+ENGINES = ('block', 'turbo')
+
+
+def run_image(filename, max_instructions=DEFAULT_MAX_INSTRUCTIONS, engine='block'):
+    """
+    Load one .hex image into a fresh emulator and run it to completion.
+
+    Args:
+        filename (str): The image to run.
+        max_instructions (int): Give up after this many instructions.
+        engine (str): 'block' for the translation cache, 'turbo' for the quiet interpreter.
+
+    Returns:
+        dict: file, status ('exit', 'halt', 'limit' or 'error'), output,
+            instructions, seconds and, for errors, error.
+    """
+    start = time.perf_counter()
+    host = HeadlessHost()
+    emulator = Emulator(None, trace_size=0)
+    emulator.cli = host
+    executed = 0
+    report = {'file': filename}
+    try:
+        emulator.pc_register = load_hex_file(emulator, filename)
+        emulator.interrupt_flag = False
+        while not emulator.interrupt_flag and not host.exited and executed < max_instructions:
+            if engine == 'turbo':
+                executed += emulator.run_until(max_instructions=max_instructions - executed, stop_on_syscall=True)
+            else:
+                executed += emulator.execute_block()
+            host.service_syscalls()
+        if host.exited:
+            status = 'exit'
+        elif emulator.interrupt_flag:
+            status = 'halt'
+        else:
+            status = 'limit'
+    except Exception as e:
+        status = 'error'
+        report['error'] = f"{type(e).__name__}: {e}"
+    report.update(status=status, output="".join(host.output), instructions=executed,
+                  seconds=time.perf_counter() - start)
+    return report
+
+
+def find_images(directory, pattern="*.hex"):
+    # The images to run, in a stable order
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+def run_farm(filenames, jobs=None, max_instructions=DEFAULT_MAX_INSTRUCTIONS, engine='block'):
+    """
+    Run every image in its own emulator across a pool of worker processes.
+
+    Args:
+        filenames (list): The .hex images to run.
+        jobs (int): Number of worker processes (None for one per CPU).
+        max_instructions (int): Per-image instruction limit.
+        engine (str): The engine every worker uses (see run_image).
+
+    Returns:
+        dict: The report: per-image results in input order plus totals.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(run_image, filenames, [max_instructions] * len(filenames),
+                                [engine] * len(filenames)))
+    seconds = time.perf_counter() - start
+    instructions = sum(result['instructions'] for result in results)
+    return {
+        'jobs': jobs,
+        'engine': engine,
+        'images': len(results),
+        'instructions': instructions,
+        'seconds': seconds,
+        'instructions_per_second': instructions / seconds if seconds else 0,
+        'results': results,
+    }
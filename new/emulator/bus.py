@@ -0,0 +1,215 @@
+# bus.py
+
+# Page-granular memory bus.
+#
+# The 64K word address space is split into PAGES pages of PAGE_WORDS words. The
+# page table (MemoryBus.pages) holds the handler that stores to each page go
+# to, called as handler(emu, address, byte): write_code for the RAM pages of
+# the program area, write_ram for the rest of RAM, write_shared for RAM pages
+# shared with a fork (see banks.py) until they are first written, or the
+# store() of the Device mapped there: ROM, a serial port, later timers and
+# disk controllers.
+# Pages are small because registers are 8 bits wide: LD and ST only reach the
+# first 256 words, so that is where devices have to live.
+#
+# Loads never look at the page table, so plain RAM reads stay a bare index into
+# the selected bank. A device instead publishes the value of each register it
+# has into that register's word, in every RAM bank, whenever the value changes.
+# A store is one indexed call: write_ram is a bare store into the selected
+# bank, write_code also drops translations of the word and decodes it again,
+# and a device's store() goes to its write() and leaves RAM alone. Registers
+# with read side effects are modelled the write-to-acknowledge way.
+#
+# The memory map is part of the machine's configuration, like the EPROM image:
+# snapshots, recordings and the history assume the same map when they are
+# restored.
+
+from array import array
+
+PAGE_SHIFT = 4
+PAGE_WORDS = 1 << PAGE_SHIFT  # 16 words per page
+ADDRESS_WORDS = 65536
+PAGES = ADDRESS_WORDS >> PAGE_SHIFT
+
+
+def write_ram(emu, address, value):
+    # Store handler of a RAM page outside the program area
+    emu.ram_memory[address] = value
+
+
+def write_code(emu, address, value):
+    # Store handler of a RAM page of the program area
+    emu.ram_memory[address] = value
+    if address in emu.block_cache.owners:
+        emu.block_cache.invalidate(address)
+    emu.redecode(address)
+
+
+def write_shared(emu, address, value):
+    # Store handler of a RAM page shared with a fork in at least one bank: the
+    # selected bank's page stops being shared (a fork's mapping copies it on
+    # this write), and the page goes back to its RAM handler once no bank shares it
+    page = address >> PAGE_SHIFT
+    emu.ram_banks[emu.cpu.current_ram_bank].shared_pages[page] = 0
+    bus = emu.bus
+    handler = bus.ram_handler(page)
+    if not any(bank.shared_pages[page] for bank in emu.ram_banks):
+        bus.pages[page] = handler
+    handler(emu, address, value)
+
+
+class Device:
+    # A memory-mapped device, mapped at `base` over `pages` pages
+    name = "device"
+    pages = 1
+
+    def __init__(self):
+        self.bus = None
+        self.base = 0
+
+    def attach(self, bus, base):
+        # Called by MemoryBus.map()
+        self.bus = bus
+        self.base = base
+        self.refresh()
+
+    def refresh(self):
+        # Publish every register's current value (after mapping, or after RAM was replaced)
+        pass
+
+    def write(self, offset, value):
+        # The guest stored value (a byte) at base + offset
+        pass
+
+    def store(self, emu, address, value):
+        # Store handler of the device's pages
+        self.write(address - self.base, value)
+
+    def publish(self, offset, value):
+        # Make value what the guest reads at base + offset
+        self.bus.publish(self.base + offset, value)
+
+    def __getstate__(self):
+        # Copied and pickled without the bus, MemoryBus.map() attaches the copy
+        state = self.__dict__.copy()
+        state['bus'] = None
+        return state
+
+
+class RomPages(Device):
+    # Read-only pages showing part of the EPROM image; stores are ignored
+    name = "rom"
+
+    def __init__(self, eprom, first_word, pages=1):
+        super().__init__()
+        self.eprom = eprom
+        self.first_word = first_word
+        self.pages = pages
+
+    def __getstate__(self):
+        # Only the words shown are kept: the image is read-only, and a mapped one cannot be pickled
+        state = super().__getstate__()
+        state['eprom'] = array('H', self.eprom[self.first_word:self.first_word + self.pages * PAGE_WORDS])
+        state['first_word'] = 0
+        return state
+
+    def refresh(self):
+        words = self.eprom[self.first_word:self.first_word + self.pages * PAGE_WORDS]
+        for offset in range(self.pages * PAGE_WORDS):
+            # Past the end of the image the pages read as 0
+            self.publish(offset, words[offset] if offset < len(words) else 0)
+
+
+class MemoryBus:
+
+    def __init__(self, emu, code_words):
+        self.emu = emu
+        self.code_words = code_words  # Words from address 0 that can hold code
+        code_pages = -(-code_words // PAGE_WORDS)
+        self.pages = [write_code] * code_pages + [write_ram] * (PAGES - code_pages)  # Page -> store handler
+        self.mapped = []  # The devices in the page table, lowest address first
+
+    def ram_handler(self, page):
+        # The store handler of a page of plain RAM
+        return write_code if page << PAGE_SHIFT < self.code_words else write_ram
+
+    def share_ram(self):
+        # Every bank was just shared with a fork: stores to RAM pages go through write_shared
+        pages = [write_shared] * PAGES
+        for device in self.mapped:
+            first = device.base >> PAGE_SHIFT
+            pages[first:first + device.pages] = [device.store] * device.pages
+        self.pages[:] = pages
+
+    def device_at(self, page):
+        # The device mapped over page, or None for RAM
+        for device in self.mapped:
+            if device.base >> PAGE_SHIFT <= page < (device.base >> PAGE_SHIFT) + device.pages:
+                return device
+        return None
+
+    def map(self, page, device):
+        """
+        Map a device over device.pages pages starting at `page`.
+
+        Args:
+            page (int): The first page.
+            device (Device): The device; it is attached and publishes its registers.
+
+        Raises:
+            ValueError: If the pages are outside memory or already mapped to
+                another device.
+        """
+        last = page + device.pages - 1
+        if not 0 <= page <= last < PAGES:
+            raise ValueError(f"Pages 0x{page:03X}-0x{last:03X} are outside memory")
+        for mapped in self.mapped:
+            if mapped.base >> PAGE_SHIFT <= last and page < (mapped.base >> PAGE_SHIFT) + mapped.pages:
+                raise ValueError(f"0x{mapped.base:04X} is already mapped to {mapped.name}")
+        self.pages[page:last + 1] = [device.store] * device.pages
+        # Programs are not loaded over a device
+        for bank in self.emu.ram_banks:
+            bank.extents.reserve(page << PAGE_SHIFT, device.pages * PAGE_WORDS)
+        device.attach(self, page << PAGE_SHIFT)
+        self.mapped.append(device)
+        self.mapped.sort(key=lambda mapped: mapped.base)
+
+    def unmap(self, page):
+        # Return the device's pages to RAM; the words keep the values last published
+        device = self.device_at(page)
+        if device is not None:
+            first = device.base >> PAGE_SHIFT
+            for page in range(first, first + device.pages):
+                shared = any(bank.shared_pages[page] for bank in self.emu.ram_banks)
+                self.pages[page] = write_shared if shared else self.ram_handler(page)
+            self.mapped.remove(device)
+            for bank in self.emu.ram_banks:
+                bank.extents.free(device.base, device.pages * PAGE_WORDS)
+        return device
+
+    def devices(self):
+        # The mapped devices, lowest address first
+        return list(self.mapped)
+
+    def publish(self, address, value):
+        # Set the word every RAM bank reads at address
+        emu = self.emu
+        for bank in emu.ram_banks:
+            memory = bank.memory
+            if memory[address] == value:
+                continue
+            # A page shared with a fork is copied by the write (see banks.py)
+            bank.shared_pages[address >> PAGE_SHIFT] = 0
+            memory[address] = value
+            if memory is emu.ram_memory:
+                # The selected bank: drop translations of the word and decode it again
+                if address in emu.block_cache.owners:
+                    emu.block_cache.invalidate(address)
+                emu.redecode(address)
+            elif address < self.code_words:
+                bank.stale = True
+
+    def refresh(self):
+        # RAM was replaced wholesale: publish every device's registers again
+        for device in self.devices():
+            device.refresh()
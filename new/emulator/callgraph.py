@@ -0,0 +1,129 @@
+# callgraph.py
+
+# Shadow call stack for guest programs, kept while the profiler runs.
+#
+# There is no call instruction; calls and returns are recognised from the way
+# programs use the link register:
+#
+#   JMP target            LR = address of the JMP; execution continues at target + 1,
+#                         the entry point of the called routine
+#   POP with bit 4 set    PC = LR, execution continues after the JMP that called
+#   (bit 7 clear)
+#
+# JMP is also the only unconditional jump, so a JMP back to a routine already
+# on the stack (a loop, or recursion) unwinds to that frame instead of pushing
+# a new one, and a return pops to the frame whose JMP it returns to. That keeps
+# the stack bounded whatever the program does.
+#
+# Instructions are attributed to the stack of routine entry points they ran
+# under. collapsed() gives the 'caller;callee count' lines that flamegraph.pl and
+# speedscope read; routines() gives inclusive and exclusive counts per routine.
+
+OP_JMP = 0x5
+OP_POP = 0xF
+MAX_DEPTH = 256  # Deeper calls are attributed to the deepest frame kept
+
+
+class CallGraph:
+
+    def __init__(self, symbols=None):
+        self.symbols = symbols if symbols is not None else {}  # Entry address -> label
+        self.entries = []  # Routine entry point of each frame, outermost first
+        self.returns = []  # LR value that returns from each frame
+        self.path = ()  # tuple(self.entries), the key counts are attributed to
+        self.counts = {}  # Stack path -> instructions executed with exactly that stack
+
+    def start(self, pc):
+        # Open the root frame at pc if nothing is running yet
+        if not self.entries:
+            self.entries.append(pc)
+            self.returns.append(None)
+            self.path = (pc,)
+
+    def add(self, count):
+        # Attribute count instructions to the current stack
+        if count:
+            self.counts[self.path] = self.counts.get(self.path, 0) + count
+
+    def call(self, target, return_address):
+        # A JMP to target ran at return_address
+        entry = target + 1
+        entries = self.entries
+        if entry in entries:
+            # Back to a routine already on the stack: a loop or recursion
+            del entries[entries.index(entry) + 1:]
+            del self.returns[len(entries):]
+        elif len(entries) < MAX_DEPTH:
+            entries.append(entry)
+            self.returns.append(return_address)
+        self.path = tuple(entries)
+
+    def ret(self, return_address):
+        # A POP through LR returned to the JMP at return_address
+        returns = self.returns
+        if len(returns) < 2:
+            return
+        depth = len(returns) - 1
+        # Unwind to the frame this return belongs to, or just the top one
+        while depth > 1 and returns[depth] != return_address:
+            depth -= 1
+        if returns[depth] != return_address:
+            depth = len(returns) - 1
+        del self.entries[depth:]
+        del returns[depth:]
+        self.path = tuple(self.entries)
+
+    def step(self, instruction, pc, new_pc):
+        # Account for one instruction run outside run_profiled(); new_pc is the PC it left
+        self.start(pc)
+        self.add(1)
+        opcode = instruction >> 12
+        if opcode == OP_JMP:
+            self.call(new_pc, pc)
+        elif opcode == OP_POP and instruction & 0x90 == 0x10:
+            self.ret(new_pc)
+
+    def reset(self):
+        self.entries.clear()
+        self.returns.clear()
+        self.path = ()
+        self.counts.clear()
+
+    def name(self, entry):
+        # The label at a routine's entry point, or its address
+        return self.symbols.get(entry, f"0x{entry:04X}")
+
+    def collapsed(self):
+        """
+        Render the samples in collapsed-stack form.
+
+        Returns:
+            list: 'outer;inner;leaf count' lines, heaviest stack first.
+        """
+        lines = []
+        for path, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+            lines.append(";".join(self.name(entry) for entry in path) + f" {count}")
+        return lines
+
+    def routines(self):
+        """
+        Total the instruction counts per routine.
+
+        Returns:
+            dict: Routine name -> (inclusive, exclusive) instruction counts.
+        """
+        inclusive = {}
+        exclusive = {}
+        for path, count in self.counts.items():
+            for entry in set(path):
+                inclusive[entry] = inclusive.get(entry, 0) + count
+            exclusive[path[-1]] = exclusive.get(path[-1], 0) + count
+        return {self.name(entry): (inclusive[entry], exclusive.get(entry, 0)) for entry in inclusive}
+
+    def export(self, filename):
+        # Write the collapsed stacks to filename; returns the number of lines written
+        lines = self.collapsed()
+        with open(filename, "w") as f:
+            for line in lines:
+                f.write(line + "\n")
+        return len(lines)
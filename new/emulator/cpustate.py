@@ -0,0 +1,114 @@
+# cpustate.py
+
+# Compact CPU state.
+#
+# Everything that describes the processor (registers, SP, PC, flags, halt flag
+# and bank selection) lives in one CPUState object with __slots__, so there is
+# no per-instance dict and the hot loops reach each field with a slot lookup.
+# A state packs into a fixed 80-byte record (STATE_FORMAT), which is what
+# snapshots, comparisons and restores work with.
+
+import struct
+
+from emulator.flags import carry_and_overflow, CLEAR_FLAGS, FLAGS_FIXED
+
+# R0-R3 and LR, SP, PC, the current RAM bank and boot EPROM bank, then the
+# zero, carry, overflow and interrupt flags
+STATE_FORMAT = struct.Struct('<5qqqqq4?4x')
+STATE_SIZE = STATE_FORMAT.size
+
+
+class CPUState:
+    __slots__ = ('registers', 'sp_register', 'pc_register', '_zero_result', '_cv_source',
+                 'interrupt_flag', 'current_ram_bank', 'boot_eprom_bank')
+
+    def __init__(self):
+        self.registers = [0] * 5  # General-purpose registers (R0, R1, R2, R3, LR)
+        self.sp_register = 0xFFFF  # Stack Pointer starts at the top of RAM
+        self.pc_register = 0x0000
+        # Flags are evaluated lazily (see flags.py), these start them all cleared
+        self._zero_result = 1  # Zero flag is set when this value is 0
+        self._cv_source = CLEAR_FLAGS  # Last operation that set the carry and overflow flags
+        self.interrupt_flag = True  # Start halted
+        self.current_ram_bank = 0
+        self.boot_eprom_bank = 60
+
+    @property
+    def zero_flag(self):
+        return self._zero_result == 0
+
+    @zero_flag.setter
+    def zero_flag(self, value):
+        self._zero_result = 0 if value else 1
+
+    @property
+    def carry_flag(self):
+        return carry_and_overflow(self._cv_source)[0]
+
+    @carry_flag.setter
+    def carry_flag(self, value):
+        self._cv_source = (FLAGS_FIXED, value, self.overflow_flag)
+
+    @property
+    def overflow_flag(self):
+        return carry_and_overflow(self._cv_source)[1]
+
+    @overflow_flag.setter
+    def overflow_flag(self, value):
+        self._cv_source = (FLAGS_FIXED, self.carry_flag, value)
+
+    def to_bytes(self):
+        """
+        Pack the state into a STATE_SIZE byte record.
+
+        Lazy flags are materialised, so two states that would behave the same
+        pack to the same bytes.
+
+        Returns:
+            bytes: The packed state.
+        """
+        carry, overflow = carry_and_overflow(self._cv_source)
+        return STATE_FORMAT.pack(*self.registers, self.sp_register, self.pc_register,
+                                 self.current_ram_bank, self.boot_eprom_bank,
+                                 self._zero_result == 0, carry, overflow, self.interrupt_flag)
+
+    def load_bytes(self, data, offset=0):
+        """
+        Restore the state in place from a record made by to_bytes().
+
+        Args:
+            data (bytes-like): Buffer holding the record (bytes, bytearray or memoryview).
+            offset (int): Where the record starts in data.
+        """
+        (r0, r1, r2, r3, lr, self.sp_register, self.pc_register, self.current_ram_bank,
+         self.boot_eprom_bank, zero, carry, overflow, self.interrupt_flag) = STATE_FORMAT.unpack_from(data, offset)
+        # Keep the same list object, the CLI and engines may hold a reference to it
+        self.registers[:] = (r0, r1, r2, r3, lr)
+        self._zero_result = 0 if zero else 1
+        self._cv_source = (FLAGS_FIXED, carry, overflow)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        # Build a new state from a packed record
+        state = cls()
+        state.load_bytes(data, offset)
+        return state
+
+    def copy(self):
+        state = CPUState()
+        state.registers = list(self.registers)
+        state.sp_register = self.sp_register
+        state.pc_register = self.pc_register
+        state._zero_result = self._zero_result
+        state._cv_source = self._cv_source
+        state.interrupt_flag = self.interrupt_flag
+        state.current_ram_bank = self.current_ram_bank
+        state.boot_eprom_bank = self.boot_eprom_bank
+        return state
+
+    def __eq__(self, other):
+        if not isinstance(other, CPUState):
+            return NotImplemented
+        return self.to_bytes() == other.to_bytes()
+
+    __hash__ = None  # Mutable, compare to_bytes() results instead
@@ -0,0 +1,39 @@
+# decoder.py
+
+# Instruction word layout (16 bits):
+#   bits 15-12  opcode
+#   bits 11-10  Rd (destination register)
+#   bits  9-8   Rn (source register)
+#   bits  7-0   operands (immediate value, address or register mask)
+
+INSTRUCTION_WORDS = 65536  # Every possible 16-bit instruction word
+
+
+def decode(instruction):
+    # Split an instruction word into its opcode, Rd, Rn and operands fields
+    opcode = (instruction >> 12) & 0xF  # Extract the opcode (4 bits)
+    registers = (instruction >> 8) & 0xF  # Extract the register bits (4 bits)
+    operands = instruction & 0xFF  # Extract the operands (8 bits)
+
+    # Extract Rd and Rn from the registers field (2 bits each)
+    Rd = (registers >> 2) & 0x3
+    Rn = registers & 0x3
+    return opcode, Rd, Rn, operands
+
+
+def build_decode_table(handlers):
+    """
+    Precompute the decoded form of every 16-bit instruction word.
+
+    Args:
+        handlers (sequence): 16 handlers indexed by opcode. Each one is called
+            as handler(emulator, Rd, Rn, operands).
+
+    Returns:
+        list: 65536 (handler, Rd, Rn, operands) tuples indexed by instruction word.
+    """
+    table = []
+    for instruction in range(INSTRUCTION_WORDS):
+        opcode, Rd, Rn, operands = decode(instruction)
+        table.append((handlers[opcode], Rd, Rn, operands))
+    return table
@@ -0,0 +1,67 @@
+# devices.py
+
+# Memory-mapped devices for the bus (see bus.py).
+#
+# SerialPort is the computer's serial output interface, 8N1 at no particular
+# baud rate, with no flow control:
+#
+#   base + SERIAL_DATA     write a byte to send it
+#   base + SERIAL_STATUS   reads SERIAL_READY (bit 0) when a byte can be sent,
+#                          which is always
+#
+# Bytes are sent to whoever services the emulator's syscalls, the CLI or a
+# HeadlessHost (see host.py), as SYS_PRINT output.
+#
+# Memory map changes reach the emulator thread as INPUT_MAP inputs, which
+# recordings keep as two numbers: the page, and one of the MAP_* codes below
+# for what goes there.
+
+from emulator.bus import Device, RomPages, PAGE_SHIFT
+from emulator.syscalls import SYS_PRINT
+
+SERIAL_DATA = 0
+SERIAL_STATUS = 1
+SERIAL_READY = 0x01
+
+MAP_RAM = 0  # Unmap the device there; the pages are RAM again
+MAP_SERIAL = 1  # A SerialPort
+MAP_ROM = 2  # MAP_ROM + n: a page of ROM showing EPROM page n
+
+
+class SerialPort(Device):
+    name = "serial"
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0  # Bytes sent since the port was made
+
+    def refresh(self):
+        self.publish(SERIAL_STATUS, SERIAL_READY)
+
+    def write(self, offset, value):
+        if offset == SERIAL_DATA:
+            # SYS_PRINT output is unescaped by the host, so escape the byte first
+            text = chr(value).encode('unicode_escape').decode()
+            self.bus.emu.host_call(SYS_PRINT, text)
+            self.sent += 1
+
+
+def make_device(emu, code):
+    """
+    Make the device a MAP_* code stands for.
+
+    Args:
+        emu (Emulator): The machine it is for.
+        code (int): MAP_SERIAL, or MAP_ROM plus an EPROM page.
+
+    Returns:
+        Device: The device, not yet mapped.
+
+    Raises:
+        ValueError: If the code names no device (MAP_RAM does not).
+    """
+    if code == MAP_SERIAL:
+        return SerialPort()
+    if code >= MAP_ROM:
+        return RomPages(emu.eprom_memory, (code - MAP_ROM) << PAGE_SHIFT)
+    raise ValueError(f"No device for map code {code}")
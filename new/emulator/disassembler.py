@@ -0,0 +1,51 @@
+# disassembler.py
+
+# Turns instruction words back into assembler source, in the syntax that
+# assembler4emulator_v8.1.py accepts: registers as r0-r3, immediates as
+# '#0x..', branch targets as '#..' in hex and register lists as '{r0, lr}'.
+
+from emulator.decoder import decode
+
+MNEMONICS = ('ld', 'li', 'st', 'add', 'sub', 'jmp', 'beq', 'bne',
+             'cmp', 'and', 'or', 'xor', 'shl', 'shr', 'push', 'pop')
+
+# Register list bits used by push and pop
+REGISTER_LIST = ((0x01, 'r0'), (0x02, 'r1'), (0x04, 'r2'), (0x08, 'r3'), (0x10, 'lr'))
+
+
+def register_list(mask):
+    # '{r0, r2, lr}' for the registers whose bits are set in mask
+    return "{" + ", ".join(name for bit, name in REGISTER_LIST if mask & bit) + "}"
+
+
+def disassemble(instruction):
+    """
+    Disassemble one instruction word.
+
+    Args:
+        instruction (int): The 16-bit instruction word.
+
+    Returns:
+        str: The instruction as assembler source, e.g. 'add r1, r1, #0x01'.
+    """
+    opcode, Rd, Rn, operands = decode(instruction)
+    mnemonic = MNEMONICS[opcode]
+    if mnemonic in ('ld', 'st'):
+        return f"{mnemonic} r{Rd}, [r{Rn}]"
+    if mnemonic == 'li':
+        return f"li r{Rd}, #0x{operands:02x}"
+    if mnemonic in ('add', 'sub', 'shl', 'shr'):
+        return f"{mnemonic} r{Rd}, r{Rn}, #0x{operands:02x}"
+    if mnemonic in ('jmp', 'beq', 'bne'):
+        return f"{mnemonic} #{operands:02x}"
+    if mnemonic == 'cmp':
+        if Rd == 0 and Rn == 0:
+            return f"cmp r0, #0x{operands:02x}"
+        return f"cmp r{Rd}, r{Rn}"
+    if mnemonic in ('and', 'or', 'xor'):
+        if Rn == 0:
+            return f"{mnemonic} r{Rd}, #0x{operands:02x}"
+        return f"{mnemonic} r{Rd}, r{Rn}"
+    if mnemonic == 'pop' and operands & 0x80:
+        return f"syscall {operands & 0x7F}"
+    return f"{mnemonic} {register_list(operands)}"
@@ -6,135 +6,578 @@ import sys
 import logging
 import threading
 import signal
+import copy
 import queue  # Import the queue module
+import zlib
+from concurrent.futures import Future
+from array import array
+from operator import attrgetter
 from utils import logger
+from emulator.decoder import build_decode_table
+from emulator.translator import BlockCache
+from emulator.turbo import TURBO_DECODE_TABLE, load, store
+from emulator.alu import get_alu_decode_table, get_alu_tables
+from emulator.cpustate import CPUState
+from emulator.banks import BankImage, RamBank, RAM_BANKS
+from emulator.extents import FreeExtents
+from emulator.heap import Heap, DEFAULT_HEAP_BASE, DEFAULT_HEAP_WORDS
+from emulator.bus import MemoryBus, PAGE_SHIFT
+from emulator.snapshot import take_snapshot, restore_snapshot, save_snapshot
+from emulator.fusion import FusionTable, FUSED, OP_BEQ, OP_BNE
+from emulator.trace import TraceBuffer, DEFAULT_TRACE_SIZE
+from emulator.profiler import Profiler
+from emulator.callgraph import OP_JMP, OP_POP
+from emulator.flags import FLAGS_ADD, FLAGS_SUB, FLAGS_CMP, FLAGS_SHL, FLAGS_SHR
+from emulator.syscalls import SYS_PRINT, SYS_EXIT, SYS_UNAME, SYS_BANK, SYS_MALLOC, SYS_FREE, VERSION
+from emulator.host import HeadlessHost
+from emulator.eprom import open_eprom_image
+from emulator.hexfile import load_hex_image
+from emulator.devices import MAP_RAM, make_device
 
 
-# Define system call constants as class attributes
-SYS_PRINT = 1
-SYS_EXIT = 0
+END_MARKER_ADDRESS = 0xFF # Define an address as the end marker
+BOOT_PROGRAM = "boot" # Name the boot block is listed under in Emulator.programs
+RAM_WORDS = 65536 # 64K words of RAM
+DEFAULT_QUANTUM = 10000 # Instructions executed between checks of the exit event
+TRACE_CRASH_FILE = "emtrace-crash.txt" # Where the trace goes when the emulator thread crashes
+
+# Inputs from outside the guest, applied by the emulator thread between quanta (see post_input)
+INPUT_STORE = 1  # Poke: a = address, b = value (a 16-bit word; post_input() masks it)
+INPUT_PC = 2  # Set the PC: a = address
+INPUT_RESUME = 3  # Clear the halt
+INPUT_RESULT = 4  # Result handed back to the guest: a = register, b = value
+INPUT_RECORD = 5  # Start recording to a = replay.Recorder, or stop when a is None (not recorded)
+INPUT_STEP = 6  # Run a instructions, then halt
+INPUT_HALT = 7  # Halted by the debugger (a breakpoint or the end of a step); logged, never posted
+INPUT_BACK = 8  # Go back a instructions through the history (see history.py; not recorded)
+INPUT_REVERSE = 9  # Go back to the last breakpoint hit (see history.py; not recorded)
+INPUT_BANK = 10  # Select RAM bank a
+INPUT_SAVE = 11  # Save a snapshot to file a (not recorded)
+INPUT_RESTORE = 12  # Restore snapshot a, uncompressed bytes (not recorded; the history starts again)
+INPUT_LOAD = 13  # Load a = hexfile.HexImage into the selected bank; recorded with the image
+INPUT_FREE = 14  # Give b words from address a back to the selected bank's free extents
+INPUT_MAP = 15  # Map device b (a devices.MAP_* code) at page a (the history starts again)
+INPUT_HEAP = 16  # Move the selected bank's heap to b words from address a (see set_heap)
+
+
+def cpu_field(name):
+    # An Emulator attribute that is stored on its CPUState
+    def set_field(self, value):
+        setattr(self.cpu, name, value)
+    return property(attrgetter(f"cpu.{name}"), set_field)
 
-# File I/O
-SYS_OPEN = 2
-SYS_READ = 3
-SYS_WRITE = 4
-SYS_CLOSE = 5
-SYS_SEEK = 8
 
-# Memory Management
-SYS_MALLOC = 92
-SYS_FREE = 93
+class Emulator:
 
-# Time and Date
-SYS_GETTIMEOFDAY = 96
-SYS_SLEEP = 11
+    # CPU state lives in self.cpu (see cpustate.py); these keep the old attribute names
+    registers = cpu_field('registers')
+    sp_register = cpu_field('sp_register')
+    pc_register = cpu_field('pc_register')
+    _zero_result = cpu_field('_zero_result')
+    _cv_source = cpu_field('_cv_source')
+    interrupt_flag = cpu_field('interrupt_flag')
+    current_ram_bank = property(attrgetter('cpu.current_ram_bank'))  # Changed by select_ram_bank()
+    boot_eprom_bank = cpu_field('boot_eprom_bank')
+    zero_flag = cpu_field('zero_flag')
+    carry_flag = cpu_field('carry_flag')
+    overflow_flag = cpu_field('overflow_flag')
+
+    def __init__(self, cli, turbo=False, quantum=DEFAULT_QUANTUM, alu_tables=False,
+                 trace_size=DEFAULT_TRACE_SIZE, trace_file=None, debug=False, ram_banks=None, cpu=None):
+        self.exit_event = threading.Event()  # Event to signal emulator to exit
+        self.wake_event = threading.Event()  # Event that wakes the halted emulator thread
+        self.cli = HeadlessHost()  # Services the syscalls (see host.py), until a CommandLineInterface takes over
 
-# File and Directory Operations
-SYS_MKDIR = 83
-SYS_RMDIR = 84
-SYS_RENAME = 82
 
-# System Information
-SYS_UNAME = 63
+        # Memory Data Structures: unsigned 16-bit words in flat typed arrays, so
+        # bulk copies (loading, snapshots, string reads) are slice copies in C.
+        # The EPROM is a read-only mapped image (see eprom.py), empty until one is attached
+        self.eprom_memory = memoryview(array('H'))
+        self.eprom_file = None  # Absolute path of the image file, if it was mapped from one
 
-END_MARKER_ADDRESS = 0xFF # Define an address as the end marker
+        # CPU registers, flags and bank selection; the emulator starts halted
+        self.cpu = CPUState() if cpu is None else cpu
+        #self.icr_register = 0x0000  # Initialize interrupt control register, or ICR to 0x0000
 
-class Emulator:
+        self.turbo_table = TURBO_DECODE_TABLE
+
+        # Page table of the devices mapped over RAM (see bus.py); all RAM to start with
+        self.bus = MemoryBus(self, END_MARKER_ADDRESS + 1)
+
+        # RAM banks (see banks.py), each with its own predecoded entries, fused
+        # pairs, translated blocks, free extents, heap and loaded programs;
+        # select_ram_bank() maps one in as ram_memory (64KB of RAM), predecoded,
+        # fusions, block_cache, extents, heap and programs. fork() hands in the
+        # banks (and CPU state) of the machine it copies
+        if ram_banks is None:
+            ram_banks = [self.new_ram_bank() for _ in range(RAM_BANKS)]
+        for bank in ram_banks:
+            if bank.block_cache is None:
+                bank.block_cache = BlockCache(self, END_MARKER_ADDRESS)
+        self.ram_banks = ram_banks
+        self.select_ram_bank(self.cpu.current_ram_bank)
+
+        # Translated basic blocks are used by execute_block() when block_engine is enabled
+        self.block_engine = False
+
+        # Per-instruction logging interpreter, toggled by the CLI 'log' command
+        self.logging_enabled = debug
+
+        # Ring buffer of the last instructions run; turbo mode runs without it
+        self.trace = TraceBuffer(trace_size) if trace_size and not turbo else None
+        self.trace_file = trace_file  # Dump the trace here whenever the program halts
+
+        # Per-address and per-opcode execution counts, collected while profiling is enabled
+        self.profiler = None
+        self.profiling = False
+        self.symbols = {}  # Routine entry address -> assembler label, from the loaded .sym files
+
+        # Precomputed 8-bit ALU tables shared by the turbo and block engines (see alu.py)
+        self.alu_tables = None
+        if alu_tables:
+            self.use_alu_tables()
+
+        # Instructions run per scheduling quantum; stop() and Ctrl+C are seen within one quantum
+        if quantum < 1:
+            # A quantum of 0 would never run anything, and a negative one never stops
+            raise ValueError(f"Quantum must be at least 1 instruction, not {quantum}")
+        self.quantum = quantum
+
+        # Instructions executed by run(); inputs are logged against this count
+        self.instruction_count = 0
+        # Inputs posted by other threads, and the recorder logging them (see replay.py)
+        self.inputs = queue.SimpleQueue()
+        self.inputs_lock = threading.Lock()
+        self.recorder = None
+        # Periodic checkpoints for going backwards (see history.py)
+        self.history = None
+
+        # Debugging: breakpoint addresses, instructions left to step, and the
+        # breakpoint being resumed from, which runs once instead of stopping again
+        self.breakpoints = set()
+        self.step_remaining = 0
+        self.breakpoint_pass = None
+        self.debugger_stop = False  # The last quantum ended at a breakpoint or the end of a step
+        self.halted_event = threading.Event()  # Set while halted with every posted input applied
+
+    def use_alu_tables(self):
+        # Switch the turbo and block engines to the precomputed ALU tables
+        self.alu_tables = get_alu_tables()
+        self.turbo_table = get_alu_decode_table()
+        # Blocks and predecoded entries made without the tables are rebuilt, other banks' when selected
+        for bank in self.ram_banks:
+            bank.stale = True
+        self.select_ram_bank(self.current_ram_bank)
+
+    def new_ram_bank(self):
+        # An all-zero RAM bank, free but for its empty heap; zero words decode to
+        # LD and never fuse, so it needs no scan
+        extents = FreeExtents(RAM_WORDS)
+        extents.reserve(DEFAULT_HEAP_BASE, DEFAULT_HEAP_WORDS)
+        return RamBank(array('H', bytes(2 * RAM_WORDS)), [self.turbo_table[0]] * (END_MARKER_ADDRESS + 1),
+                       FusionTable(END_MARKER_ADDRESS), BlockCache(self, END_MARKER_ADDRESS),
+                       extents, Heap(DEFAULT_HEAP_BASE, DEFAULT_HEAP_WORDS))
+
+    def select_ram_bank(self, bank):
+        """
+        Map a RAM bank into the address space.
 
-    def __init__(self, cli):
-        self.exit_event = threading.Event()  # Event to signal emulator to exit
-        self.cli = None  # Store a reference to the CommandLineInterface instance
+        Only references are swapped: the bank's memory, predecoded entries, fused
+        pairs, translated blocks, free extents, heap and loaded programs become
+        the emulator's. The run loops pick the new bank up right after the
+        syscall that switched it.
 
+        Args:
+            bank (int): The bank, 0 to RAM_BANKS - 1.
 
-        # Memory Data Structures
-        self.ram_memory = [0x0000] * 65536 # Initialize with zeros (64KB of RAM)
-        self.eprom_memory = [0] * 4096  # 4KB of EPROM
+        Raises:
+            ValueError: If there is no such bank.
+        """
+        if not 0 <= bank < len(self.ram_banks):
+            raise ValueError(f"No RAM bank {bank}")
+        ram_bank = self.ram_banks[bank]
+        self.cpu.current_ram_bank = bank
+        self.ram_memory = ram_bank.memory
+        self.predecoded = ram_bank.predecoded
+        self.fusions = ram_bank.fusions
+        self.block_cache = ram_bank.block_cache
+        self.extents = ram_bank.extents
+        self.heap = ram_bank.heap
+        self.programs = ram_bank.programs
+        if ram_bank.stale:
+            ram_bank.stale = False
+            self.image_loaded()
+
+    def attach_eprom(self, words, filename=None):
+        # Use an image from eprom.open_eprom_image() as the EPROM; nothing is copied.
+        # With the file it was mapped from, pickling passes the path, not the words
+        self.eprom_memory = words
+        self.eprom_file = os.path.abspath(filename) if filename is not None else None
+
+    def boot(self):
+        # Copy the EPROM's boot block into the program area of RAM and run it from address 0
+        boot_words = min(len(self.eprom_memory), END_MARKER_ADDRESS + 1)
+        memoryview(self.ram_memory)[:boot_words] = self.eprom_memory[:boot_words]
+        self.extents.reserve(0, boot_words)
+        if boot_words:
+            self.programs[0] = (boot_words, BOOT_PROGRAM)
+        self.image_loaded()
+        self.pc_register = 0
+        self.interrupt_flag = False
+
+    def boot_block_words(self):
+        # Words of the boot block still loaded at address 0, or 0 once a program replaced it
+        boot = self.programs.get(0)
+        return boot[0] if boot is not None and boot[1] == BOOT_PROGRAM else 0
+
+    def release_boot_block(self):
+        # A program is being loaded to take over from the boot block: its words go back
+        # to the free extents, so the program area is loadable again
+        words = self.boot_block_words()
+        if words:
+            self.free_memory(0, words)
+
+    def set_heap(self, base, words):
+        """
+        Replace the selected bank's heap with an empty one over a new region.
 
-        # Bank Selection
-        self.current_ram_bank = 0  # Initialize to the first RAM bank
-        self.boot_eprom_bank = 60   # Set to the boot EPROM bank during bootup
+        The old region goes back to the bank's free extents and the new one is
+        reserved from them. Blocks still allocated in the old heap are dropped;
+        its statistics are kept.
 
-        # CPU Registers
-        self.registers = [0] * 5  # General-purpose registers (R0, R1, R2, R3, LR)
-        self.sp_register = 0xFFFF  # Initialize Stack Pointer to 0xFFFF
-        self.pc_register = 0x0000  # Initialize Program Counter to 0x0000
-        #self.icr_register = 0x0000  # Initialize interrupt control register, or ICR to 0x0000
+        Args:
+            base (int): The first word of the region, not 0 (SYS_MALLOC's failure value).
+            words (int): The region's size in words.
+
+        Raises:
+            ValueError: If the region is empty, starts at 0 or runs past the end of RAM.
+        """
+        if base == 0:
+            raise ValueError("The heap cannot start at 0x0000, SYS_MALLOC's failure value")
+        if words <= 0 or not 0 < base <= base + words <= RAM_WORDS:
+            raise ValueError(f"Heap of {words} words at 0x{base:04X} does not fit in RAM")
+        heap = self.heap
+        self.extents.free(heap.base, heap.words)
+        self.extents.reserve(base, words)
+        heap.reset(base, words)
+
+    def program_at(self, address):
+        # The load address of the program in the selected bank holding address, or address itself
+        for start, (end, _) in self.programs.items():
+            if start <= address < end:
+                return start
+        return address
+
+    def image_loaded(self):
+        # RAM was replaced wholesale: no page is the one a fork shares any more; put
+        # the devices' registers back, drop stale translations, find fusable pairs
+        # and predecode
+        self.ram_banks[self.cpu.current_ram_bank].unshare()
+        self.bus.refresh()
+        self.block_cache.clear()
+        self.fusions.scan(self.ram_memory)
+        self.predecode()
+
+    def predecode(self):
+        # Decode every word of the program area once, with fused pairs in place of
+        # their first instruction; nothing above END_MARKER_ADDRESS is ever run twice
+        predecoded = self.predecoded
+        # Filled in place, run_until() may be holding the list
+        predecoded[:] = map(self.turbo_table.__getitem__, self.ram_memory[:END_MARKER_ADDRESS + 1])
+        for address, handler in self.fusions.handlers.items():
+            predecoded[address] = (handler, FUSED, 0, 0)
+
+    def redecode(self, address):
+        # One RAM word changed: decode it again and break the fused pairs covering it
+        if address <= END_MARKER_ADDRESS:
+            predecoded = self.predecoded
+            memory = self.ram_memory
+            table = self.turbo_table
+            predecoded[address] = table[memory[address]]
+            for start in self.fusions.invalidate(address):
+                predecoded[start] = table[memory[start]]
+
+    def enable_profiler(self):
+        # Start counting executions; the counters survive disable_profiler() until reset
+        if self.profiler is None:
+            self.profiler = Profiler(len(self.ram_memory), self.symbols)
+        self.profiling = True
+
+    def disable_profiler(self):
+        self.profiling = False
+
+    def post_input(self, kind, a=0, b=0):
+        """
+        Hand the emulator an input from outside the guest program.
+
+        Inputs are applied by the emulator thread between quanta, never in the
+        middle of one, so each lands at an exact instruction count and a recording
+        of them replays the run exactly.
+
+        Args:
+            kind (int): One of the INPUT_ constants.
+            a (int): First argument, as described by the constant.
+            b (int): Second argument, as described by the constant.
+
+        Returns:
+            Future: Done once the input was applied, with the result or the
+                exception applying it gave.
+        """
+        if kind == INPUT_STORE:
+            # Stores keep a word's worth, which is also what a recording has room for
+            b &= 0xFFFF
+        done = Future()
+        with self.inputs_lock:
+            self.halted_event.clear()
+            self.inputs.put((kind, a, b, done))
+        # Wake the thread in case it is waiting while halted
+        self.wake_event.set()
+        return done
+
+    def wait_until_halted(self, timeout=None):
+        """
+        Wait for the emulator thread to apply every posted input and halt again.
+
+        Args:
+            timeout (float): Give up after this many seconds (None to wait for ever).
 
-        # Flags
-        self.zero_flag = False
-        self.overflow_flag = False
-        self.carry_flag = False
-        # Initialize the emulator in a halted state
+        Returns:
+            bool: True once halted, False on timeout.
+        """
+        return self.halted_event.wait(timeout)
+
+    def apply_inputs(self):
+        # Apply the posted inputs, logging them if a recording is running
+        inputs = self.inputs
+        while not inputs.empty():
+            kind, a, b, done = inputs.get()
+            result = None
+            try:
+                if kind == INPUT_RECORD:
+                    if self.recorder is not None:
+                        self.recorder.stop(self)
+                    self.recorder = a
+                    if a is not None:
+                        a.start(self)
+                elif kind == INPUT_BACK or kind == INPUT_REVERSE:
+                    if self.history is not None:
+                        if kind == INPUT_BACK:
+                            self.history.back(a)
+                        else:
+                            self.history.reverse_continue()
+                elif kind == INPUT_SAVE:
+                    save_snapshot(self, a)
+                elif kind == INPUT_RESTORE:
+                    restore_snapshot(self, a)
+                    # Whatever was being stepped or resumed belongs to the old state
+                    self.step_remaining = 0
+                    self.breakpoint_pass = None
+                    if self.history is not None:
+                        self.history.reset()
+                else:
+                    # Logged once applied, so an input that fails is not replayed
+                    result = self.apply_input(kind, a, b)
+                    self.log_input(kind, a, b)
+                    if kind == INPUT_MAP and self.history is not None:
+                        # Snapshots do not hold the memory map, so the history cannot go back across it
+                        self.history.reset()
+            except Exception as e:
+                # A bad input is dropped; it must not take the emulator thread down
+                logging.error(f"Input {kind} failed", exc_info=True)
+                done.set_exception(e)
+            else:
+                done.set_result(result)
+
+    def log_input(self, kind, a=0, b=0):
+        # Keep an input for the recording and the history, at the current instruction count
+        if self.recorder is not None:
+            self.recorder.log(self.instruction_count, kind, a, b)
+        if self.history is not None:
+            self.history.log(self.instruction_count, kind, a, b)
+
+    def apply_input(self, kind, a, b):
+        # Make one input's change to the machine; a load returns the address it loaded at,
+        # a map the device mapped or, for MAP_RAM, the one unmapped (None if there was none)
+        if kind == INPUT_STORE:
+            # Quietly, a replay must not print
+            store(self, a, b)
+        elif kind == INPUT_PC:
+            self.pc_register = a
+        elif kind == INPUT_RESUME:
+            self.interrupt_flag = False
+            self.breakpoint_pass = self.pc_register
+        elif kind == INPUT_RESULT:
+            self.registers[a] = b
+        elif kind == INPUT_STEP:
+            self.step_remaining = a
+            self.interrupt_flag = False
+            self.breakpoint_pass = self.pc_register
+        elif kind == INPUT_HALT:
+            self.interrupt_flag = True
+        elif kind == INPUT_BANK:
+            self.select_ram_bank(a)
+        elif kind == INPUT_LOAD:
+            return load_hex_image(self, a)
+        elif kind == INPUT_FREE:
+            self.free_memory(a, b)
+        elif kind == INPUT_MAP:
+            if b == MAP_RAM:
+                return self.bus.unmap(a)
+            device = make_device(self, b)
+            self.bus.map(a, device)
+            return device
+        elif kind == INPUT_HEAP:
+            self.set_heap(a, b)
+
+    def stop_for_debugger(self):
+        # Halt at a breakpoint or at the end of a step
         self.interrupt_flag = True
+        self.debugger_stop = True
+        self.step_remaining = 0
 
-        # Define a dictionary that maps opcodes to their corresponding functions
-        self.instruction_set = {
-            '0000': self.load_data,       # LD
-            '0001': self.load_immediate, # LI
-            '0010': self.store_data,     # ST
-            '0011': self.add,            # ADD
-            '0100': self.subtract,       # SUB
-            '0101': self.jump,           # JMP
-            '0110': self.branch_equal,   # BEQ
-            '0111': self.branch_not_equal, # BNE
-            '1000': self.compare,        # CMP
-            '1001': self.logical_and,    # AND
-            '1010': self.logical_or,     # OR
-            '1011': self.logical_xor,    # XOR
-            '1100': self.shift_left,     # SHL
-            '1101': self.shift_right,    # SHR
-            '1110': self.push,           # PUSH
-            '1111': self.pop             # POP
+    def snapshot(self):
+        # Capture CPU state and RAM as one bytes object (see snapshot.py)
+        return take_snapshot(self)
+
+    def fork(self):
+        """
+        Make a new machine in this one's state, for fuzzing and what-if runs.
+
+        The child shares the words of every RAM bank page by page, copy-on-write
+        (see banks.py): they are written once into an image that the child
+        maps, or not at all if this machine has not written to RAM since its
+        last fork, and either machine only copies the pages it writes to. The
+        program area's decoded entries are copied. The child has
+        the same CPU state, allocation state, EPROM, memory map, decode tables,
+        breakpoints and engine settings, its own copies of the devices, a
+        HeadlessHost of its own (see host.py) for syscalls and device output,
+        and no trace, profiler, history or recording. It can be run in this
+        process, in a thread of its own, or pickled to a worker process.
+
+        Call it while the machine is not running: halted, or from the emulator
+        thread between quanta.
+
+        Returns:
+            Emulator: The child.
+        """
+        image = self.ram_banks[0].image
+        if image is None or any(bank.image is not image or 0 in bank.shared_pages for bank in self.ram_banks):
+            image = BankImage(self.ram_banks)
+            for bank in self.ram_banks:
+                bank.share(image)
+            self.bus.share_ram()
+        banks = [bank.fork(memory) for bank, memory in zip(self.ram_banks, image.map())]
+        child = Emulator(None, quantum=self.quantum, trace_size=0, debug=self.logging_enabled,
+                         ram_banks=banks, cpu=self.cpu.copy())
+        child.eprom_memory = self.eprom_memory
+        child.eprom_file = self.eprom_file
+        child.alu_tables = self.alu_tables
+        child.turbo_table = self.turbo_table
+        for device in self.bus.devices():
+            # The copy publishes what is already in the child's RAM, so nothing is written
+            child.bus.map(device.base >> PAGE_SHIFT, copy.copy(device))
+        child.bus.share_ram()
+        child.block_engine = self.block_engine
+        child.symbols = dict(self.symbols)
+        child.breakpoints = set(self.breakpoints)
+        child.instruction_count = self.instruction_count
+        return child
+
+    def __reduce__(self):
+        # Pickled as the state fork() copies, with the RAM as a compressed snapshot
+        # and the EPROM as the path of its image file, mapped again by the unpickling
+        # process (the words themselves only for an image that has no file); unpickling
+        # builds a new machine from it
+        state = {
+            'snapshot': zlib.compress(take_snapshot(self), 1),
+            'eprom_file': self.eprom_file,
+            'eprom': self.eprom_memory.tobytes() if self.eprom_file is None else b"",
+            'devices': [(device.base >> PAGE_SHIFT, device) for device in self.bus.devices()],
+            'quantum': self.quantum,
+            'debug': self.logging_enabled,
+            'alu_tables': self.alu_tables is not None,
+            'block_engine': self.block_engine,
+            'symbols': self.symbols,
+            'breakpoints': self.breakpoints,
+            'instruction_count': self.instruction_count,
         }
+        return rebuild_emulator, (state,)
+
+    def restore(self, data):
+        # Return to a state captured by snapshot()
+        restore_snapshot(self, data)
 
     def syscall_dispatcher(self, syscall_number, register0, register1, register2, register3):
         if syscall_number == SYS_PRINT:
             #print(f"DISPATCHER PRINT: syscall_number=>{syscall_number}, register0=>{register0}")
             args = self.get_string_from_memory(register0)
-            self.cli.system_call_queue.put((syscall_number, args))
+            self.host_call(syscall_number, args)
         elif syscall_number == SYS_EXIT or syscall_number == SYS_UNAME:
             #print(f"DISPATCHER EXIT: syscall_number=>{syscall_number}")
             args = None
-            self.cli.system_call_queue.put((syscall_number, args))  
+            self.host_call(syscall_number, args)
+        elif syscall_number == SYS_BANK:
+            # Handled here, in the emulator thread, so the switch lands at an exact instruction
+            if 0 <= register0 < len(self.ram_banks):
+                self.registers[0] = self.current_ram_bank
+                self.select_ram_bank(register0)
+            else:
+                self.registers[0] = 0xFF
+        elif syscall_number == SYS_MALLOC:
+            # The heap of the selected bank (see heap.py), credited to the calling program
+            self.registers[0] = self.heap.allocate(register0, self.program_at(self.pc_register))
+        elif syscall_number == SYS_FREE:
+            self.registers[0] = self.heap.release(register0)
         return
 
 
-    def find_empty_memory_slot(self, size):
+    def host_call(self, syscall_number, args):
+        # Hand a request to the host servicing syscalls, the CLI or a HeadlessHost
+        self.cli.system_call_queue.put((syscall_number, args))
+
+    def allocate_memory(self, size):
         """
-        Find an empty memory slot in RAM to load a binary file.
+        Claim free words of the selected RAM bank, to load a program into.
+
+        Placement looks at the bank's free extents (see extents.py), not at its
+        contents, so words holding zeros that were loaded or stored stay in use.
+        The program area, where code can run, is tried first.
 
         Args:
-            size (int): The size (in bytes) of the binary data to be loaded.
+            size (int): The number of 16-bit words wanted.
 
         Returns:
-            int: The starting memory address for loading the binary data.
+            int: The starting address of the claimed words, or -1 if no free
+                extent is big enough.
         """
-        # Iterate through the RAM memory to find the first available slot
-        for address in range(len(self.ram_memory) - size + 1):
-            # Check if the memory slot is empty (contains zeros)
-            if all(byte == 0 for byte in self.ram_memory[address:address + size]):
-                # print(f"Found empty slot at address 0x{address:04X}")
-                return address  # Return the starting address where the empty slot was found
-
-        # If no empty slot is found, return -1 to indicate an error
-        print("No empty slot found.")
-        return -1
+        address = self.extents.allocate(size, END_MARKER_ADDRESS + 1)
+        if address < 0:
+            print("No empty slot found.")
+        return address
+
+    def free_memory(self, address, size):
+        # Hand size words from address back to the selected bank's free extents,
+        # forgetting the programs loaded there
+        self.extents.free(address, size)
+        for start in [start for start in self.programs if address <= start < address + size]:
+            del self.programs[start]
 
     def get_string_from_memory(self, address):
-        # Initialize an empty string to store the characters of the string
-        result = ""
-        # Read characters from memory until a null terminator (0x00) is encountered
-        while True:
-            # Read a character from memory at the current address
-            char = self.read_memory(address)
-            # Check if the character is a null terminator
-            if char == 0x00:
-                break  # Exit the loop if a null terminator is found
-            # Append the character to the result string
-            result += chr(char)
-            # Increment the address to read the next character
-            address += 1
-        return result
+        # Read characters from memory up to a null terminator (0x00) or the end of RAM
+        memory = self.ram_memory
+        if not 0 <= address < len(memory):
+            self.read_memory(address)  # Reports the invalid address
+            return ""
+        try:
+            if isinstance(memory, array):
+                end = memory.index(0x00, address)
+            else:
+                # A bank mapped by a fork (see banks.py): views have no index(), search a copy
+                end = address + array('H', memory[address:].tobytes()).index(0x00)
+        except ValueError:
+            end = len(memory)
+        # One slice copy, then one character per word
+        return "".join(map(chr, memory[address:end]))
 
 
 
@@ -152,9 +595,9 @@ class Emulator:
         if 0 <= address < len(self.ram_memory):
             # Ensure that the data is within the byte range (0x00 to 0xFF)
             data &= 0xFF
-            # Write the data to the specified memory address
-            self.ram_memory[address] = data
-            print(f"Memory write: Address 0x{address:04X} set to 0x{data:02X}")
+            # Write the data through the bus: RAM, with stale translations dropped, or a device
+            store(self, address, data)
+            logging.info(f"Memory write: Address 0x{address:04X} set to 0x{data:02X}")
         else:
             # Handle the case where the address is out of bounds
             print(f"Error: Attempted to write to invalid memory address 0x{address:04X}.")
@@ -162,36 +605,33 @@ class Emulator:
 
     def execute_instruction(self, opcode, Rd, Rn, operands):
         logging.info(f"execute_instruction: {opcode, Rd, Rn, operands}")
-        # Convert opcode to binary string for dictionary lookup
-        opcode_binary = bin(opcode)[2:].zfill(4)
-        #logging.info(f"execute_instruction (opcode_binary)): {opcode_binary}")
-
-        for a in self.instruction_set:
-            if opcode_binary == a:
-                #logging.info(f"execution for loop a & opcode_binary: {a}, {opcode_binary}")
-                instruction_function = self.instruction_set[a]
-                #logging.info(f"instruction_function(Rd, Rn, Operands): {Rd}, {Rn}, {operands}")
-                instruction_function(Rd, Rn, operands)
-                logging.info("Register Info:")
-                for i, value in enumerate(self.registers):
-                    if i < 4:
-                        logging.info(f"R{i}  0x{value:02X}  {value}")
-                    elif i == 4 :
-                        logging.info(f"LR  0x{value:02X}  {value}")
-                # Display Stack Pointer (SP) and Program Counter (PC)
-                logging.info(f"SP   0x{self.sp_register:04X}  {self.sp_register}")
-                logging.info(f"PC   0x{self.pc_register:04X}  {self.pc_register}")
-                # Display flags
-                logging.info("Flags:")
-                logging.info(f"Zero Flag: {self.zero_flag}")
-                logging.info(f"Overflow Flag: {self.overflow_flag}")
-                logging.info(f"Carry Flag: {self.carry_flag}")
-                logging.info(f"Interrupt Flag: {self.interrupt_flag}")
-                return
+        # Look the handler up directly by its opcode index
+        if 0 <= opcode < len(OPCODE_HANDLERS):
+            self.execute_decoded(OPCODE_HANDLERS[opcode], Rd, Rn, operands)
+            return
 
         # Update the program counter (PC) for the next instruction
         self.pc_register += 1
-        logging.error(f"Unsupported opcode: {opcode_binary}")
+        logging.error(f"Unsupported opcode: {bin(opcode)[2:].zfill(4)}")
+
+    def execute_decoded(self, instruction_function, Rd, Rn, operands):
+        # Run an already decoded instruction and log the resulting CPU state
+        instruction_function(self, Rd, Rn, operands)
+        logging.info("Register Info:")
+        for i, value in enumerate(self.registers):
+            if i < 4:
+                logging.info(f"R{i}  0x{value:02X}  {value}")
+            elif i == 4 :
+                logging.info(f"LR  0x{value:02X}  {value}")
+        # Display Stack Pointer (SP) and Program Counter (PC)
+        logging.info(f"SP   0x{self.sp_register:04X}  {self.sp_register}")
+        logging.info(f"PC   0x{self.pc_register:04X}  {self.pc_register}")
+        # Display flags
+        logging.info("Flags:")
+        logging.info(f"Zero Flag: {self.zero_flag}")
+        logging.info(f"Overflow Flag: {self.overflow_flag}")
+        logging.info(f"Carry Flag: {self.carry_flag}")
+        logging.info(f"Interrupt Flag: {self.interrupt_flag}")
 
     def handle_unsupported_opcode(self, opcode, operands):
         # Log unsupported opcode in binary format
@@ -219,10 +659,7 @@ class Emulator:
         self.registers[Rd] = data_from_memory
 
         # Update flags as needed (e.g., zero flag)
-        if self.registers[Rd] == 0:
-            self.zero_flag = True
-        else:
-            self.zero_flag = False
+        self._zero_result = self.registers[Rd]
 
     def store_data(self, Rd, Rn, operands):
         logging.info(f"Data Store: {Rd}, {Rn}, {operands}")
@@ -249,24 +686,15 @@ class Emulator:
             # Add Rn to Rd and store the result in Rd
             result = self.registers[Rd] + self.registers[Rn]
 
-        # Set the carry flag if there is a carry-out (8-bit behavior)
-        if result > 255:
-            self.carry_flag = True
-        else:
-            self.carry_flag = False
-
-        # Set the overflow flag if there is overflow in signed arithmetic (8-bit behavior)
-        # Overflow occurs when the result is outside the signed 8-bit range (-128 to 127).
-        if result > 127 or result < -128:
-            self.overflow_flag = True
-        else:
-            self.overflow_flag = False
+        # Record the result; carry (result > 255) and signed 8-bit overflow are
+        # worked out from it only when the flags are read
+        self._cv_source = (FLAGS_ADD, result, 0)
 
         # Perform addition and store the result in the destination register (8-bit behavior)
         self.registers[Rd] = result & 0xFF
 
-        # Set the zero flag if the result is zero
-        self.zero_flag = self.registers[Rd] == 0
+        # The zero flag is set if the result is zero
+        self._zero_result = self.registers[Rd]
 
         logging.info(f"Result: 0x{self.registers[Rd]:02X} ({self.registers[Rd]})")
 
@@ -283,28 +711,16 @@ class Emulator:
             # Subtract Rn from Rd and store the result in Rd
             result = self.registers[Rd] - self.registers[Rn]
 
-        # Set the overflow flag if there is overflow in signed arithmetic (8-bit behavior)
-        # Overflow occurs when subtracting two positive numbers and getting a negative result, or vice versa.
-        if result > 127 or result < -128:
-            self.overflow_flag = True
-        else:
-            self.overflow_flag = False
-
         # Perform subtraction and store the result in the destination register (8-bit behavior)
         self.registers[Rd] = result & 0xFF
 
-        # Update flags as needed (e.g., zero flag, carry flag)
-        result = self.registers[Rd]
+        # Record the result and Rn; signed 8-bit overflow and the borrow (stored result
+        # smaller than Rn) are worked out from them only when the flags are read
+        self._cv_source = (FLAGS_SUB, result, self.registers[Rn])
 
         # Set the zero flag if the result is zero
-        self.zero_flag = result == 0
-
-        # Set the carry flag if there is a borrow during subtraction (8-bit behavior)
-        # Carry occurs when subtracting a smaller number from a larger one.
-        if self.registers[Rd] < self.registers[Rn]:
-            self.carry_flag = True
-        else:
-            self.carry_flag = False
+        result = self.registers[Rd]
+        self._zero_result = result
 
         logging.info(f"Result: 0x{result:02X} ({result})")
 
@@ -327,7 +743,7 @@ class Emulator:
     def branch_equal(self, Rd, Rn, operands):
         logging.info(f"Inside BEQ")
         # Check if the zero flag is set (indicating that the values in the destination and source registers are equal)
-        if self.zero_flag:
+        if self._zero_result == 0:
             # Set the program counter (PC) to the target address (8-bit binary)
             self.pc_register = operands
             logging.info(f"BEQ instruction: Branching to address 0x{operands}")
@@ -338,7 +754,7 @@ class Emulator:
     def branch_not_equal(self, Rd, Rn, operands):
         logging.info(f"Inside BNE")
         # Check if the zero flag is not set (indicating that the values in the destination and source registers are not equal)
-        if not self.zero_flag:
+        if self._zero_result != 0:
             # Set the program counter (PC) to the target address (8-bit binary)
             self.pc_register = operands
             logging.info(f"BNE instruction: Branching to address 0x{operands}")
@@ -360,23 +776,10 @@ class Emulator:
             source_value = self.registers[Rn]
             result = destination_value - source_value
 
-        # Update flags based on the comparison result
-        if result == 0:
-            self.zero_flag = True  # Set zero flag if the values are equal
-        else:
-            self.zero_flag = False
-
-        # Check for overflow (signed comparison)
-        if result > 32767 or result < -32768:
-            self.overflow_flag = True
-        else:
-            self.overflow_flag = False
-
-        # Check for carry (unsigned comparison)
-        if destination_value < source_value:
-            self.carry_flag = True
-        else:
-            self.carry_flag = False
+        # Zero flag is set if the values are equal; signed overflow and the unsigned
+        # carry are worked out from the recorded operands when they are read
+        self._zero_result = result
+        self._cv_source = (FLAGS_CMP, destination_value, source_value)
 
         logging.info(f"CMP instruction result: {result}")
 
@@ -400,10 +803,7 @@ class Emulator:
             self.registers[0] = primary_value & secondary_value
 
         # Update flags as needed (e.g., zero flag)
-        if self.registers[0] == 0:
-            self.zero_flag = True
-        else:
-            self.zero_flag = False
+        self._zero_result = self.registers[0]
 
         logging.info(f"AND result: {self.registers[Rd]}")
         logging.info(f"AND result: 0x{self.registers[Rd]:02X}")
@@ -429,10 +829,7 @@ class Emulator:
             self.registers[0] = primary_value | secondary_value
 
         # Update flags as needed (e.g., zero flag)
-        if self.registers[0] == 0:
-            self.zero_flag = True
-        else:
-            self.zero_flag = False
+        self._zero_result = self.registers[0]
 
         logging.info(f"OR result: {self.registers[Rd]}")
         logging.info(f"OR result: 0x{self.registers[Rd]:02X}")
@@ -456,10 +853,7 @@ class Emulator:
             self.registers[0] = primary_value ^ secondary_value
 
         # Update flags as needed (e.g., zero flag)
-        if self.registers[0] == 0:
-            self.zero_flag = True
-        else:
-            self.zero_flag = False
+        self._zero_result = self.registers[0]
 
         logging.info(f"XOR result: {self.registers[Rd]}")
 
@@ -474,23 +868,16 @@ class Emulator:
         # Shift left by the immediate value (assuming operands is an integer)
         result = (source_value << operands)
 
-        # Set the overflow flag if the result has overflowed (bit 8 is set)
-        if result & 0x100:
-            self.overflow_flag = True
-        else:
-            self.overflow_flag = False
+        # Overflow (bit 8 set) is worked out from the operands when read; carry is
+        # always clear (no carry in left shift operations)
+        self._cv_source = (FLAGS_SHL, result, 0)
 
         # Store the result in the destination register (Rd)
         self.registers[Rd] = result & 0xFF
 
-        # Update flags as needed (e.g., zero flag, carry flag)
-        result = self.registers[Rd]
-
         # Set the zero flag if the result is zero
-        self.zero_flag = result == 0
-
-        # Clear the carry flag (no carry in left shift operations)
-        self.carry_flag = False
+        result = self.registers[Rd]
+        self._zero_result = result
 
         logging.info(f"Result: 0x{result:02X} ({result})")
 
@@ -503,23 +890,16 @@ class Emulator:
         result = (source_value >> operands)
 
 
-        # Set the overflow flag if the source_value has the most significant bit set
-        if source_value & 0x80:
-            self.overflow_flag = True
-        else:
-            self.overflow_flag = False
+        # Overflow (source_value has the most significant bit set) is worked out when
+        # read; carry is always clear (no carry in right shift operations)
+        self._cv_source = (FLAGS_SHR, source_value, 0)
 
         # Store the result in the destination register (Rd)
         self.registers[Rd] = result & 0xFF
 
-        # Update flags as needed (e.g., zero flag, carry flag)
-        result = self.registers[Rd]
-
         # Set the zero flag if the result is zero
-        self.zero_flag = result == 0
-
-        # Clear the carry flag (no carry in right shift operations)
-        self.carry_flag = False
+        result = self.registers[Rd]
+        self._zero_result = result
 
         logging.info(f"Result: 0x{result:02X} ({result})")
 
@@ -654,21 +1034,23 @@ class Emulator:
 
             # Check if the instruction is not None (indicating a valid memory read)
             if instruction is not None:
-                # Decode the instruction to extract opcode, registers, and operands
-                opcode = (instruction >> 12) & 0xF  # Extract the opcode (4 bits)
-                registers = (instruction >> 8) & 0xF  # Extract the register bits (4 bits)
-                operands = instruction & 0xFF  # Extract the operands (8 bits)
+                pc = self.pc_register
+                # Decode the instruction with a single lookup in the precomputed table
+                instruction_function, Rd, Rn, operands = DECODE_TABLE[instruction]
 
-                # Extract Rd and Rn from the registers field (assuming they are 2 bits each)
-                Rd = (registers >> 2) & 0x3  # Extract the destination register (Rd)
-                Rn = registers & 0x3  # Extract the source register (Rn)
+                if self.trace is not None:
+                    self.trace.record(self.pc_register, instruction, self.cpu)
+                if self.profiling:
+                    self.profiler.count(self.pc_register, instruction, self.cpu)
 
                 # Log opcode, operands, Rd, and Rn
-                logging.info(f"fetch_and_execute() Opcode: {bin(opcode)[2:].zfill(4)}, Operands: {bin(operands)[2:].zfill(12)}")
+                logging.info(f"fetch_and_execute() Opcode: {bin(instruction >> 12)[2:].zfill(4)}, Operands: {bin(operands)[2:].zfill(12)}")
                 logging.info(f"fetch_and_execute() Rd: {bin(Rd)[2:].zfill(4)}, Rn: {bin(Rn)[2:].zfill(4)}")
 
-                # Execute the instruction using the execute_instruction function
-                self.execute_instruction(opcode, Rd, Rn, operands)
+                # Execute the decoded instruction
+                self.execute_decoded(instruction_function, Rd, Rn, operands)
+                if self.profiling:
+                    self.profiler.call_graph.step(instruction, pc, self.pc_register)
 
                 # Increment the program counter (PC) for the next instruction by 2 since it's a 16-bit instruction
                 self.pc_register += 1
@@ -683,17 +1065,349 @@ class Emulator:
 
 
 
-    def run(self):
-        while not self.exit_event.is_set():
-            # Fetch and execute instructions until a halt condition is met
-            self.fetch_and_execute()
+    def execute_block(self):
+        # Execute one translated basic block starting at the current PC
+        if not self.interrupt_flag:
+            block = self.block_cache.lookup(self.pc_register)
+            if block is None:
+                # Nothing to translate (e.g. PC outside RAM), take the normal path
+                self.fetch_and_execute()
+                return 1
+            return block(self)
+        return 0
+
+    def run_until(self, max_instructions=None, stop_pc=None, stop_on_syscall=False):
+        """
+        Run instructions in turbo mode: no logging, no string formatting, no print.
+
+        Args:
+            max_instructions (int): Stop after this many instructions (None for no limit).
+            stop_pc (int): Stop before executing the instruction at this address.
+            stop_on_syscall (bool): Stop right after a syscall instruction.
+
+        Returns:
+            int: The number of instructions executed. The emulator also stops when
+                the program halts (the interrupt flag is set).
+        """
+        cpu = self.cpu
+        if cpu.interrupt_flag:
+            return 0
+
+        table = self.turbo_table
+        memory = self.ram_memory
+        predecoded = self.predecoded
+        size = len(predecoded)
+        limit = -1 if max_instructions is None else max_instructions
+        executed = 0
+        # Only the PC is checked per instruction; halting and syscalls end the loop directly
+        while executed != limit:
+            pc = cpu.pc_register
+            if pc == stop_pc:
+                break
+            # Only the program area is predecoded; a PC set beyond it runs one
+            # instruction before the halt (out of range addresses read as word 0)
+            handler, Rd, Rn, operands = predecoded[pc] if 0 <= pc < size else table[load(self, pc)]
+            if Rd == FUSED:
+                # A fused pair runs as one step unless the limit or stop_pc falls between its halves
+                if executed + 1 != limit and pc + 1 != stop_pc:
+                    executed += handler(self, cpu, pc)
+                    pc = cpu.pc_register + 1
+                    cpu.pc_register = pc
+                    if pc > END_MARKER_ADDRESS:
+                        cpu.interrupt_flag = True
+                        break
+                    continue
+                handler, Rd, Rn, operands = table[memory[pc]]
+            syscalled = handler(self, Rd, Rn, operands)
+            executed += 1
+            pc = cpu.pc_register + 1
+            cpu.pc_register = pc
+            if pc > END_MARKER_ADDRESS:
+                cpu.interrupt_flag = True
+                break
+            if syscalled:
+                if stop_on_syscall:
+                    break
+                # The syscall may have switched RAM banks
+                memory = self.ram_memory
+                predecoded = self.predecoded
+        return executed
+
+    def run_traced(self, max_instructions=None):
+        """
+        Run quietly like run_until(), recording every instruction in the trace buffer.
+
+        Args:
+            max_instructions (int): Stop after this many instructions (None for no limit).
+
+        Returns:
+            int: The number of instructions executed.
+        """
+        cpu = self.cpu
+        if cpu.interrupt_flag:
+            return 0
+
+        record = self.trace.record
+        table = self.turbo_table
+        memory = self.ram_memory
+        size = len(memory)
+        limit = -1 if max_instructions is None else max_instructions
+        executed = 0
+        # Pairs are not fused here so that every instruction gets its own record
+        while executed != limit:
+            pc = cpu.pc_register
+            instruction = memory[pc] if 0 <= pc < size else 0
+            record(pc, instruction, cpu)
+            handler, Rd, Rn, operands = table[instruction]
+            if handler(self, Rd, Rn, operands):
+                # A syscall, which may have switched RAM banks
+                memory = self.ram_memory
+            executed += 1
+            pc = cpu.pc_register + 1
+            cpu.pc_register = pc
+            if pc > END_MARKER_ADDRESS:
+                cpu.interrupt_flag = True
+                break
+        return executed
+
+    def run_profiled(self, max_instructions=None):
+        """
+        Run quietly like run_until(), counting every instruction in the profiler.
 
-            # Check for the halt condition (end of program)
-            if self.pc_register == END_MARKER_ADDRESS:
+        Args:
+            max_instructions (int): Stop after this many instructions (None for no limit).
+
+        Returns:
+            int: The number of instructions executed.
+        """
+        cpu = self.cpu
+        if cpu.interrupt_flag:
+            return 0
+
+        profiler = self.profiler
+        address_counts = profiler.address_counts
+        opcode_counts = profiler.opcode_counts
+        branch_taken = profiler.branch_taken
+        branch_not_taken = profiler.branch_not_taken
+        call_graph = profiler.call_graph
+        call_graph.start(cpu.pc_register)
+        record = self.trace.record if self.trace is not None else None
+        table = self.turbo_table
+        memory = self.ram_memory
+        size = len(memory)
+        limit = -1 if max_instructions is None else max_instructions
+        executed = 0
+        attributed = 0  # Instructions already handed to the call graph
+        # Pairs are not fused here so that every instruction is counted at its own address
+        while executed != limit:
+            pc = cpu.pc_register
+            if 0 <= pc < size:
+                instruction = memory[pc]
+                address_counts[pc] += 1
+            else:
+                instruction = 0
+            opcode = instruction >> 12
+            opcode_counts[opcode] += 1
+            if opcode == OP_BEQ or opcode == OP_BNE:
+                # Decided by the zero flag before the branch runs
+                if (cpu._zero_result == 0) == (opcode == OP_BEQ):
+                    branch_taken[pc] += 1
+                else:
+                    branch_not_taken[pc] += 1
+            if record is not None:
+                record(pc, instruction, cpu)
+            handler, Rd, Rn, operands = table[instruction]
+            if handler(self, Rd, Rn, operands):
+                # A syscall, which may have switched RAM banks
+                memory = self.ram_memory
+            executed += 1
+            if opcode == OP_JMP:
+                call_graph.add(executed - attributed)
+                attributed = executed
+                call_graph.call(cpu.pc_register, pc)
+            elif opcode == OP_POP and instruction & 0x90 == 0x10:
+                # Return through LR (bit 4), not a syscall (bit 7)
+                call_graph.add(executed - attributed)
+                attributed = executed
+                call_graph.ret(cpu.pc_register)
+            pc = cpu.pc_register + 1
+            cpu.pc_register = pc
+            if pc > END_MARKER_ADDRESS:
+                cpu.interrupt_flag = True
                 break
+        call_graph.add(executed - attributed)
+        return executed
+
+    def run_debug(self, max_instructions=None):
+        """
+        Run quietly like run_until(), stopping before any instruction at a breakpoint.
+
+        Args:
+            max_instructions (int): Stop after this many instructions (None for no limit).
+
+        Returns:
+            int: The number of instructions executed.
+        """
+        cpu = self.cpu
+        if cpu.interrupt_flag:
+            return 0
+
+        breakpoints = self.breakpoints
+        passing = self.breakpoint_pass
+        self.breakpoint_pass = None
+        record = self.trace.record if self.trace is not None else None
+        table = self.turbo_table
+        memory = self.ram_memory
+        size = len(memory)
+        limit = -1 if max_instructions is None else max_instructions
+        executed = 0
+        while executed != limit:
+            pc = cpu.pc_register
+            if pc in breakpoints and pc != passing:
+                self.stop_for_debugger()
+                break
+            passing = None
+            instruction = memory[pc] if 0 <= pc < size else 0
+            if record is not None:
+                record(pc, instruction, cpu)
+            handler, Rd, Rn, operands = table[instruction]
+            if handler(self, Rd, Rn, operands):
+                # A syscall, which may have switched RAM banks
+                memory = self.ram_memory
+            executed += 1
+            pc = cpu.pc_register + 1
+            cpu.pc_register = pc
+            if pc > END_MARKER_ADDRESS:
+                cpu.interrupt_flag = True
+                break
+        return executed
+
+    def run_quantum(self):
+        # Run up to one quantum of instructions with the selected engine
+        quantum = self.quantum
+        if self.step_remaining:
+            quantum = min(quantum, self.step_remaining)
+        executed = 0
+        if self.logging_enabled:
+            breakpoints = self.breakpoints
+            passing = self.breakpoint_pass
+            self.breakpoint_pass = None
+            while executed < quantum and not self.interrupt_flag:
+                if self.pc_register in breakpoints and self.pc_register != passing:
+                    self.stop_for_debugger()
+                    break
+                passing = None
+                # Fetch and execute instructions until a halt condition is met
+                self.fetch_and_execute()
+                executed += 1
+        elif self.breakpoints:
+            executed = self.run_debug(max_instructions=quantum)
+        elif self.profiling:
+            executed = self.run_profiled(max_instructions=quantum)
+        elif self.block_engine:
+            while executed < quantum and not self.interrupt_flag:
+                executed += self.execute_block()
+        elif self.trace is not None:
+            executed = self.run_traced(max_instructions=quantum)
+        else:
+            executed = self.run_until(max_instructions=quantum)
+        if self.step_remaining:
+            self.step_remaining -= executed
+            if self.step_remaining <= 0 and not self.interrupt_flag:
+                self.stop_for_debugger()
+        return executed
+
+    def dump_trace(self, filename):
+        # Write the trace buffer to filename (.bin for binary, text otherwise)
+        if self.trace is None:
+            return 0
+        return self.trace.dump(filename)
+
+    def run(self):
+        # The exit event is only checked between quanta, not on every instruction
+        while not self.exit_event.is_set():
+            self.apply_inputs()
+            if self.interrupt_flag:
+                with self.inputs_lock:
+                    if self.inputs.empty():
+                        self.halted_event.set()
+                # Halted: sleep until resume() or stop() wakes us instead of spinning
+                self.wake_event.wait()
+                self.wake_event.clear()
+                continue
+            if self.history is not None:
+                self.history.tick()
+            try:
+                self.instruction_count += self.run_quantum()
+            except Exception:
+                # Keep the instructions that led up to the crash for a post-mortem
+                logging.error("Emulator crashed", exc_info=True)
+                self.dump_trace(self.trace_file or TRACE_CRASH_FILE)
+                raise
+            if self.debugger_stop:
+                # Halts made by the debugger are part of the run, like any other input
+                self.debugger_stop = False
+                self.log_input(INPUT_HALT)
+            if self.interrupt_flag and self.trace_file:
+                self.dump_trace(self.trace_file)
+        # Close a recording that is still running, with the state the machine stopped in
+        self.apply_inputs()
+        if self.recorder is not None:
+            self.recorder.stop(self)
+            self.recorder = None
+
+    def resume(self):
+        # Clear the halt and wake the emulator thread
+        self.post_input(INPUT_RESUME)
 
     def stop(self):
         # Set the exit event to signal the emulator to stop
         self.exit_event.set()
-
-
+        # Wake the thread in case it is waiting while halted
+        self.wake_event.set()
+
+
+
+def rebuild_emulator(state):
+    # Unpickle a machine pickled by Emulator.__reduce__()
+    emu = Emulator(None, quantum=state['quantum'], alu_tables=state['alu_tables'], trace_size=0,
+                   debug=state['debug'])
+    if state['eprom_file'] is not None:
+        emu.attach_eprom(open_eprom_image(state['eprom_file']), state['eprom_file'])
+    elif state['eprom']:
+        emu.attach_eprom(memoryview(array('H', state['eprom'])))
+    for page, device in state['devices']:
+        emu.bus.map(page, device)
+    restore_snapshot(emu, zlib.decompress(state['snapshot']))
+    emu.block_engine = state['block_engine']
+    emu.symbols = state['symbols']
+    emu.breakpoints = state['breakpoints']
+    emu.instruction_count = state['instruction_count']
+    return emu
+
+
+# Instruction handlers indexed by opcode
+OPCODE_HANDLERS = (
+    Emulator.load_data,         # 0000 LD
+    Emulator.load_immediate,    # 0001 LI
+    Emulator.store_data,        # 0010 ST
+    Emulator.add,               # 0011 ADD
+    Emulator.subtract,          # 0100 SUB
+    Emulator.jump,              # 0101 JMP
+    Emulator.branch_equal,      # 0110 BEQ
+    Emulator.branch_not_equal,  # 0111 BNE
+    Emulator.compare,           # 1000 CMP
+    Emulator.logical_and,       # 1001 AND
+    Emulator.logical_or,        # 1010 OR
+    Emulator.logical_xor,       # 1011 XOR
+    Emulator.shift_left,        # 1100 SHL
+    Emulator.shift_right,       # 1101 SHR
+    Emulator.push,              # 1110 PUSH
+    Emulator.pop,               # 1111 POP
+)
+
+# (handler, Rd, Rn, operands) for every 16-bit instruction word, built once at import
+DECODE_TABLE = build_decode_table(OPCODE_HANDLERS)
+
+# Opcode bit strings mapped to their handlers, shared by every instance
+Emulator.instruction_set = {f"{opcode:04b}": handler for opcode, handler in enumerate(OPCODE_HANDLERS)}
@@ -0,0 +1,48 @@
+# eprom.py
+
+# Boot EPROM images.
+#
+# An EPROM image is a file of raw little-endian 16-bit words, DEFAULT_EPROM_IMAGE
+# in the harddrive folder unless told otherwise. It is memory-mapped read-only
+# and used through a memoryview cast to words: nothing is copied into Python
+# objects and the OS reads each page from disk the first time it is touched, so
+# opening a 256MB image costs the same time and memory as opening a 4KB one.
+#
+# Booting (Emulator.boot) copies the boot block, the words of the program area
+# up to END_MARKER_ADDRESS, into RAM and starts running it at address 0.
+
+import mmap
+import os
+import sys
+from array import array
+
+DEFAULT_EPROM_IMAGE = os.path.join("harddrive", "boot.rom")
+
+
+def open_eprom_image(filename):
+    """
+    Map an EPROM image read-only.
+
+    Args:
+        filename (str): The image file.
+
+    Returns:
+        memoryview: The image's words (format 'H'), backed by the mapping. A
+            trailing odd byte is ignored.
+
+    Raises:
+        OSError: If the file cannot be opened or mapped.
+    """
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size & ~1
+        if not size:
+            return memoryview(array('H'))  # mmap cannot map an empty file
+        # The mapping stays valid once the file is closed
+        mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    words = memoryview(mapped).cast('H')
+    if sys.byteorder == "big":
+        # Rare enough to pay for one swapped copy instead of a lazy mapping
+        swapped = array('H', words)
+        swapped.byteswap()
+        return memoryview(swapped)
+    return words
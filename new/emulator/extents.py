@@ -0,0 +1,141 @@
+# extents.py
+
+# Free-extent index of a RAM bank.
+#
+# Free memory is kept as maximal [start, end) extents, never by looking at
+# the words themselves, so a zero word that was loaded is in use and a word
+# that was freed is free whatever it holds. Two sorted lists index the extents:
+#
+#   starts    extent starts in address order, with ends[start] its end, for
+#             placing, reserving and freeing ranges and merging neighbours
+#   by_size   (length, start) pairs, for placing by size
+#
+# Reserving and freeing find their extents with bisect in O(log n); the list
+# updates are C memmoves. Placement is best fit, the smallest extent that is
+# big enough (the lowest of equal ones), found with one bisect of by_size. Only
+# the first 256 words can hold code, though, so a caller can name a prefix of
+# the address space to try first: the extents starting in it are tried lowest
+# first, at most half as many as the prefix has words, before the best fit.
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+
+class FreeExtents:
+
+    def __init__(self, size):
+        self.size = size
+        self.starts = []
+        self.ends = {}
+        self.by_size = []
+        self.add(0, size)
+
+    def add(self, start, end):
+        # Index a free extent that touches no other
+        insort(self.starts, start)
+        self.ends[start] = end
+        insort(self.by_size, (end - start, start))
+
+    def remove(self, start):
+        # Drop the free extent at start from the index; returns its end
+        end = self.ends.pop(start)
+        del self.starts[bisect_left(self.starts, start)]
+        del self.by_size[bisect_left(self.by_size, (end - start, start))]
+        return end
+
+    def allocate(self, size, below=0):
+        """
+        Claim size words at the start of a free extent.
+
+        Args:
+            size (int): Words wanted.
+            below (int): Try the extents starting below this address first, lowest
+                first; if none of them is big enough, take the best fit.
+
+        Returns:
+            int: The start of the claimed words, or -1 if no extent is big enough.
+        """
+        if size <= 0:
+            return -1
+        starts, ends = self.starts, self.ends
+        for index in range(bisect_left(starts, below)):
+            start = starts[index]
+            if ends[start] - start >= size:
+                break
+        else:
+            # The smallest extent of at least size words, the lowest on ties
+            index = bisect_left(self.by_size, (size, 0))
+            if index == len(self.by_size):
+                return -1
+            start = self.by_size[index][1]
+        end = self.remove(start)
+        if start + size < end:
+            self.add(start + size, end)
+        return start
+
+    def reserve(self, start, size):
+        # Mark [start, start + size) as in use, whether or not any of it was free
+        end = min(start + size, self.size)
+        start = max(start, 0)
+        index = bisect_right(self.starts, start) - 1
+        if index < 0:
+            index = 0
+        while index < len(self.starts) and self.starts[index] < end:
+            free_start = self.starts[index]
+            free_end = self.ends[free_start]
+            if free_end <= start:
+                index += 1
+                continue
+            self.remove(free_start)
+            # Keep what lies either side of the reserved range
+            if free_start < start:
+                self.add(free_start, start)
+                index += 1
+            if end < free_end:
+                self.add(end, free_end)
+                break
+
+    def free(self, start, size):
+        # Return [start, start + size) to the free extents, merging it with its neighbours
+        end = min(start + size, self.size)
+        start = max(start, 0)
+        if start >= end:
+            return
+        self.reserve(start, end - start)
+        index = bisect_left(self.starts, start)
+        if index > 0 and self.ends[self.starts[index - 1]] == start:
+            start = self.starts[index - 1]
+            self.remove(start)
+        if end in self.ends:
+            end = self.remove(end)
+        self.add(start, end)
+
+    def copy(self):
+        extents = FreeExtents(self.size)
+        extents.starts = list(self.starts)
+        extents.ends = dict(self.ends)
+        extents.by_size = list(self.by_size)
+        return extents
+
+    def free_words(self):
+        return sum(length for length, _ in self.by_size)
+
+    def extents(self):
+        # (start, end) of every free extent, in address order
+        return [(start, self.ends[start]) for start in self.starts]
+
+    def to_array(self):
+        # The extents as one flat array('I') of start, end pairs, for snapshots
+        flat = array('I')
+        for start in self.starts:
+            flat.append(start)
+            flat.append(self.ends[start])
+        return flat
+
+    def load(self, flat):
+        # Replace the extents with those of a to_array() result
+        self.starts.clear()
+        self.ends.clear()
+        self.by_size.clear()
+        for index in range(0, len(flat), 2):
+            self.add(flat[index], flat[index + 1])
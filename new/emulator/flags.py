@@ -0,0 +1,58 @@
+# flags.py
+
+# Lazy condition flags.
+#
+# The ALU handlers no longer compute the zero, carry and overflow flags on every
+# instruction. Instead the emulator keeps two cheap records:
+#
+#   _zero_result  the value the zero flag tests (zero flag is set when it is 0)
+#   _cv_source    a (kind, a, b) tuple naming the last operation that set the
+#                 carry and overflow flags, with the values needed to work them out
+#
+# The flags are only worked out from these when something reads them (BEQ/BNE
+# only need the zero flag; the CLI and the debug log read all of them).
+
+FLAGS_FIXED = 0  # (FLAGS_FIXED, carry, overflow) - flags were set directly
+FLAGS_ADD = 1    # (FLAGS_ADD, result, 0) - unmasked sum
+FLAGS_SUB = 2    # (FLAGS_SUB, result, rn) - unmasked difference and Rn after the write
+FLAGS_CMP = 3    # (FLAGS_CMP, destination, source) - 16-bit signed overflow
+FLAGS_SHL = 4    # (FLAGS_SHL, result, 0) - unmasked shifted value
+FLAGS_SHR = 5    # (FLAGS_SHR, source, 0) - value before the shift
+FLAGS_PACKED = 6 # (FLAGS_PACKED, entry, 0) - ALU table entry (see alu.py)
+
+# Flag bits of a packed ALU table entry, above the 8-bit result
+ZERO_BIT = 0x100
+CARRY_BIT = 0x200
+OVERFLOW_BIT = 0x400
+
+CLEAR_FLAGS = (FLAGS_FIXED, False, False)
+
+
+def carry_and_overflow(source):
+    """
+    Materialise the carry and overflow flags from a recorded operation.
+
+    Args:
+        source (tuple): The (kind, a, b) record left by the last flag-setting operation.
+
+    Returns:
+        tuple: (carry_flag, overflow_flag) exactly as the eager handlers computed them.
+    """
+    kind, a, b = source
+    if kind == FLAGS_FIXED:
+        return a, b
+    if kind == FLAGS_ADD:
+        return a > 255, a > 127 or a < -128
+    if kind == FLAGS_SUB:
+        # Borrow when the stored 8-bit result is smaller than Rn
+        return (a & 0xFF) < b, a > 127 or a < -128
+    if kind == FLAGS_CMP:
+        result = a - b
+        return a < b, result > 32767 or result < -32768
+    if kind == FLAGS_SHL:
+        return False, a & 0x100 != 0
+    if kind == FLAGS_SHR:
+        return False, a & 0x80 != 0
+    if kind == FLAGS_PACKED:
+        return a & CARRY_BIT != 0, a & OVERFLOW_BIT != 0
+    raise ValueError(f"Unknown flag source: {kind}")
@@ -0,0 +1,176 @@
+# fusion.py
+
+# Superinstructions for the turbo run loop.
+#
+# When an image is loaded the program area is scanned for adjacent instruction
+# pairs that guest code uses all the time:
+#
+#   CMP + BEQ/BNE     compare and branch
+#   LI + ADD          load a constant, then add
+#   LD/ST + ADD       memory access followed by a pointer increment
+#
+# Each pair found gets a fused handler that does the work of both instructions
+# in one host call, leaving exactly the state the two separate instructions
+# would. A write to either word of a pair drops its fused handler again.
+# Fused handlers are called as handler(emu, cpu, pc) with pc the address of the
+# first instruction; they leave the PC on the last instruction they executed
+# and return how many they executed. In the emulator's predecoded image a fused
+# pair is stored as (handler, FUSED, 0, 0).
+
+from emulator.decoder import decode
+from emulator.flags import FLAGS_ADD, FLAGS_CMP
+from emulator.turbo import load, store
+
+OP_LD, OP_LI, OP_ST, OP_ADD = 0x0, 0x1, 0x2, 0x3
+OP_BEQ, OP_BNE, OP_CMP = 0x6, 0x7, 0x8
+
+FUSED = -1  # Stands in for Rd in a predecoded entry that holds a fused pair
+
+
+def fuse_compare_branch(compare, branch):
+    Rd, Rn, operands = compare
+    branch_opcode, _, _, target = branch
+    immediate = Rd == 0 and Rn == 0
+    take_when_zero = branch_opcode == OP_BEQ
+
+    def compare_branch(emu, cpu, pc):
+        registers = cpu.registers
+        destination_value = registers[Rd]
+        source_value = operands if immediate else registers[Rn]
+        cpu._zero_result = result = destination_value - source_value
+        cpu._cv_source = (FLAGS_CMP, destination_value, source_value)
+        cpu.pc_register = target if (result == 0) == take_when_zero else pc + 1
+        return 2
+    return compare_branch
+
+
+def fuse_load_immediate_add(load_immediate, add):
+    Rd1, _, value = load_immediate
+    _, Rd2, Rn2, operands = add
+
+    def load_immediate_add(emu, cpu, pc):
+        registers = cpu.registers
+        registers[Rd1] = value
+        result = registers[Rn2] + operands
+        cpu._cv_source = (FLAGS_ADD, result, 0)
+        cpu._zero_result = registers[Rd2] = result & 0xFF
+        cpu.pc_register = pc + 1
+        return 2
+    return load_immediate_add
+
+
+def fuse_load_add(load_data, add):
+    Rd1, Rn1, _ = load_data
+    _, Rd2, Rn2, operands = add
+
+    def load_add(emu, cpu, pc):
+        registers = cpu.registers
+        registers[Rd1] = load(emu, registers[Rn1])
+        result = registers[Rn2] + operands
+        cpu._cv_source = (FLAGS_ADD, result, 0)
+        cpu._zero_result = registers[Rd2] = result & 0xFF
+        cpu.pc_register = pc + 1
+        return 2
+    return load_add
+
+
+def fuse_store_add(store_data, add, add_word):
+    Rd1, Rn1, _ = store_data
+    _, Rd2, Rn2, operands = add
+
+    def store_add(emu, cpu, pc):
+        registers = cpu.registers
+        store(emu, registers[Rn1], registers[Rd1])
+        if emu.ram_memory[pc + 1] != add_word:
+            # The store rewrote the ADD itself, leave it to the normal path
+            return 1
+        result = registers[Rn2] + operands
+        cpu._cv_source = (FLAGS_ADD, result, 0)
+        cpu._zero_result = registers[Rd2] = result & 0xFF
+        cpu.pc_register = pc + 1
+        return 2
+    return store_add
+
+
+def fuse_pair(first_word, second_word):
+    """
+    Build the fused handler for two adjacent instruction words.
+
+    Args:
+        first_word (int): The instruction at the lower address.
+        second_word (int): The instruction that follows it.
+
+    Returns:
+        tuple: (name, handler), or None when the pair is not fused.
+    """
+    opcode, Rd, Rn, operands = decode(first_word)
+    second = decode(second_word)
+    second_opcode = second[0]
+    first = (Rd, Rn, operands)
+    if opcode == OP_CMP and second_opcode in (OP_BEQ, OP_BNE):
+        name = "cmp+beq" if second_opcode == OP_BEQ else "cmp+bne"
+        return name, fuse_compare_branch(first, second)
+    if second_opcode == OP_ADD:
+        if opcode == OP_LI:
+            return "li+add", fuse_load_immediate_add(first, second)
+        if opcode == OP_LD:
+            return "ld+add", fuse_load_add(first, second)
+        if opcode == OP_ST:
+            return "st+add", fuse_store_add(first, second, second_word)
+    return None
+
+
+class FusionTable:
+
+    def __init__(self, end_marker_address):
+        self.end_marker_address = end_marker_address
+        self.handlers = {}  # Address -> fused handler for the pair starting there
+        self.names = {}  # Address -> name of the fused pair starting there
+
+    def scan(self, memory):
+        # Fuse every recognised pair that lies wholly before the end marker
+        self.clear()
+        for address in range(min(self.end_marker_address, len(memory) - 1)):
+            fused = fuse_pair(memory[address], memory[address + 1])
+            if fused is not None:
+                self.names[address], self.handlers[address] = fused
+
+    def invalidate(self, address):
+        """
+        Break the pairs that cover a written address.
+
+        Args:
+            address (int): The address that was written.
+
+        Returns:
+            list: Start addresses of the pairs that were dropped.
+        """
+        dropped = []
+        for start in (address - 1, address):
+            if start in self.handlers:
+                del self.handlers[start]
+                del self.names[start]
+                dropped.append(start)
+        return dropped
+
+    def clear(self):
+        self.handlers.clear()
+        self.names.clear()
+
+    def copy(self):
+        fusions = FusionTable(self.end_marker_address)
+        fusions.handlers = dict(self.handlers)
+        fusions.names = dict(self.names)
+        return fusions
+
+    def stats(self):
+        """
+        Summarise the fused pairs.
+
+        Returns:
+            dict: Pair name -> list of the addresses where it was fused.
+        """
+        pairs = {}
+        for address in sorted(self.names):
+            pairs.setdefault(self.names[address], []).append(address)
+        return pairs
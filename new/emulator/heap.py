@@ -0,0 +1,212 @@
+# heap.py
+
+# Guest heap: a buddy allocator behind SYS_MALLOC and SYS_FREE.
+#
+# Every RAM bank has a Heap over a region of its words, DEFAULT_HEAP_WORDS
+# from DEFAULT_HEAP_BASE unless Emulator.set_heap() (the CLI 'heap' command)
+# moves it. The region is reserved from the bank's free extents, so programs
+# are never loaded over it. Allocating on the host costs the guest one
+# syscall instead of a free-list walk in guest instructions.
+#
+# The region is cut into blocks of 2**order words, each aligned to its size
+# relative to the region base; a region whose size is not a power of two
+# starts as several blocks. free[order] is the set of offsets of the free
+# blocks of that order, and lowest[order] a heapq of the same offsets that
+# may also hold ones taken since (they are skipped when they come to the top,
+# and dropped whenever the heapq grows to twice the set). Allocating pops the
+# lowest block of the smallest order that fits and splits it down; freeing
+# merges a block with its buddy (offset ^ size) for as long as the buddy is
+# free. Each step is O(1) or O(log n), and always taking the lowest block keeps
+# the heap deterministic for recordings and the history.
+#
+# Guest interface, R0 in and R0 out:
+#   SYS_MALLOC  R0 = words wanted       -> R0 = address of the block, 0 if none is free
+#   SYS_FREE    R0 = address of a block -> R0 = 0, or 0xFF if R0 is not an allocated block
+#
+# LD and ST take the whole of R0, so a block above 0xFF can be used through the
+# address as returned; ADD only keeps 8 bits, so programs that index into
+# their blocks move the heap below 0x100 with 'heap'.
+#
+# Blocks are not cleared. Each remembers its owner, the load address of the
+# program that allocated it (see Emulator.program_at()), and the words asked
+# for, for the per-program statistics of the CLI 'heap' command.
+
+from array import array
+from heapq import heappop, heappush
+
+DEFAULT_HEAP_BASE = 0x8000
+DEFAULT_HEAP_WORDS = 0x4000  # 16K words, 0x8000-0xBFFF
+
+
+class HeapStats:
+    __slots__ = ('allocations', 'frees', 'failures', 'in_use', 'peak')
+
+    def __init__(self):
+        self.allocations = 0  # Successful SYS_MALLOCs
+        self.frees = 0  # Successful SYS_FREEs
+        self.failures = 0  # SYS_MALLOCs that found no block
+        self.in_use = 0  # Words asked for by the live blocks
+        self.peak = 0  # Highest in_use so far
+
+
+class Heap:
+
+    def __init__(self, base, words):
+        self.stats = {}  # Owner -> HeapStats, kept across restores
+        self.reset(base, words)
+
+    def reset(self, base, words):
+        # Make the heap an empty one over words words from base; the counters carry on
+        for stats in self.stats.values():
+            stats.in_use = 0
+        self.base = base
+        self.words = words
+        self.free = [set() for _ in range(words.bit_length())]  # Order -> free block offsets
+        self.lowest = [[] for _ in range(words.bit_length())]  # Order -> heapq of (at least) those offsets
+        self.blocks = {}  # Offset of each allocated block -> (order, words asked for, owner)
+        # Carve the region into the largest aligned blocks that fit
+        offset = 0
+        while offset < words:
+            order = (words - offset).bit_length() - 1
+            if offset:
+                order = min(order, (offset & -offset).bit_length() - 1)
+            self.add_free(order, offset)
+            offset += 1 << order
+
+    def add_free(self, order, offset):
+        # Make the block of order at offset free
+        self.free[order].add(offset)
+        lowest = self.lowest[order]
+        heappush(lowest, offset)
+        if len(lowest) > 2 * len(self.free[order]) + 8:
+            # Drop the offsets taken since they were pushed; a sorted list is a heapq
+            lowest[:] = sorted(self.free[order])
+
+    def pop_free(self, order):
+        # Take the lowest free block of order, which must have one
+        free = self.free[order]
+        lowest = self.lowest[order]
+        offset = heappop(lowest)
+        while offset not in free:
+            offset = heappop(lowest)
+        free.remove(offset)
+        return offset
+
+    def allocate(self, size, owner):
+        """
+        Allocate a block of at least size words.
+
+        Args:
+            size (int): Words wanted.
+            owner (int): The program asking, credited in the statistics.
+
+        Returns:
+            int: The block's address, or 0 if no free block is big enough.
+        """
+        if size <= 0:
+            return 0
+        want = (size - 1).bit_length()
+        stats = self.stats.get(owner)
+        if stats is None:
+            stats = self.stats[owner] = HeapStats()
+        free = self.free
+        for order in range(want, len(free)):
+            if free[order]:
+                break
+        else:
+            stats.failures += 1
+            return 0
+        offset = self.pop_free(order)
+        # Split down to the order wanted, freeing the upper halves
+        while order > want:
+            order -= 1
+            self.add_free(order, offset + (1 << order))
+        self.blocks[offset] = (want, size, owner)
+        stats.allocations += 1
+        stats.in_use += size
+        stats.peak = max(stats.peak, stats.in_use)
+        return self.base + offset
+
+    def release(self, address):
+        """
+        Free a block returned by allocate(), merging it with free buddies.
+
+        Args:
+            address (int): The block's address.
+
+        Returns:
+            int: 0, or 0xFF if address is not an allocated block.
+        """
+        offset = address - self.base
+        block = self.blocks.pop(offset, None)
+        if block is None:
+            return 0xFF
+        order, size, owner = block
+        stats = self.stats.setdefault(owner, HeapStats())
+        stats.frees += 1
+        stats.in_use -= size
+        free = self.free
+        while order + 1 < len(free):
+            buddy = offset ^ (1 << order)
+            if buddy not in free[order]:
+                break
+            # Its entry in lowest[order] is skipped when it comes to the top
+            free[order].remove(buddy)
+            offset = min(offset, buddy)
+            order += 1
+        self.add_free(order, offset)
+        return 0
+
+    def copy(self):
+        # A heap in the same state, with counters of its own, for a forked machine
+        heap = Heap(self.base, 0)
+        heap.words = self.words
+        heap.free = [set(blocks) for blocks in self.free]
+        heap.lowest = [list(blocks) for blocks in self.lowest]
+        heap.blocks = dict(self.blocks)
+        for _, size, owner in heap.blocks.values():
+            heap.stats.setdefault(owner, HeapStats()).in_use += size
+        return heap
+
+    def used_words(self):
+        # Words held by allocated blocks, rounding included
+        return sum(1 << order for order, _, _ in self.blocks.values())
+
+    def largest_free(self):
+        for order in range(len(self.free) - 1, -1, -1):
+            if self.free[order]:
+                return 1 << order
+        return 0
+
+    def fragmentation(self):
+        # External fragmentation: the share of free words outside the largest free block
+        free_words = self.words - self.used_words()
+        return 1 - self.largest_free() / free_words if free_words else 0.0
+
+    def to_array(self):
+        # The allocation state as one flat array('I'), for snapshots; the statistics are not saved
+        flat = array('I', (self.base, self.words, len(self.blocks)))
+        for offset, (order, size, owner) in self.blocks.items():
+            flat.extend((offset, order, size, owner))
+        for order, blocks in enumerate(self.free):
+            flat.append(len(blocks))
+            flat.extend(sorted(blocks))
+        return flat
+
+    def load(self, flat):
+        # Replace the allocation state with that of a to_array() result
+        self.reset(flat[0], flat[1])
+        index = 3
+        for _ in range(flat[2]):
+            offset, order, size, owner = flat[index:index + 4]
+            self.blocks[offset] = (order, size, owner)
+            index += 4
+        for order, blocks in enumerate(self.free):
+            count = flat[index]
+            blocks.clear()
+            blocks.update(flat[index + 1:index + 1 + count])
+            self.lowest[order] = sorted(blocks)
+            index += 1 + count
+        # The words in use are those of the restored blocks
+        for _, size, owner in self.blocks.values():
+            self.stats.setdefault(owner, HeapStats()).in_use += size
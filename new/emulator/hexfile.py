@@ -0,0 +1,222 @@
+# hexfile.py
+
+# Intel Hex image loading, shared by the interactive CLI and the batch farm.
+#
+# Record types understood:
+#   00  data: bytes stored one per word at the record's address
+#   01  end of file
+#   11  (17) instructions: 16-bit words, all of them stored together in free RAM
+#
+# Loading is two steps. read_hex_file() parses and checks the whole file into a
+# HexImage without touching any machine; the CLI does that on its own thread and
+# hands the image to the emulator thread as an INPUT_LOAD, which recordings keep
+# (see replay.py). load_hex_image() then claims the words it writes from the
+# selected bank's free extents (see extents.py): data records reserve the words
+# at their addresses, then the instructions get the lowest free extent their
+# exact size fits in. The boot block copied from the EPROM (see Emulator.boot())
+# is freed first: the image takes over from it. The placement is worked out on
+# a copy of the extents before anything is written, so an image that does not
+# fit leaves the machine as it was.
+#
+# The assembler also writes a symbol file next to the image (foo.hex -> foo.sym),
+# one 'address label' line per jump label, with the address in hex. Its labels
+# name guest routines in profiles and flamegraphs.
+
+import os
+import struct
+import sys
+from array import array
+
+from emulator.bus import ADDRESS_WORDS
+
+IMAGE_HEADER = struct.Struct('<III')  # HexImage.to_bytes(): name bytes, data records, instruction words
+RECORD_HEADER = struct.Struct('<II')  # Then per data record: address, words
+
+
+class HexImage:
+    # A .hex image read and checked by read_hex_file(), not yet written into any RAM
+
+    def __init__(self, name, data_records, instructions, symbols):
+        self.name = name  # Listed under this name in Emulator.programs
+        self.data_records = data_records  # (address, array('H')) per data record, one byte per word
+        self.instructions = instructions  # array('H') of every instruction word
+        self.symbols = symbols  # Address -> label, from the .sym file
+
+    def to_bytes(self):
+        # The image as one bytes object, for recordings; words in native byte order, labels left out
+        name = self.name.encode()
+        parts = [IMAGE_HEADER.pack(len(name), len(self.data_records), len(self.instructions)), name]
+        for address, words in self.data_records:
+            parts.append(RECORD_HEADER.pack(address, len(words)))
+            parts.append(words.tobytes())
+        parts.append(self.instructions.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        # The image of a to_bytes() result; raises ValueError if data is not one
+        data = bytes(data)
+        try:
+            name_size, record_count, instruction_words = IMAGE_HEADER.unpack_from(data)
+            offset = IMAGE_HEADER.size
+            name = data[offset:offset + name_size].decode()
+            offset += name_size
+            data_records = []
+            for _ in range(record_count):
+                address, size = RECORD_HEADER.unpack_from(data, offset)
+                offset += RECORD_HEADER.size
+                data_records.append((address, array('H', data[offset:offset + 2 * size])))
+                offset += 2 * size
+            instructions = array('H', data[offset:offset + 2 * instruction_words])
+            offset += 2 * instruction_words
+        except struct.error as e:
+            raise ValueError(f"Image is truncated: {e}")
+        if offset != len(data) or len(instructions) != instruction_words:
+            raise ValueError("Image is truncated or has trailing data")
+        return cls(name, data_records, instructions, {})
+
+
+def read_hex_file(filename):
+    """
+    Read and check an Intel Hex image, and the labels next to it.
+
+    Args:
+        filename (str): Path of the .hex file.
+
+    Returns:
+        HexImage: The image, named after the file.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If a record is malformed or does not fit in memory.
+    """
+    data_records = []
+    instructions = array('H')
+
+    with open(filename, "r") as hex_file:
+        for number, line in enumerate(hex_file, 1):
+            line = line.strip()  # Remove leading/trailing whitespace
+            if not line.startswith(":"):
+                continue
+            # Remove the start code ':' from the line and parse the record
+            line = line[1:]
+            try:
+                address = int(line[2:6], 16)
+                record_type = int(line[6:8], 16)
+
+                # Check if it's an end-of-file record
+                if record_type == 1:
+                    break
+
+                if record_type == 0:
+                    # Data record (00), one byte per word
+                    words = array('H', list(bytes.fromhex(line[8:])))
+                    if address + len(words) > ADDRESS_WORDS:
+                        raise ValueError(f"record at 0x{address:04X} does not fit in memory")
+                    data_records.append((address, words))
+
+                elif record_type == 17:
+                    # Instruction record (11), big-endian 16-bit words
+                    words = array('H', bytes.fromhex(line[8:]))
+                    if sys.byteorder == "little":
+                        words.byteswap()
+                    instructions.extend(words)
+            except ValueError as e:
+                raise ValueError(f"Line {number}: {e}")
+    if len(instructions) > ADDRESS_WORDS:
+        raise ValueError(f"{len(instructions)} instruction words do not fit in memory")
+
+    symbol_file = os.path.splitext(filename)[0] + ".sym"
+    symbols = load_symbol_file(symbol_file) if os.path.exists(symbol_file) else {}
+    return HexImage(os.path.basename(filename), data_records, instructions, symbols)
+
+
+def load_hex_image(emu, image):
+    """
+    Load an image read by read_hex_file() into the emulator's RAM.
+
+    Args:
+        emu (Emulator): The machine to load into.
+        image (HexImage): The image.
+
+    Returns:
+        int: The address the instructions were loaded at.
+
+    Raises:
+        ValueError: If there is no free extent big enough for the instructions;
+            nothing has been written then.
+    """
+    instructions = image.instructions
+
+    # Place the image on a copy of the free extents first
+    extents = emu.extents.copy()
+    extents.free(0, emu.boot_block_words())
+    for address, words in image.data_records:
+        extents.reserve(address, len(words))
+    if instructions and extents.allocate(len(instructions), emu.bus.code_words) < 0:
+        raise ValueError(f"No free extent of {len(instructions)} words for the instructions")
+
+    # Data records go where they say; reserve them first so the instructions are placed around them
+    emu.release_boot_block()
+    ram_memory = emu.ram_memory
+    for address, words in image.data_records:
+        copy_words(ram_memory, address, words)
+        emu.extents.reserve(address, len(words))
+
+    # The same placement as on the copy
+    memory_address = emu.allocate_memory(len(instructions)) if instructions else 0
+    copy_words(ram_memory, memory_address, instructions)
+    if instructions:
+        emu.programs[memory_address] = (memory_address + len(instructions), image.name)
+
+    # The image was copied straight into RAM, bypassing write_memory
+    emu.image_loaded()
+    emu.symbols.update(image.symbols)
+    return memory_address
+
+
+def load_hex_file(emu, filename):
+    """
+    Read an Intel Hex image and load it into the emulator's RAM.
+
+    Args:
+        emu (Emulator): The machine to load into.
+        filename (str): Path of the .hex file.
+
+    Returns:
+        int: The address the instructions were loaded at.
+
+    Raises:
+        OSError: If the file cannot be read.
+        ValueError: If a record is malformed, or there is no free extent big
+            enough for the instructions; nothing has been written then.
+    """
+    return load_hex_image(emu, read_hex_file(filename))
+
+
+def copy_words(memory, address, words):
+    # Slice copy words into memory at address; returns the address after them
+    end = address + len(words)
+    if not 0 <= address <= end <= len(memory):
+        raise ValueError(f"Record at 0x{address:04X} does not fit in memory")
+    memory[address:end] = words
+    return end
+
+
+def load_symbol_file(filename):
+    """
+    Read the labels the assembler wrote for an image.
+
+    Args:
+        filename (str): Path of the .sym file.
+
+    Returns:
+        dict: Address -> label. Where several labels share an address the first one wins.
+    """
+    symbols = {}
+    with open(filename, "r") as symbol_file:
+        for line in symbol_file:
+            fields = line.split()
+            if len(fields) == 2:
+                symbols.setdefault(int(fields[0], 16), fields[1])
+    return symbols
@@ -0,0 +1,199 @@
+# history.py
+
+# Going backwards in time.
+#
+# While the emulator thread runs, History takes a checkpoint (a zlib compressed
+# snapshot) every `interval` instructions and keeps every input the emulator
+# applies, the same inputs a recording holds (see replay.py). The program is
+# deterministic given those inputs, so the state after any earlier instruction
+# can be rebuilt: restore the nearest checkpoint before it and run forward to it
+# with the quiet turbo engine, applying the logged inputs on the way.
+#
+# Checkpoints are dropped oldest first once they take more than `budget`
+# bytes; the history then starts at the oldest one left. Going back discards
+# the future: checkpoints and inputs after the new position are forgotten and
+# running on from there is a new timeline.
+#
+# back() and reverse_continue() are called by the emulator thread when it
+# applies an INPUT_BACK or INPUT_REVERSE, and leave the machine halted. status
+# describes the outcome for the CLI.
+
+import zlib
+
+from emulator.host import HeadlessHost
+from emulator.snapshot import take_snapshot, restore_snapshot
+
+DEFAULT_HISTORY_INTERVAL = 100_000  # Instructions between checkpoints
+DEFAULT_HISTORY_BUDGET = 64 * 1024 * 1024  # Bytes of compressed checkpoints kept
+
+
+class History:
+
+    def __init__(self, emu, interval=DEFAULT_HISTORY_INTERVAL, budget=DEFAULT_HISTORY_BUDGET):
+        self.emu = emu
+        self.interval = interval
+        self.budget = budget
+        self.checkpoints = []  # (instruction count, inputs already applied, compressed snapshot), oldest first
+        self.inputs = []  # (instruction count, kind, a, b) of every input applied
+        self.size = 0  # Bytes held by the checkpoints
+        self.status = ""
+
+    def tick(self):
+        # Called by the emulator thread before each quantum: checkpoint when one is due
+        checkpoints = self.checkpoints
+        count = self.emu.instruction_count
+        if not checkpoints or count - checkpoints[-1][0] >= self.interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        data = zlib.compress(take_snapshot(self.emu), 1)
+        self.checkpoints.append((self.emu.instruction_count, len(self.inputs), data))
+        self.size += len(data)
+        # Evict the oldest checkpoints, always keeping the newest one
+        while self.size > self.budget and len(self.checkpoints) > 1:
+            self.size -= len(self.checkpoints.pop(0)[2])
+        # Inputs before the oldest checkpoint can no longer be replayed
+        first = self.checkpoints[0][1]
+        if first:
+            del self.inputs[:first]
+            self.checkpoints = [(count, index - first, data) for count, index, data in self.checkpoints]
+
+    def log(self, count, kind, a, b):
+        self.inputs.append((count, kind, a, b))
+
+    def reset(self):
+        # Forget everything, e.g. after a new program was loaded from outside
+        self.checkpoints.clear()
+        self.inputs.clear()
+        self.size = 0
+
+    def oldest(self):
+        # The earliest instruction count the history can return to
+        return self.checkpoints[0][0] if self.checkpoints else self.emu.instruction_count
+
+    def first_input_at(self, count):
+        # Index of the first logged input at or after instruction count `count`
+        for index, logged in enumerate(self.inputs):
+            if logged[0] >= count:
+                return index
+        return len(self.inputs)
+
+    def checkpoint_before(self, count):
+        # The newest checkpoint at or before instruction count `count`
+        for checkpoint in reversed(self.checkpoints):
+            if checkpoint[0] <= count:
+                return checkpoint
+        return self.checkpoints[0]
+
+    def run_forward(self, checkpoint, target, breakpoints=False):
+        """
+        Rebuild the machine from a checkpoint and run it up to instruction `target`.
+
+        Inputs logged before `target` are applied at their instruction counts;
+        syscalls are serviced by a throwaway host so nothing is printed twice.
+
+        Args:
+            checkpoint (tuple): Where to start, from self.checkpoints.
+            target (int): The instruction count to stop at.
+            breakpoints (bool): Note every breakpoint hit on the way.
+
+        Returns:
+            list: Instruction counts at which a breakpoint was about to execute.
+        """
+        emu = self.emu
+        count, index, data = checkpoint
+        restore_snapshot(emu, zlib.decompress(data))
+        inputs = self.inputs
+        cli = emu.cli
+        host = HeadlessHost()
+        emu.cli = host
+        hits = []
+        done = count
+        trace = emu.trace
+        try:
+            while done < target:
+                while index < len(inputs) and inputs[index][0] <= done:
+                    emu.apply_input(*inputs[index][1:])
+                    index += 1
+                stop = inputs[index][0] if index < len(inputs) and inputs[index][0] < target else target
+                if emu.interrupt_flag:
+                    if stop == target:
+                        break  # Halted for good
+                    done = stop  # Halted until the next input
+                    continue
+                if breakpoints:
+                    executed = emu.run_debug(max_instructions=stop - done)
+                elif trace is not None and stop > target - trace.capacity:
+                    # Run the stretch the trace buffer can show traced, so it matches the new position
+                    if done < target - trace.capacity:
+                        executed = emu.run_until(max_instructions=target - trace.capacity - done)
+                    else:
+                        executed = emu.run_traced(max_instructions=stop - done)
+                else:
+                    executed = emu.run_until(max_instructions=stop - done)
+                done += executed
+                if emu.debugger_stop:
+                    # Note the hit and carry on through the breakpoint
+                    hits.append(done)
+                    emu.debugger_stop = False
+                    emu.interrupt_flag = False
+                    emu.breakpoint_pass = emu.pc_register
+                host.service_syscalls()
+        finally:
+            emu.cli = cli
+        emu.instruction_count = done
+        return hits
+
+    def go_to(self, target):
+        # Rebuild the state after `target` instructions, forget what came after and halt there
+        emu = self.emu
+        checkpoint = self.checkpoint_before(target)
+        if emu.trace is not None:
+            emu.trace.clear()
+        self.run_forward(checkpoint, target)
+        # Inputs from before the target stay, and so do those already in the checkpoint
+        keep = max(self.first_input_at(target), checkpoint[1])
+        del self.inputs[keep:]
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints
+                            if checkpoint[0] < target or (checkpoint[0] == target and checkpoint[1] <= keep)]
+        self.size = sum(len(checkpoint[2]) for checkpoint in self.checkpoints)
+        emu.step_remaining = 0
+        emu.breakpoint_pass = None
+        emu.interrupt_flag = True
+
+    def check(self):
+        # Whether the history can be used right now; sets status when it cannot
+        if self.emu.recorder is not None:
+            self.status = "Stop the recording before going back."
+            return False
+        if not self.checkpoints:
+            self.status = "No history yet."
+            return False
+        return True
+
+    def back(self, count=1):
+        # Go back `count` instructions, or as far as the history reaches
+        if not self.check():
+            return
+        now = self.emu.instruction_count
+        target = max(now - count, self.oldest())
+        self.go_to(target)
+        self.status = f"Went back {now - target} instructions to PC 0x{self.emu.pc_register:04X}."
+        if now - target < count:
+            self.status += " The history does not reach any further."
+
+    def reverse_continue(self):
+        # Go back to the most recent breakpoint hit, or to the start of the history
+        if not self.check():
+            return
+        now = self.emu.instruction_count
+        end = now
+        for checkpoint in reversed([checkpoint for checkpoint in self.checkpoints if checkpoint[0] < now]):
+            hits = [hit for hit in self.run_forward(checkpoint, end, breakpoints=True) if hit < now]
+            if hits:
+                self.go_to(hits[-1])
+                self.status = f"Breakpoint at PC 0x{self.emu.pc_register:04X}, {now - hits[-1]} instructions back."
+                return
+            end = checkpoint[0]
+        self.go_to(self.oldest())
+        self.status = f"No breakpoint hit; went back {now - self.oldest()} instructions to the start of the history."
@@ -0,0 +1,31 @@
+# host.py
+
+# The host of a machine without a CLI. The emulator hands syscall requests that
+# need the outside world (SYS_PRINT, SYS_EXIT, SYS_UNAME) to whatever services
+# them, the CLI or a HeadlessHost, through its system_call_queue; devices send
+# their output the same way. A HeadlessHost only services them when asked to:
+# SYS_PRINT output is captured, SYS_EXIT is noted.
+
+import queue
+
+from emulator.syscalls import SYS_PRINT, SYS_EXIT, SYS_UNAME, VERSION
+
+
+class HeadlessHost:
+    # Stands in for the CLI: the emulator puts syscall requests on system_call_queue
+
+    def __init__(self):
+        self.system_call_queue = queue.SimpleQueue()
+        self.output = []
+        self.exited = False
+
+    def service_syscalls(self):
+        # Handle every queued request the way CommandLineInterface.handle_syscall does
+        while not self.system_call_queue.empty():
+            syscall_number, args = self.system_call_queue.get()
+            if syscall_number == SYS_PRINT:
+                self.output.append(args.encode().decode('unicode_escape'))
+            elif syscall_number == SYS_EXIT:
+                self.exited = True
+            elif syscall_number == SYS_UNAME:
+                self.output.append(f"Rick's Amazing Emulator version: {VERSION}\n")
@@ -0,0 +1,295 @@
+# lockstep.py
+
+# Vectorised lockstep execution of many machines with NumPy.
+#
+# N machines are held as arrays: an N x RAM_BANKS x 65536 RAM array, an N x 5
+# register matrix and one vector each for the selected bank, SP, PC, the
+# zero-flag value, carry, overflow and the halt flag. step() fetches and decodes one instruction for every
+# running machine at once, then applies each opcode to the machines that
+# fetched it with masked array updates. The instruction semantics are those
+# of Emulator (including the flag rules in flags.py), so any machine can be
+# copied back into an Emulator and compared with it, RAM banks included:
+# SYS_BANK switches a machine's bank as it does an Emulator's. There is no
+# memory bus: every page is plain RAM. There is no heap either: SYS_MALLOC
+# always fails and SYS_FREE reports a bad block.
+#
+# NumPy is optional: it is only imported by this module.
+
+from emulator.banks import RAM_BANKS
+from emulator.emulator import END_MARKER_ADDRESS
+from emulator.syscalls import SYS_PRINT, SYS_EXIT, SYS_BANK, SYS_MALLOC, SYS_FREE
+from emulator.flags import FLAGS_FIXED
+
+try:
+    import numpy as np
+except ImportError:  # Only the lockstep engine needs NumPy
+    np = None
+
+RAM_WORDS = 65536
+
+(OP_LD, OP_LI, OP_ST, OP_ADD, OP_SUB, OP_JMP, OP_BEQ, OP_BNE,
+ OP_CMP, OP_AND, OP_OR, OP_XOR, OP_SHL, OP_SHR, OP_PUSH, OP_POP) = range(16)
+
+
+class LockstepMachines:
+
+    def __init__(self, count):
+        if np is None:
+            raise ImportError("The lockstep engine needs NumPy (pip install numpy)")
+        self.count = count
+        self.rows = np.arange(count)
+        self.ram = np.zeros((count, RAM_BANKS, RAM_WORDS), dtype=np.uint16)
+        self.bank = np.zeros(count, dtype=np.int64)  # Selected RAM bank
+        self.registers = np.zeros((count, 5), dtype=np.int64)  # R0-R3 and LR
+        self.sp = np.full(count, 0xFFFF, dtype=np.int64)
+        self.pc = np.zeros(count, dtype=np.int64)
+        self.zero_result = np.ones(count, dtype=np.int64)  # Zero flag is set when this is 0
+        self.carry = np.zeros(count, dtype=bool)
+        self.overflow = np.zeros(count, dtype=bool)
+        self.halted = np.ones(count, dtype=bool)
+        self.exited = np.zeros(count, dtype=bool)  # Stopped by SYS_EXIT
+        self.output = [[] for _ in range(count)]  # Raw SYS_PRINT strings per machine
+
+    @classmethod
+    def from_emulator(cls, emu, count):
+        """
+        Make count copies of an emulator's current state.
+
+        Args:
+            emu (Emulator): The machine to copy (RAM banks, registers, SP, PC, flags, halt flag).
+            count (int): Number of machines.
+
+        Returns:
+            LockstepMachines: The machines, all in the same state.
+        """
+        machines = cls(count)
+        for index, bank in enumerate(emu.ram_banks):
+            machines.ram[:, index] = np.frombuffer(bank.memory, dtype=np.uint16)
+        machines.bank[:] = emu.current_ram_bank
+        machines.registers[:] = emu.registers
+        machines.sp[:] = emu.sp_register
+        machines.pc[:] = emu.pc_register
+        machines.zero_result[:] = 0 if emu.zero_flag else 1
+        machines.carry[:] = emu.carry_flag
+        machines.overflow[:] = emu.overflow_flag
+        machines.halted[:] = emu.interrupt_flag
+        return machines
+
+    def copy_from_emulator(self, index, emu):
+        # Set machine index to a scalar Emulator's state, e.g. to fuzz from different starting points
+        for bank_index, bank in enumerate(emu.ram_banks):
+            self.ram[index, bank_index] = np.frombuffer(bank.memory, dtype=np.uint16)
+        self.bank[index] = emu.current_ram_bank
+        self.registers[index] = emu.registers
+        self.sp[index] = emu.sp_register
+        self.pc[index] = emu.pc_register
+        self.zero_result[index] = 0 if emu.zero_flag else 1
+        self.carry[index] = emu.carry_flag
+        self.overflow[index] = emu.overflow_flag
+        self.halted[index] = emu.interrupt_flag
+
+    def copy_to_emulator(self, index, emu):
+        # Write machine index back into a scalar Emulator, e.g. to compare the two
+        cpu = emu.cpu
+        cpu.registers[:] = self.registers[index].tolist()
+        cpu.sp_register = int(self.sp[index])
+        cpu.pc_register = int(self.pc[index])
+        cpu._zero_result = int(self.zero_result[index])
+        cpu._cv_source = (FLAGS_FIXED, bool(self.carry[index]), bool(self.overflow[index]))
+        cpu.interrupt_flag = bool(self.halted[index])
+        for bank_index, bank in enumerate(emu.ram_banks):
+            # Written in place like a snapshot restore: rebuilt when next selected
+            bank.unshare()
+            memoryview(bank.memory)[:] = self.ram[index, bank_index]
+            bank.stale = True
+        emu.select_ram_bank(int(self.bank[index]))
+
+    def load(self, rows, addresses):
+        # RAM reads from the selected banks of the given machines, out of range addresses read as 0
+        valid = (addresses >= 0) & (addresses < RAM_WORDS)
+        values = np.zeros(len(rows), dtype=np.int64)
+        rows = rows[valid]
+        values[valid] = self.ram[rows, self.bank[rows], addresses[valid]]
+        return values
+
+    def store(self, rows, addresses, values):
+        # RAM writes of the low byte, out of range addresses are ignored
+        valid = (addresses >= 0) & (addresses < RAM_WORDS)
+        rows = rows[valid]
+        self.ram[rows, self.bank[rows], addresses[valid]] = values[valid] & 0xFF
+
+    def step(self):
+        """
+        Execute one instruction on every running machine.
+
+        Returns:
+            int: Number of machines that executed an instruction.
+        """
+        running = np.flatnonzero(~self.halted)
+        if len(running) == 0:
+            return 0
+
+        pc = self.pc[running]
+        instructions = self.load(running, pc)
+        opcodes = instructions >> 12
+        # Group the running machines by opcode once, then apply each group
+        order = np.argsort(opcodes, kind='stable')
+        bounds = np.searchsorted(opcodes[order], np.arange(17))
+        for opcode in range(16):
+            group = order[bounds[opcode]:bounds[opcode + 1]]
+            if len(group):
+                words = instructions[group]
+                self.execute(opcode, running[group], (words >> 10) & 0x3, (words >> 8) & 0x3, words & 0xFF)
+
+        # The PC moves on after every instruction; past the end marker the machine halts
+        pc = self.pc[running] + 1
+        self.pc[running] = pc
+        self.halted[running[pc > END_MARKER_ADDRESS]] = True
+        return len(running)
+
+    def execute(self, opcode, rows, Rd, Rn, operands):
+        # Apply one opcode to the machines in rows (Rd, Rn, operands are per row)
+        registers = self.registers
+        if opcode == OP_LD:
+            value = self.load(rows, registers[rows, Rn])
+            registers[rows, Rd] = value
+            self.zero_result[rows] = value
+        elif opcode == OP_LI:
+            registers[rows, Rd] = operands
+        elif opcode == OP_ST:
+            self.store(rows, registers[rows, Rn], registers[rows, Rd])
+        elif opcode == OP_ADD:
+            result = registers[rows, Rn] + operands
+            self.carry[rows] = result > 255
+            self.overflow[rows] = (result > 127) | (result < -128)
+            registers[rows, Rd] = self.zero_result[rows] = result & 0xFF
+        elif opcode == OP_SUB:
+            result = registers[rows, Rn] - operands
+            value = result & 0xFF
+            registers[rows, Rd] = self.zero_result[rows] = value
+            # The borrow compares with Rn after the write, like Emulator.subtract
+            self.carry[rows] = value < registers[rows, Rn]
+            self.overflow[rows] = (result > 127) | (result < -128)
+        elif opcode == OP_JMP:
+            registers[rows, 4] = self.pc[rows]
+            self.pc[rows] = operands
+        elif opcode == OP_BEQ:
+            taken = self.zero_result[rows] == 0
+            self.pc[rows[taken]] = operands[taken]
+        elif opcode == OP_BNE:
+            taken = self.zero_result[rows] != 0
+            self.pc[rows[taken]] = operands[taken]
+        elif opcode == OP_CMP:
+            destination = registers[rows, Rd]
+            # If both Rd & Rn are zero then it is an immediate check
+            source = np.where((Rd == 0) & (Rn == 0), operands, registers[rows, Rn])
+            result = destination - source
+            self.zero_result[rows] = result
+            self.carry[rows] = destination < source
+            self.overflow[rows] = (result > 32767) | (result < -32768)
+        elif opcode in (OP_AND, OP_OR, OP_XOR):
+            source = np.where(Rn == 0, operands, registers[rows, Rn])
+            if opcode == OP_AND:
+                value = registers[rows, Rd] & source
+            elif opcode == OP_OR:
+                value = registers[rows, Rd] | source
+            else:
+                value = registers[rows, Rd] ^ source
+            registers[rows, 0] = self.zero_result[rows] = value
+        elif opcode == OP_SHL:
+            source = registers[rows, Rn]
+            # Registers hold at most 16 bits, so shifts of 16 or more leave the low 9 bits clear
+            result = np.where(operands < 16, source << np.minimum(operands, 15), 0)
+            self.carry[rows] = False
+            self.overflow[rows] = (result & 0x100) != 0
+            registers[rows, Rd] = self.zero_result[rows] = result & 0xFF
+        elif opcode == OP_SHR:
+            source = registers[rows, Rn]
+            result = np.where(operands < 63, source >> np.minimum(operands, 62), 0)
+            self.carry[rows] = False
+            self.overflow[rows] = (source & 0x80) != 0
+            registers[rows, Rd] = self.zero_result[rows] = result & 0xFF
+        elif opcode == OP_PUSH:
+            self.push(rows, Rd, Rn, operands)
+        else:
+            syscalls = (operands & 0x80) != 0
+            if syscalls.any():
+                for row, number in zip(rows[syscalls].tolist(), (operands[syscalls] & 0x7F).tolist()):
+                    self.syscall(row, number)
+            popping = ~syscalls
+            self.pop(rows[popping], Rd[popping], Rn[popping], operands[popping])
+
+    def push(self, rows, Rd, Rn, operands):
+        # Rd first, then Rn (bit 0), then each register named in the mask
+        registers = self.registers
+        slots = [(np.ones(len(rows), dtype=bool), registers[rows, Rd]),
+                 ((operands & 0x01) != 0, registers[rows, Rn])]
+        slots.extend(((operands & (1 << i)) != 0, registers[rows, i]) for i in range(5))
+        for selected, values in slots:
+            if selected.any():
+                selected_rows = rows[selected]
+                self.sp[selected_rows] -= 1
+                self.store(selected_rows, self.sp[selected_rows], values[selected])
+
+    def pop(self, rows, Rd, Rn, operands):
+        if len(rows) == 0:
+            return
+        registers = self.registers
+        destinations = [((operands & 0x01) != 0, Rd), ((operands & 0x02) != 0, Rn)]
+        destinations.extend(((operands & (1 << i)) != 0, np.full(len(rows), i)) for i in range(5))
+        # Pop LR again and return through it
+        destinations.append(((operands & 0x10) != 0, np.full(len(rows), 4)))
+        for selected, register in destinations:
+            if selected.any():
+                selected_rows = rows[selected]
+                registers[selected_rows, register[selected]] = self.load(selected_rows, self.sp[selected_rows])
+                self.sp[selected_rows] += 1
+        returning = rows[(operands & 0x10) != 0]
+        self.pc[returning] = registers[returning, 4]
+
+    def syscall(self, row, number):
+        # Service a syscall for one machine, as the batch runner's host does
+        if number == SYS_PRINT:
+            address = int(self.registers[row, 0])
+            memory = self.ram[row, self.bank[row]]
+            characters = []
+            while 0 <= address < RAM_WORDS and memory[address] != 0:
+                characters.append(chr(memory[address]))
+                address += 1
+            # Kept exactly as the guest wrote it, escapes are left to whoever prints it
+            self.output[row].append("".join(characters))
+        elif number == SYS_EXIT:
+            self.exited[row] = True
+            self.halted[row] = True
+        elif number == SYS_BANK:
+            # Carries on at the next address of the newly selected bank
+            bank = int(self.registers[row, 0])
+            if 0 <= bank < RAM_BANKS:
+                self.registers[row, 0] = self.bank[row]
+                self.bank[row] = bank
+            else:
+                self.registers[row, 0] = 0xFF
+        elif number == SYS_FREE:
+            self.registers[row, 0] = 0xFF  # Not a block, see the header
+        elif number == SYS_MALLOC:
+            self.registers[row, 0] = 0
+
+    def run(self, max_steps=None):
+        """
+        Step every machine until all of them halt.
+
+        Args:
+            max_steps (int): Stop after this many steps (None for no limit).
+
+        Returns:
+            int: Total instructions executed across all machines.
+        """
+        executed = 0
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            stepped = self.step()
+            if stepped == 0:
+                break
+            executed += stepped
+            steps += 1
+        return executed
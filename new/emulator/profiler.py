@@ -0,0 +1,120 @@
+# profiler.py
+
+# Execution profile of a guest program.
+#
+# Counters are preallocated array('Q') buffers, never dicts:
+#
+#   address_counts     executions of each RAM address
+#   opcode_counts      executions of each of the 16 opcodes
+#   branch_taken       BEQ/BNE executions at each address that branched
+#   branch_not_taken   BEQ/BNE executions at each address that fell through
+#
+# call_graph attributes the same instructions to guest routines (callgraph.py).
+#
+# The emulator's run_profiled() loop updates the arrays inline; count() does the
+# same for the logging interpreter. Reports pair each hot address with the
+# instruction word currently at it, disassembled.
+
+import csv
+import heapq
+import json
+from array import array
+
+from emulator.callgraph import CallGraph
+from emulator.disassembler import disassemble, MNEMONICS
+from emulator.fusion import OP_BEQ, OP_BNE
+
+CSV_FIELDS = ('address', 'count', 'percent', 'instruction', 'disassembly', 'taken', 'not_taken')
+
+
+class Profiler:
+
+    def __init__(self, memory_size, symbols=None):
+        self.address_counts = array('Q', bytes(8 * memory_size))
+        self.opcode_counts = array('Q', bytes(8 * len(MNEMONICS)))
+        self.branch_taken = array('Q', bytes(8 * memory_size))
+        self.branch_not_taken = array('Q', bytes(8 * memory_size))
+        self.call_graph = CallGraph(symbols)
+
+    def count(self, pc, instruction, cpu):
+        # Count the instruction at pc, before it runs
+        opcode = instruction >> 12
+        self.opcode_counts[opcode] += 1
+        if 0 <= pc < len(self.address_counts):
+            self.address_counts[pc] += 1
+            if opcode == OP_BEQ or opcode == OP_BNE:
+                if (cpu._zero_result == 0) == (opcode == OP_BEQ):
+                    self.branch_taken[pc] += 1
+                else:
+                    self.branch_not_taken[pc] += 1
+
+    def reset(self):
+        # Zero every counter in place
+        for counters in (self.address_counts, self.opcode_counts, self.branch_taken, self.branch_not_taken):
+            counters[:] = array('Q', bytes(8 * len(counters)))
+        self.call_graph.reset()
+
+    def total(self):
+        # Instructions counted since the last reset
+        return sum(self.opcode_counts)
+
+    def hot_spots(self, memory, count=None):
+        """
+        List the most executed addresses.
+
+        Args:
+            memory (sequence): RAM, used to disassemble each address.
+            count (int): How many addresses to return (None for every executed one).
+
+        Returns:
+            list: One dict per address, most executed first, with the keys in CSV_FIELDS.
+        """
+        counts = self.address_counts
+        executed = [address for address in range(len(counts)) if counts[address]]
+        if count is None:
+            executed.sort(key=counts.__getitem__, reverse=True)
+        else:
+            executed = heapq.nlargest(count, executed, key=counts.__getitem__)
+        total = self.total() or 1
+        spots = []
+        for address in executed:
+            instruction = memory[address]
+            spots.append({
+                'address': address,
+                'count': counts[address],
+                'percent': 100.0 * counts[address] / total,
+                'instruction': instruction,
+                'disassembly': disassemble(instruction),
+                'taken': self.branch_taken[address],
+                'not_taken': self.branch_not_taken[address],
+            })
+        return spots
+
+    def opcode_profile(self):
+        # Mnemonic -> executions, for the opcodes that ran
+        return {MNEMONICS[opcode]: count for opcode, count in enumerate(self.opcode_counts) if count}
+
+    def export(self, filename, memory):
+        """
+        Write the profile to a file, CSV when the name ends in .csv, JSON otherwise.
+
+        Args:
+            filename (str): Where to write the profile.
+            memory (sequence): RAM, used to disassemble each address.
+
+        Returns:
+            int: The number of addresses written.
+        """
+        spots = self.hot_spots(memory)
+        if filename.endswith(".csv"):
+            with open(filename, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+                writer.writerows(spots)
+        else:
+            with open(filename, "w") as f:
+                routines = {name: {'inclusive': inclusive, 'exclusive': exclusive}
+                            for name, (inclusive, exclusive) in self.call_graph.routines().items()}
+                json.dump({'instructions': self.total(), 'opcodes': self.opcode_profile(), 'addresses': spots,
+                           'routines': routines}, f, indent=2)
+        return len(spots)
@@ -0,0 +1,155 @@
+# replay.py
+
+# Deterministic record and replay.
+#
+# The guest program itself is deterministic; everything that is not arrives as
+# an input posted to the emulator (Emulator.post_input): CLI pokes, the PC change
+# that SYS_EXIT makes, resuming after a halt, results handed back to the guest
+# and, later, input devices. The emulator thread applies inputs between quanta,
+# so each one lands at an exact instruction count, and that is what a recording
+# holds:
+#
+#   header     RECORDING_HEADER: magic and the length of the snapshot
+#   snapshot   zlib compressed snapshot of the machine when recording started
+#   events     EVENT records: instruction count since the start, input kind, a, b;
+#              an INPUT_LOAD has b = the size of the image, whose bytes
+#              (HexImage.to_bytes()) follow the record in place of a
+#   end        an EVENT_END record: final instruction count and the CRC-32 of
+#              the final snapshot, to check a replay against
+#
+# A replay restores the snapshot and runs the quiet turbo engine up to each
+# event's instruction count, applies the input and carries on. No CLI thread is
+# involved and syscall output is only collected, never printed.
+
+import struct
+import zlib
+
+from emulator.emulator import INPUT_LOAD
+from emulator.hexfile import HexImage
+from emulator.host import HeadlessHost
+from emulator.snapshot import take_snapshot, restore_snapshot, SnapshotError
+
+RECORDING_MAGIC = b"EMR2"
+RECORDING_HEADER = struct.Struct('<4sI')
+EVENT = struct.Struct('<QBII')
+EVENT_END = 0  # Closes a recording: a = CRC-32 of the final snapshot
+
+
+class Recorder:
+
+    def __init__(self, filename):
+        # Opened here so that a bad filename fails in the caller's thread
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.start_count = 0
+        self.events = 0
+
+    def start(self, emu):
+        # Called by the emulator thread: capture the starting state
+        snapshot = zlib.compress(take_snapshot(emu), 1)
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, len(snapshot)))
+        self.file.write(snapshot)
+        self.start_count = emu.instruction_count
+
+    def log(self, count, kind, a, b):
+        # One input, applied after `count` instructions of the emulator's run
+        if kind == INPUT_LOAD:
+            # The image itself, so a replay does not depend on the file
+            image = a.to_bytes()
+            self.file.write(EVENT.pack(count - self.start_count, kind, 0, len(image)))
+            self.file.write(image)
+        else:
+            self.file.write(EVENT.pack(count - self.start_count, kind, a, b))
+        self.events += 1
+
+    def stop(self, emu):
+        # Called by the emulator thread: close the recording with the final state
+        final_state = zlib.crc32(take_snapshot(emu))
+        self.file.write(EVENT.pack(emu.instruction_count - self.start_count, EVENT_END, final_state, 0))
+        self.file.close()
+
+
+def read_recording(filename):
+    """
+    Read a recording written by Recorder.
+
+    Args:
+        filename (str): The recording file.
+
+    Returns:
+        tuple: (snapshot, events, end) where snapshot is the uncompressed starting
+            state, events a list of (count, kind, a, b) and end the (count, crc)
+            of the final state.
+
+    Raises:
+        SnapshotError: If the file is not a complete recording.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if len(data) < RECORDING_HEADER.size:
+        raise SnapshotError("Recording is truncated")
+    magic, snapshot_size = RECORDING_HEADER.unpack_from(data)
+    if magic != RECORDING_MAGIC:
+        raise SnapshotError("Not a recording")
+    offset = RECORDING_HEADER.size + snapshot_size
+    try:
+        snapshot = zlib.decompress(data[RECORDING_HEADER.size:offset])
+    except zlib.error as e:
+        raise SnapshotError(f"Recording is corrupt: {e}")
+    events = []
+    while True:
+        if offset + EVENT.size > len(data):
+            raise SnapshotError("Recording is truncated (was it stopped?)")
+        count, kind, a, b = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        if kind == EVENT_END:
+            break
+        if kind == INPUT_LOAD:
+            if offset + b > len(data):
+                raise SnapshotError("Recording is truncated (was it stopped?)")
+            try:
+                a = HexImage.from_bytes(data[offset:offset + b])
+            except ValueError as e:
+                raise SnapshotError(f"Recording is corrupt: {e}")
+            offset += b
+        events.append((count, kind, a, b))
+    if offset != len(data):
+        raise SnapshotError("Recording has trailing data")
+    return snapshot, events, (count, a)
+
+
+def run_to(emu, host, done, count):
+    # Run from instruction `done` up to `count`, or until the program halts
+    while done < count and not emu.interrupt_flag:
+        done += emu.run_until(max_instructions=count - done)
+        host.service_syscalls()
+    return done
+
+
+def replay_recording(emu, filename):
+    """
+    Re-run a recorded execution on emu, headless and at turbo speed.
+
+    Args:
+        emu (Emulator): The machine to replay on; its state is replaced.
+        filename (str): The recording file.
+
+    Returns:
+        dict: instructions replayed, events applied, the guest's output and
+            whether the final state matched the recording bit for bit.
+    """
+    snapshot, events, (end_count, final_state) = read_recording(filename)
+    host = HeadlessHost()
+    emu.cli = host
+    restore_snapshot(emu, snapshot)
+    done = 0
+    for count, kind, a, b in events:
+        done = run_to(emu, host, done, count)
+        emu.apply_input(kind, a, b)
+    done = run_to(emu, host, done, end_count)
+    return {
+        'instructions': done,
+        'events': len(events),
+        'output': "".join(host.output),
+        'matched': done == end_count and zlib.crc32(take_snapshot(emu)) == final_state,
+    }
@@ -0,0 +1,169 @@
+# snapshot.py
+
+# Full-machine save states.
+#
+# A snapshot is one bytes object:
+#
+#   header    SNAPSHOT_HEADER: magic, number of RAM banks, bank and EPROM sizes in words
+#   CPU       the CPUState record (cpustate.STATE_FORMAT), selected RAM bank included
+#   RAM       every word of every RAM bank, bank 0 first, as native unsigned 16-bit values
+#   alloc     the free extents, the heap and the loaded programs of every RAM
+#             bank, bank 0 first: records of native unsigned 32-bit values, each
+#             its length then the values of FreeExtents.to_array(),
+#             Heap.to_array() or programs_to_array()
+#
+# The EPROM is a read-only image on disk (see eprom.py) and is not saved; only
+# its size is, and a snapshot is only restored onto a machine with an EPROM of
+# that size.
+#
+# RAM banks are array('H') buffers (or, in a fork, memoryviews of a mapped image,
+# see banks.py), so taking a snapshot joins them as they are and restoring one
+# is a memoryview copy into them: a machine with three 64K word
+# banks costs well under a millisecond either way.
+# Snapshot files hold the same bytes compressed with zlib.
+
+import struct
+import sys
+import zlib
+from array import array
+
+from emulator.cpustate import CPUState, STATE_SIZE
+
+SNAPSHOT_MAGIC = f"EMS6{sys.byteorder[0]}".encode()  # Words are stored in native byte order
+SNAPSHOT_HEADER = struct.Struct(f'<{len(SNAPSHOT_MAGIC)}sIII')
+ALLOC_WORD = array('I').itemsize
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def programs_to_array(programs):
+    # A bank's loaded programs (RamBank.programs) as one flat array('I'): per program
+    # its start, end and name length in bytes, then the UTF-8 name padded to whole values
+    flat = array('I')
+    for start, (end, name) in programs.items():
+        encoded = name.encode()
+        flat.extend((start, end, len(encoded)))
+        flat.frombytes(encoded.ljust(-(-len(encoded) // ALLOC_WORD) * ALLOC_WORD, b"\0"))
+    return flat
+
+
+def programs_from_array(flat):
+    # The program list of a programs_to_array() result
+    programs = {}
+    index = 0
+    while index < len(flat):
+        if index + 3 > len(flat):
+            raise SnapshotError("Snapshot is truncated")
+        start, end, size = flat[index:index + 3]
+        index += 3
+        words = -(-size // ALLOC_WORD)
+        if index + words > len(flat):
+            raise SnapshotError("Snapshot is truncated")
+        try:
+            programs[start] = (end, flat[index:index + words].tobytes()[:size].decode())
+        except UnicodeDecodeError:
+            raise SnapshotError("Snapshot has a corrupt program name")
+        index += words
+    return programs
+
+
+def take_snapshot(emu):
+    """
+    Serialise the whole machine: CPU state, every RAM bank and its allocation state.
+
+    Args:
+        emu (Emulator): The machine to capture.
+
+    Returns:
+        bytes: The uncompressed snapshot.
+    """
+    banks = [bank.memory for bank in emu.ram_banks]
+    alloc = array('I')
+    for bank in emu.ram_banks:
+        for flat in (bank.extents.to_array(), bank.heap.to_array(), programs_to_array(bank.programs)):
+            alloc.append(len(flat))
+            alloc.extend(flat)
+    return b"".join((SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(banks), len(banks[0]), len(emu.eprom_memory)),
+                     emu.cpu.to_bytes(), *banks, alloc))
+
+
+def restore_snapshot(emu, data):
+    """
+    Put the machine back into the state captured by take_snapshot().
+
+    Args:
+        emu (Emulator): The machine to restore.
+        data (bytes-like): An uncompressed snapshot.
+
+    Raises:
+        SnapshotError: If data is not a snapshot this build can read.
+    """
+    view = memoryview(data)
+    if len(view) < SNAPSHOT_HEADER.size:
+        raise SnapshotError("Snapshot is truncated")
+    magic, bank_count, ram_words, eprom_words = SNAPSHOT_HEADER.unpack_from(view)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("Not a snapshot, or one from a machine with a different byte order")
+    cpu_offset = SNAPSHOT_HEADER.size
+    ram_offset = cpu_offset + STATE_SIZE
+    alloc_offset = ram_offset + 2 * ram_words * bank_count
+    if len(view) < alloc_offset or (len(view) - alloc_offset) % ALLOC_WORD:
+        raise SnapshotError("Snapshot is truncated")
+    alloc = view[alloc_offset:].cast('I')
+    records = []
+    index = 0
+    for _ in range(3 * bank_count):
+        if index >= len(alloc) or index + 1 + alloc[index] > len(alloc):
+            raise SnapshotError("Snapshot is truncated")
+        records.append(alloc[index + 1:index + 1 + alloc[index]])
+        index += 1 + alloc[index]
+    if index != len(alloc):
+        raise SnapshotError("Snapshot has trailing data")
+    banks = emu.ram_banks
+    if bank_count != len(banks) or ram_words != len(banks[0].memory):
+        raise SnapshotError("Snapshot is of a machine with a different memory size")
+    if eprom_words != len(emu.eprom_memory):
+        raise SnapshotError(f"Snapshot was taken with a {eprom_words} word EPROM image attached")
+    if not 0 <= CPUState.from_bytes(view, cpu_offset).current_ram_bank < bank_count:
+        raise SnapshotError("Snapshot selects a RAM bank that does not exist")
+    programs = [programs_from_array(records[3 * index + 2]) for index in range(bank_count)]
+
+    emu.cpu.load_bytes(view, cpu_offset)
+    # Straight memory copies; the arrays keep their identity so anything holding
+    # a reference sees the new contents
+    for index, bank in enumerate(banks):
+        # Written in place, so no page is the one a fork shares any more
+        bank.unshare()
+        memoryview(bank.memory)[:] = view[ram_offset:ram_offset + 2 * ram_words].cast('H')
+        ram_offset += 2 * ram_words
+        bank.extents.load(records[3 * index])
+        bank.heap.load(records[3 * index + 1])
+        bank.programs.clear()
+        bank.programs.update(programs[index])
+        # Translations and fused pairs of the old contents are no longer valid
+        bank.stale = True
+    # Rebuilds the selected bank now, the others when they are selected
+    emu.select_ram_bank(emu.cpu.current_ram_bank)
+
+
+def save_snapshot(emu, filename):
+    # Write a zlib compressed snapshot of the machine to filename
+    with open(filename, "wb") as f:
+        f.write(memoryview(zlib.compress(take_snapshot(emu), 1)))
+
+
+def read_snapshot_file(filename):
+    # The uncompressed snapshot in a file written by save_snapshot()
+    with open(filename, "rb") as f:
+        compressed = f.read()
+    try:
+        return zlib.decompress(compressed)
+    except zlib.error as e:
+        raise SnapshotError(f"Snapshot file is corrupt: {e}")
+
+
+def load_snapshot(emu, filename):
+    # Restore the machine from a file written by save_snapshot()
+    restore_snapshot(emu, read_snapshot_file(filename))
@@ -0,0 +1,34 @@
+# syscalls.py
+
+# Syscall numbers, shared by the emulator, the CLI and headless hosts. A guest
+# makes syscall n with a POP whose operand has bit 7 set and n in bits 6-0.
+
+SYS_PRINT = 1
+SYS_EXIT = 0
+
+# File I/O
+SYS_OPEN = 2
+SYS_READ = 3
+SYS_WRITE = 4
+SYS_CLOSE = 5
+SYS_SEEK = 8
+
+# Memory Management
+SYS_MALLOC = 92
+SYS_FREE = 93
+
+# Time and Date
+SYS_GETTIMEOFDAY = 96
+SYS_SLEEP = 11
+
+# File and Directory Operations
+SYS_MKDIR = 83
+SYS_RMDIR = 84
+SYS_RENAME = 82
+
+# System Information
+SYS_UNAME = 63
+VERSION = '8.0.0'  # Reported by SYS_UNAME, by the CLI and by headless hosts alike
+
+# RAM banks: R0 = bank to select, returns the previous bank in R0 (0xFF if R0 is not a bank)
+SYS_BANK = 12
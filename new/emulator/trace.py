@@ -0,0 +1,115 @@
+# trace.py
+
+# Execution trace ring buffer.
+#
+# The last `capacity` instructions are kept in one preallocated array('q'),
+# RECORD_WORDS integers per record, overwriting the oldest. A record is the
+# state just before the instruction ran:
+#
+#   PC, instruction word, R0-R3, LR, SP, then the lazy flag record
+#   (zero-flag value, carry/overflow kind, a, b - see flags.py)
+#
+# Recording is one struct.pack_into() call with no string formatting; flags are
+# only worked out and packed (FLAG_ZERO | FLAG_CARRY | FLAG_OVERFLOW) when the
+# trace is dumped.
+
+import struct
+import sys
+from array import array
+
+from emulator.flags import carry_and_overflow, FLAGS_SHL
+
+DEFAULT_TRACE_SIZE = 4096  # Instructions kept by default
+RECORD_WORDS = 12
+RECORD = struct.Struct(f'{RECORD_WORDS}q')  # Native layout, written straight into the array
+
+# Packed flag bits in dumped records
+FLAG_ZERO = 0x1
+FLAG_CARRY = 0x2
+FLAG_OVERFLOW = 0x4
+
+# Binary dumps: header, then per record PC, instruction, R0-R3, LR, SP and packed
+# flags as native int64, oldest record first
+DUMP_MAGIC = f"EMT1{sys.byteorder[0]}".encode()
+DUMP_HEADER = struct.Struct(f'<{len(DUMP_MAGIC)}sII')
+DUMP_WORDS = 9
+
+
+class TraceBuffer:
+
+    def __init__(self, capacity=DEFAULT_TRACE_SIZE):
+        self.capacity = capacity
+        self.data = array('q', bytes(8 * RECORD_WORDS * capacity))
+        self.position = 0  # Next record slot
+        self.count = 0  # Records held, at most capacity
+
+    def record(self, pc, instruction, cpu):
+        # Store the state before the instruction at pc runs
+        r0, r1, r2, r3, lr = cpu.registers
+        kind, a, b = cpu._cv_source
+        if kind == FLAGS_SHL:
+            # Unmasked shift results can outgrow 64 bits; only bit 8 is ever read
+            a &= 0x1FF
+        RECORD.pack_into(self.data, self.position * RECORD.size, pc, instruction,
+                         r0, r1, r2, r3, lr, cpu.sp_register, cpu._zero_result, kind, a, b)
+        position = self.position + 1
+        self.position = 0 if position == self.capacity else position
+        if self.count < self.capacity:
+            self.count += 1
+
+    def clear(self):
+        self.position = 0
+        self.count = 0
+
+    def records(self, last=None):
+        """
+        Return the recorded instructions, oldest first, with the flags packed.
+
+        Args:
+            last (int): Only the most recent `last` records (None for all of them).
+
+        Returns:
+            list: (pc, instruction, r0, r1, r2, r3, lr, sp, flags) tuples.
+        """
+        count = self.count if last is None else min(last, self.count)
+        data = self.data
+        records = []
+        for i in range(self.position - count, self.position):
+            fields = RECORD.unpack_from(data, (i % self.capacity) * RECORD.size)
+            carry, overflow = carry_and_overflow((fields[9], fields[10], fields[11]))
+            flags = (FLAG_ZERO if fields[8] == 0 else 0) | (FLAG_CARRY if carry else 0) | (FLAG_OVERFLOW if overflow else 0)
+            records.append(fields[:8] + (flags,))
+        return records
+
+    def format_records(self, last=None):
+        # One line of text per record
+        lines = []
+        for pc, instruction, r0, r1, r2, r3, lr, sp, flags in self.records(last):
+            lines.append(f"PC 0x{pc:04X}  0x{instruction:04X}  R0 0x{r0:02X} R1 0x{r1:02X} R2 0x{r2:02X} "
+                         f"R3 0x{r3:02X} LR 0x{lr:04X} SP 0x{sp:04X}  "
+                         f"Z{1 if flags & FLAG_ZERO else 0} C{1 if flags & FLAG_CARRY else 0} V{1 if flags & FLAG_OVERFLOW else 0}")
+        return lines
+
+    def dump(self, filename):
+        """
+        Write the trace to a file, binary when the name ends in .bin, text otherwise.
+
+        Args:
+            filename (str): Where to write the trace.
+
+        Returns:
+            int: The number of records written.
+        """
+        records = self.records()
+        if filename.endswith(".bin"):
+            packed = array('q')
+            for record in records:
+                packed.extend(record)
+            with open(filename, "wb") as f:
+                f.write(DUMP_HEADER.pack(DUMP_MAGIC, DUMP_WORDS, len(records)))
+                f.write(memoryview(packed))
+        else:
+            with open(filename, "w") as f:
+                for line in self.format_records():
+                    f.write(line + "\n")
+        return len(records)
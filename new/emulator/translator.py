@@ -0,0 +1,330 @@
+# translator.py
+
+# Basic-block translation cache.
+#
+# A basic block is a run of straight-line instructions starting at some PC and
+# ending at the first control-flow instruction (JMP, BEQ, BNE, POP with LR,
+# syscall). Each block is translated once into a generated Python function that
+# keeps the registers, SP and flags in local variables, and is cached by its
+# start address. Any write into a block's address range throws it away so that
+# self-modifying code keeps working.
+#
+# Flags follow the lazy scheme in flags.py. Only BEQ/BNE read a flag inside a
+# block, so a carry/overflow record that is overwritten before anything can
+# observe it is not generated at all.
+#
+# When the emulator has ALU tables turned on (alu.py), 8-bit ALU operations are
+# generated as table lookups so blocks produce exactly the turbo engine's results.
+
+from emulator.turbo import store
+from emulator.flags import FLAGS_ADD, FLAGS_SUB, FLAGS_CMP, FLAGS_SHL, FLAGS_SHR, FLAGS_PACKED, CARRY_BIT
+
+MAX_BLOCK_LENGTH = 64  # Upper bound on instructions per block
+
+OP_LD, OP_LI, OP_ST, OP_ADD, OP_SUB, OP_JMP, OP_BEQ, OP_BNE = range(8)
+OP_CMP, OP_AND, OP_OR, OP_XOR, OP_SHL, OP_SHR, OP_PUSH, OP_POP = range(8, 16)
+
+
+def ends_block(opcode, operands):
+    # Control-flow instructions always finish a block
+    if opcode in (OP_JMP, OP_BEQ, OP_BNE):
+        return True
+    # POP ends a block when it is a syscall (bit 7) or restores the PC from LR (bit 4)
+    return opcode == OP_POP and operands & 0x90 != 0
+
+
+def live_flag_records(instructions):
+    # For each instruction, whether its carry/overflow record can be observed.
+    # Records are observed wherever the block may hand its state back: after a
+    # store (early exit), at a syscall and at the end of the block.
+    live = [False] * len(instructions)
+    needed = True
+    for index in range(len(instructions) - 1, -1, -1):
+        instruction = instructions[index][1]
+        opcode = (instruction >> 12) & 0xF
+        if opcode in (OP_ST, OP_PUSH) or ends_block(opcode, instruction & 0xFF):
+            needed = True
+        elif opcode in (OP_ADD, OP_SUB, OP_CMP, OP_SHL, OP_SHR):
+            live[index] = needed
+            needed = False
+    return live
+
+
+class BlockCache:
+
+    def __init__(self, emulator, end_marker_address):
+        self.emulator = emulator
+        self.end_marker_address = end_marker_address
+        self.blocks = {}  # Start address -> translated block function
+        self.ranges = {}  # Start address -> (first, last) address covered by the block
+        self.owners = {}  # Address -> set of block start addresses covering it
+        self.generation = 0  # Bumped on every invalidation so running blocks can bail out
+
+    def lookup(self, address):
+        # Return the block starting at address, translating it on first use
+        block = self.blocks.get(address)
+        if block is None:
+            block = self.translate(address)
+        return block
+
+    def invalidate(self, address):
+        # Drop every block that covers the written address
+        starts = self.owners.pop(address, None)
+        if not starts:
+            return
+        self.generation += 1
+        for start in list(starts):
+            self.blocks.pop(start, None)
+            first, last = self.ranges.pop(start)
+            for covered in range(first, last + 1):
+                owners = self.owners.get(covered)
+                if owners is not None:
+                    owners.discard(start)
+                    if not owners:
+                        del self.owners[covered]
+
+    def clear(self):
+        # Forget every translated block (e.g. after loading a new program)
+        if self.blocks:
+            self.generation += 1
+        self.blocks.clear()
+        self.ranges.clear()
+        self.owners.clear()
+
+    def discover(self, start):
+        # Collect the (address, instruction) pairs that make up the block at start
+        memory = self.emulator.ram_memory
+        instructions = []
+        address = start
+        while 0 <= address < len(memory):
+            instruction = memory[address]
+            instructions.append((address, instruction))
+            opcode = (instruction >> 12) & 0xF
+            # Stop at control flow, at the end marker (where the CPU halts) and at the size limit
+            if (ends_block(opcode, instruction & 0xFF)
+                    or address + 1 >= self.end_marker_address
+                    or len(instructions) >= MAX_BLOCK_LENGTH):
+                break
+            address += 1
+        return instructions
+
+    def translate(self, start):
+        instructions = self.discover(start)
+        if not instructions:
+            return None
+
+        tables = self.emulator.alu_tables
+        source = generate_block_source(instructions, alu_tables=tables is not None)
+        namespace = {
+            'END_MARKER_ADDRESS': self.end_marker_address,
+            'cache': self,
+            'store': store,
+        }
+        if tables is not None:
+            namespace.update(ADD_TABLE=tables.add, SUB_TABLE=tables.sub, SHL_TABLE=tables.shl,
+                             SHR_TABLE=tables.shr, AND_TABLE=tables.and_, OR_TABLE=tables.or_,
+                             XOR_TABLE=tables.xor)
+        exec(compile(source, f"<block 0x{start:04X}>", "exec"), namespace)
+        block = namespace['block']
+
+        # Register the block and the addresses it was built from
+        first, last = start, instructions[-1][0]
+        self.blocks[start] = block
+        self.ranges[start] = (first, last)
+        for address in range(first, last + 1):
+            self.owners.setdefault(address, set()).add(start)
+        return block
+
+
+def generate_block_source(instructions, alu_tables=False):
+    """
+    Generate the Python source of one translated block.
+
+    Args:
+        instructions (list): (address, instruction) pairs in execution order.
+        alu_tables (bool): Generate 8-bit ALU operations as lookups in the
+            ADD_TABLE, SUB_TABLE, ... arrays supplied by the caller.
+
+    Returns:
+        str: Source defining block(emu), which runs the instructions, writes the
+            CPU state back to the emulator and returns the number executed.
+    """
+    lines = [
+        "def block(emu):",
+        "    mem = emu.ram_memory",
+        "    size = len(mem)",
+        "    cpu = emu.cpu",
+        "    regs = cpu.registers",
+        "    r0, r1, r2, r3, r4 = regs",
+        "    sp = cpu.sp_register",
+        "    zr = cpu._zero_result",
+        "    cv = cpu._cv_source",
+        "    generation = cache.generation",
+    ]
+
+    level = [1]  # Current indentation of the generated statements
+
+    def emit(text, indent=None):
+        lines.append("    " * (level[0] if indent is None else indent) + text)
+
+    def open_table_lookup(table, a, b, target, record_flags, clear_carry=False):
+        # Emit the table path for 8-bit operands and open the else branch for
+        # wider ones; returns False (emitting nothing) when tables are off
+        if not alu_tables:
+            return False
+        checks = [f"{a} <= 255"]
+        if isinstance(b, str) and b != a:
+            checks.append(f"{b} <= 255")
+        emit("if " + " and ".join(checks) + ":")
+        level[0] += 1
+        emit(f"p = {table}[{a} << 8 | {b}]")
+        if record_flags:
+            entry = f"p & {~CARRY_BIT & 0xFFFF}" if clear_carry else "p"
+            emit(f"cv = ({FLAGS_PACKED}, {entry}, 0)")
+        emit(f"zr = {target} = p & 0xFF")
+        level[0] -= 1
+        emit("else:")
+        level[0] += 1
+        return True
+
+    def close_table_lookup(opened):
+        if opened:
+            level[0] -= 1
+
+    def emit_write_back(indent=1):
+        # Copy the locals back into the emulator's CPU state
+        emit("regs[0] = r0; regs[1] = r1; regs[2] = r2; regs[3] = r3; regs[4] = r4", indent)
+        emit("cpu.sp_register = sp", indent)
+        emit("cpu._zero_result = zr; cpu._cv_source = cv", indent)
+
+    def emit_exit(pc_expression, count, indent=1):
+        # Write the CPU state back, move the PC on and leave the block
+        emit_write_back(indent)
+        emit(f"cpu.pc_register = pc = {pc_expression}", indent)
+        emit("if pc > END_MARKER_ADDRESS:", indent)
+        emit("cpu.interrupt_flag = True", indent + 1)
+        emit(f"return {count}", indent)
+
+    def emit_read(target, address_expression):
+        # Inline RAM read, out of range addresses read as 0
+        emit(f"x = {address_expression}")
+        emit(f"{target} = mem[x] if 0 <= x < size else 0")
+
+    live = live_flag_records(instructions)
+    for count, (address, instruction) in enumerate(instructions, start=1):
+        opcode = (instruction >> 12) & 0xF
+        Rd = (instruction >> 10) & 0x3
+        Rn = (instruction >> 8) & 0x3
+        operands = instruction & 0xFF
+        rd, rn = f"r{Rd}", f"r{Rn}"
+        record_flags = live[count - 1]
+        stores = False
+
+        emit(f"# 0x{address:04X}: 0x{instruction:04X}")
+        if opcode == OP_LD:
+            emit_read(rd, rn)
+            emit(f"zr = {rd}")
+        elif opcode == OP_LI:
+            emit(f"{rd} = {operands}")
+        elif opcode == OP_ST:
+            emit(f"store(emu, {rn}, {rd})")
+            stores = True
+        elif opcode == OP_ADD:
+            opened = open_table_lookup("ADD_TABLE", rn, operands, rd, record_flags)
+            emit(f"t = {rn} + {operands}")
+            if record_flags:
+                emit(f"cv = ({FLAGS_ADD}, t, 0)")
+            emit(f"zr = {rd} = t & 0xFF")
+            close_table_lookup(opened)
+        elif opcode == OP_SUB:
+            # With Rd == Rn the borrow compares the result with itself, so it is never set
+            opened = open_table_lookup("SUB_TABLE", rn, operands, rd, record_flags, clear_carry=Rd == Rn)
+            emit(f"t = {rn} - {operands}")
+            emit(f"zr = {rd} = t & 0xFF")
+            if record_flags:
+                # Rn is recorded after the write, like Emulator.subtract
+                emit(f"cv = ({FLAGS_SUB}, t, {rn})")
+            close_table_lookup(opened)
+        elif opcode == OP_JMP:
+            # Save the return address in LR
+            emit(f"r4 = {address}")
+            emit_exit(operands + 1, count)
+        elif opcode == OP_BEQ:
+            emit_exit(f"{operands + 1} if zr == 0 else {address + 1}", count)
+        elif opcode == OP_BNE:
+            emit_exit(f"{address + 1} if zr == 0 else {operands + 1}", count)
+        elif opcode == OP_CMP:
+            # If both Rd & Rn are zero then it is an immediate check
+            source = operands if Rd == 0 and Rn == 0 else rn
+            emit(f"zr = {rd} - {source}")
+            if record_flags:
+                emit(f"cv = ({FLAGS_CMP}, {rd}, {source})")
+        elif opcode in (OP_AND, OP_OR, OP_XOR):
+            operator = {OP_AND: "&", OP_OR: "|", OP_XOR: "^"}[opcode]
+            table = {OP_AND: "AND_TABLE", OP_OR: "OR_TABLE", OP_XOR: "XOR_TABLE"}[opcode]
+            source = operands if Rn == 0 else rn
+            # Logical operations only set the zero flag
+            opened = open_table_lookup(table, rd, source, "r0", False)
+            emit(f"zr = r0 = {rd} {operator} {source}")
+            close_table_lookup(opened)
+        elif opcode == OP_SHL:
+            opened = open_table_lookup("SHL_TABLE", rn, operands, rd, record_flags)
+            emit(f"t = {rn} << {operands}")
+            if record_flags:
+                emit(f"cv = ({FLAGS_SHL}, t, 0)")
+            emit(f"zr = {rd} = t & 0xFF")
+            close_table_lookup(opened)
+        elif opcode == OP_SHR:
+            opened = open_table_lookup("SHR_TABLE", rn, operands, rd, record_flags)
+            if record_flags:
+                emit(f"cv = ({FLAGS_SHR}, {rn}, 0)")
+            emit(f"zr = {rd} = ({rn} >> {operands}) & 0xFF")
+            close_table_lookup(opened)
+        elif opcode == OP_PUSH:
+            # Rd first, then Rn (bit 0), then each register named in the mask
+            pushed = [rd]
+            if operands & 0x01:
+                pushed.append(rn)
+            pushed.extend(f"r{i}" for i in range(5) if operands & (1 << i))
+            emit("t = (" + ", ".join(pushed) + ",)")
+            for index in range(len(pushed)):
+                emit("sp -= 1")
+                emit(f"store(emu, sp, t[{index}])")
+            stores = True
+        elif opcode == OP_POP:
+            if operands & 0x80:
+                # Syscall: the dispatcher sees the live CPU state, the PC then moves on as usual
+                emit_write_back()
+                emit(f"cpu.pc_register = {address}")
+                emit(f"emu.syscall_dispatcher({operands & 0x7F}, r0, r1, r2, r3)")
+                emit("cpu.pc_register = pc = cpu.pc_register + 1")
+                emit("if pc > END_MARKER_ADDRESS:")
+                emit("cpu.interrupt_flag = True", 2)
+                emit(f"return {count}")
+            else:
+                popped = []
+                if operands & 0x01:
+                    popped.append(rd)
+                if operands & 0x02:
+                    popped.append(rn)
+                popped.extend(f"r{i}" for i in range(5) if operands & (1 << i))
+                if operands & 0x10:
+                    popped.append("r4")
+                for target in popped:
+                    emit_read(target, "sp")
+                    emit("sp += 1")
+                if operands & 0x10:
+                    # Return through LR
+                    emit_exit("r4 + 1", count)
+
+        if stores:
+            # A store may have rewritten code; leave so the next lookup retranslates it
+            emit("if cache.generation != generation:")
+            emit_exit(address + 1, count, indent=2)
+
+    # Fell off the end of a straight-line block
+    last_address, last_instruction = instructions[-1]
+    if not ends_block((last_instruction >> 12) & 0xF, last_instruction & 0xFF):
+        emit_exit(last_address + 1, len(instructions))
+
+    return "\n".join(lines) + "\n"
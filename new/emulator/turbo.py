@@ -0,0 +1,208 @@
+# turbo.py
+
+# Quiet instruction handlers for the turbo run loop (Emulator.run_until).
+#
+# These mirror the instruction semantics of the Emulator methods exactly, but
+# never log, format strings or print, so the hot loop pays only for the work the
+# guest asked for. Flags are recorded lazily, as described in flags.py.
+# Every handler is called as handler(emu, Rd, Rn, operands) and works on the
+# emulator's CPUState (emu.cpu); only the syscall handler returns a value (True)
+# so the loop can stop on it.
+
+from emulator.bus import ADDRESS_WORDS, PAGE_SHIFT
+from emulator.decoder import build_decode_table, decode, INSTRUCTION_WORDS
+from emulator.flags import FLAGS_ADD, FLAGS_SUB, FLAGS_CMP, FLAGS_SHL, FLAGS_SHR
+
+
+def load(emu, address):
+    # Read a RAM word, out of range addresses read as 0
+    memory = emu.ram_memory
+    if 0 <= address < len(memory):
+        return memory[address]
+    return 0
+
+
+def store(emu, address, data):
+    # Write the low byte of data through the page table (see bus.py), to RAM or to
+    # the device mapped there; out of range addresses are ignored
+    if 0 <= address < ADDRESS_WORDS:
+        emu.bus.pages[address >> PAGE_SHIFT](emu, address, data & 0xFF)
+
+
+def load_data(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    cpu._zero_result = registers[Rd] = load(emu, registers[Rn])
+
+
+def load_immediate(emu, Rd, Rn, operands):
+    emu.cpu.registers[Rd] = operands
+
+
+def store_data(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    store(emu, registers[Rn], registers[Rd])
+
+
+def add(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    result = registers[Rn] + operands
+    cpu._cv_source = (FLAGS_ADD, result, 0)
+    cpu._zero_result = registers[Rd] = result & 0xFF
+
+
+def subtract(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    result = registers[Rn] - operands
+    cpu._zero_result = registers[Rd] = result & 0xFF
+    # Rn is recorded after the write, exactly like Emulator.subtract
+    cpu._cv_source = (FLAGS_SUB, result, registers[Rn])
+
+
+def jump(emu, Rd, Rn, operands):
+    # Save the return address in LR
+    cpu = emu.cpu
+    cpu.registers[4] = cpu.pc_register
+    cpu.pc_register = operands
+
+
+def branch_equal(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    if cpu._zero_result == 0:
+        cpu.pc_register = operands
+
+
+def branch_not_equal(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    if cpu._zero_result != 0:
+        cpu.pc_register = operands
+
+
+def compare(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    destination_value = registers[Rd]
+    # If both Rd & Rn are zero then it is an immediate check
+    if Rd == 0 and Rn == 0:
+        source_value = operands
+    else:
+        source_value = registers[Rn]
+    cpu._zero_result = destination_value - source_value
+    cpu._cv_source = (FLAGS_CMP, destination_value, source_value)
+
+
+def logical_and(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    cpu._zero_result = registers[0] = registers[Rd] & (operands if Rn == 0 else registers[Rn])
+
+
+def logical_or(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    cpu._zero_result = registers[0] = registers[Rd] | (operands if Rn == 0 else registers[Rn])
+
+
+def logical_xor(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    cpu._zero_result = registers[0] = registers[Rd] ^ (operands if Rn == 0 else registers[Rn])
+
+
+def shift_left(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    result = registers[Rn] << operands
+    cpu._cv_source = (FLAGS_SHL, result, 0)
+    cpu._zero_result = registers[Rd] = result & 0xFF
+
+
+def shift_right(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    source_value = registers[Rn]
+    cpu._cv_source = (FLAGS_SHR, source_value, 0)
+    cpu._zero_result = registers[Rd] = (source_value >> operands) & 0xFF
+
+
+def push(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    # Rd first, then Rn (bit 0), then each register named in the mask
+    pushed = [registers[Rd]]
+    if operands & 0x01:
+        pushed.append(registers[Rn])
+    for i in range(5):
+        if operands & (1 << i):
+            pushed.append(registers[i])
+    sp = cpu.sp_register
+    for value in pushed:
+        sp -= 1
+        store(emu, sp, value)
+    cpu.sp_register = sp
+
+
+def pop(emu, Rd, Rn, operands):
+    cpu = emu.cpu
+    registers = cpu.registers
+    sp = cpu.sp_register
+    if operands & 0x01:
+        registers[Rd] = load(emu, sp)
+        sp += 1
+    if operands & 0x02:
+        registers[Rn] = load(emu, sp)
+        sp += 1
+    for i in range(5):
+        if operands & (1 << i):
+            registers[i] = load(emu, sp)
+            sp += 1
+    if operands & 0x10:
+        # Pop LR again and return through it
+        registers[4] = load(emu, sp)
+        sp += 1
+        cpu.pc_register = registers[4]
+    cpu.sp_register = sp
+
+
+def syscall(emu, Rd, Rn, operands):
+    # POP with bit 7 set is a syscall, numbered by the remaining 7 bits
+    cpu = emu.cpu
+    registers = cpu.registers
+    emu.syscall_dispatcher(operands & 0x7F, registers[0], registers[1], registers[2], registers[3])
+    return True
+
+
+TURBO_HANDLERS = (
+    load_data,         # 0000 LD
+    load_immediate,    # 0001 LI
+    store_data,        # 0010 ST
+    add,               # 0011 ADD
+    subtract,          # 0100 SUB
+    jump,              # 0101 JMP
+    branch_equal,      # 0110 BEQ
+    branch_not_equal,  # 0111 BNE
+    compare,           # 1000 CMP
+    logical_and,       # 1001 AND
+    logical_or,        # 1010 OR
+    logical_xor,       # 1011 XOR
+    shift_left,        # 1100 SHL
+    shift_right,       # 1101 SHR
+    push,              # 1110 PUSH
+    pop,               # 1111 POP
+)
+
+
+def build_turbo_decode_table():
+    # Same layout as DECODE_TABLE, with syscall words given their own handler
+    table = build_decode_table(TURBO_HANDLERS)
+    for instruction in range(0xF000, INSTRUCTION_WORDS):
+        opcode, Rd, Rn, operands = decode(instruction)
+        if operands & 0x80:
+            table[instruction] = (syscall, Rd, Rn, operands)
+    return table
+
+
+TURBO_DECODE_TABLE = build_turbo_decode_table()
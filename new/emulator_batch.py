@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+# Run a directory of .hex images headless, in parallel, and write a JSON report.
+
+import argparse
+import json
+import sys
+
+from emulator.batch import find_images, run_farm, DEFAULT_MAX_INSTRUCTIONS, ENGINES
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rick's Amazing Emulator - batch runner")
+    parser.add_argument("directory", help="directory holding the .hex images to run")
+    parser.add_argument("--pattern", default="*.hex", help="glob pattern for images in the directory")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--max-instructions", type=int, default=DEFAULT_MAX_INSTRUCTIONS, help="per-image instruction limit")
+    parser.add_argument("--engine", choices=ENGINES, default="block", help="execution engine used by every worker")
+    parser.add_argument("--report", "-o", default=None, help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    images = find_images(args.directory, args.pattern)
+    if not images:
+        print(f"No images matching '{args.pattern}' in {args.directory}", file=sys.stderr)
+        sys.exit(1)
+
+    report = run_farm(images, jobs=args.jobs, max_instructions=args.max_instructions, engine=args.engine)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    # Non-zero exit status when any image failed to load or run
+    sys.exit(1 if any(result['status'] == 'error' for result in report['results']) else 0)
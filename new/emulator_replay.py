@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+# Replay a recording made with the CLI 'record' command, headless and at turbo speed.
+
+import argparse
+import os
+import sys
+
+from emulator.emulator import Emulator
+from emulator.eprom import open_eprom_image, DEFAULT_EPROM_IMAGE
+from emulator.replay import replay_recording
+from emulator.snapshot import SnapshotError
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rick's Amazing Emulator - replay")
+    parser.add_argument("recording", help="recording file written by the CLI 'record' command")
+    parser.add_argument("--quiet", "-q", action="store_true", help="do not print the guest's output")
+    parser.add_argument("--eprom", default=DEFAULT_EPROM_IMAGE, help="EPROM image the recording was made with, if it exists")
+    args = parser.parse_args()
+
+    emulator = Emulator(None, trace_size=0)
+    try:
+        if os.path.exists(args.eprom):
+            emulator.attach_eprom(open_eprom_image(args.eprom), args.eprom)
+        result = replay_recording(emulator, args.recording)
+    except (OSError, SnapshotError) as e:
+        print(f"Error replaying '{args.recording}': {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if not args.quiet:
+        print(result['output'], end='')
+    print(f"Replayed {result['instructions']} instructions and {result['events']} inputs: "
+          f"final state {'matches' if result['matched'] else 'DIFFERS FROM'} the recording.", file=sys.stderr)
+    sys.exit(0 if result['matched'] else 1)
@@ -9,16 +9,44 @@ import sys
 import logging
 import threading
 import signal
+import argparse
 
-from emulator.emulator import Emulator
+from emulator.emulator import Emulator, DEFAULT_QUANTUM
+from emulator.trace import DEFAULT_TRACE_SIZE
+from emulator.history import History, DEFAULT_HISTORY_INTERVAL, DEFAULT_HISTORY_BUDGET
+from emulator.eprom import open_eprom_image, DEFAULT_EPROM_IMAGE
 from cli.cli import CommandLineInterface
 from utils import logger
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rick's Amazing Emulator")
+    parser.add_argument("--turbo", action="store_true", help="run guest code without logging or the execution trace")
+    parser.add_argument("--debug", action="store_true", help="start with per-instruction logging to emlog.log enabled")
+    parser.add_argument("--trace-size", type=int, default=DEFAULT_TRACE_SIZE, help="instructions kept in the execution trace (0 to disable)")
+    parser.add_argument("--trace-file", default=None, help="dump the execution trace here whenever the program halts (.bin for binary)")
+    parser.add_argument("--quantum", type=int, default=DEFAULT_QUANTUM, help="instructions run between checks for stop and Ctrl+C")
+    parser.add_argument("--profile", action="store_true", help="start with the execution profiler enabled (see the 'profile' command)")
+    parser.add_argument("--history-interval", type=int, default=DEFAULT_HISTORY_INTERVAL, help="instructions between the checkpoints used by 'back'")
+    parser.add_argument("--history-budget", type=int, default=DEFAULT_HISTORY_BUDGET // (1024 * 1024), help="megabytes of checkpoints kept for 'back' (0 to disable)")
+    parser.add_argument("--eprom", default=DEFAULT_EPROM_IMAGE, help="EPROM image to boot from at start-up, if it exists")
+    parser.add_argument("--alu-tables", action="store_true", help="use precomputed 8-bit ALU result and flag tables")
+    args = parser.parse_args()
+    if args.quantum < 1:
+        parser.error("--quantum must be at least 1")
+
     try:
         # Create an instance of the emulator
-        emulator = Emulator(None)
+        emulator = Emulator(None, turbo=args.turbo, quantum=args.quantum, alu_tables=args.alu_tables,
+                            trace_size=args.trace_size, trace_file=args.trace_file, debug=args.debug)
+        if args.profile:
+            emulator.enable_profiler()
+        if args.history_budget:
+            emulator.history = History(emulator, args.history_interval, args.history_budget * 1024 * 1024)
+        if os.path.exists(args.eprom):
+            # Mapped, not read: start-up costs the same whatever the size of the image
+            emulator.attach_eprom(open_eprom_image(args.eprom), args.eprom)
+            emulator.boot()
 
         # Create an instance of the CLI
         cli = CommandLineInterface(None)
@@ -0,0 +1,39 @@
+# support.py
+
+# Helpers shared by the tests: guest programs written as .hex images.
+
+import os
+import tempfile
+
+from emulator.hexfile import load_hex_file
+
+
+def write_image(filename, words, data=()):
+    # Write an image of one instruction record of words, plus (address, bytes) data records
+    with open(filename, "w") as hex_file:
+        for address, values in data:
+            hex_file.write(f":{len(values):02X}{address:04X}00{bytes(values).hex().upper()}\n")
+        hex_file.write(f":{2 * len(words):02X}000011{''.join(f'{word:04X}' for word in words)}\n")
+        hex_file.write(":00000001FF\n")
+
+
+def load_words(emulator, words, name="test.hex", data=()):
+    """
+    Load a guest program through an image file, as the CLI 'load' command does.
+
+    Args:
+        emulator (Emulator): The machine to load into.
+        words (list): The instruction words.
+        name (str): File name the program is listed under.
+        data (list): (address, bytes) data records.
+
+    Returns:
+        int: The load address, with the PC set to it and the machine running.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, name)
+        write_image(filename, words, data)
+        address = load_hex_file(emulator, filename)
+    emulator.pc_register = address
+    emulator.interrupt_flag = False
+    return address
@@ -0,0 +1,67 @@
+# test_alu.py
+
+# The ALU table cache file: reused when valid, rebuilt when not, never left half written.
+
+import os
+import tempfile
+import unittest
+
+from emulator.alu import CACHE_MAGIC, build_alu_tables, load_alu_tables
+
+
+class AluCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tables = build_alu_tables()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "cache", "alu_tables.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_written_then_read_back(self):
+        self.assertEqual(load_alu_tables(self.cache_file), self.tables)
+        self.assertEqual(os.listdir(os.path.dirname(self.cache_file)), ["alu_tables.bin"])
+        modified = os.stat(self.cache_file).st_mtime_ns
+        self.assertEqual(load_alu_tables(self.cache_file), self.tables)
+        self.assertEqual(os.stat(self.cache_file).st_mtime_ns, modified)
+
+    def test_bad_cache_files_are_rebuilt(self):
+        load_alu_tables(self.cache_file)
+        with open(self.cache_file, "rb") as f:
+            good = f.read()
+        wrong_magic = b"X" * len(CACHE_MAGIC) + good[len(CACHE_MAGIC):]
+        for name, data in (("truncated", good[:len(good) // 2]), ("empty", b""), ("wrong magic", wrong_magic),
+                           ("trailing data", good + b"\0\0")):
+            with self.subTest(name):
+                with open(self.cache_file, "wb") as f:
+                    f.write(data)
+                self.assertEqual(load_alu_tables(self.cache_file), self.tables)
+                with open(self.cache_file, "rb") as f:
+                    self.assertEqual(f.read(), good)
+
+    def test_unwritable_directory(self):
+        # A cache directory that cannot be made: the tables are built, nothing is written
+        blocker = os.path.join(self.directory.name, "file")
+        with open(blocker, "w"):
+            pass
+        self.assertEqual(load_alu_tables(os.path.join(blocker, "alu_tables.bin")), self.tables)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["file"])
+
+    @unittest.skipIf(not hasattr(os, "geteuid") or os.geteuid() == 0, "root can write to any directory")
+    def test_read_only_directory(self):
+        directory = os.path.dirname(self.cache_file)
+        os.makedirs(directory)
+        os.chmod(directory, 0o555)
+        try:
+            self.assertEqual(load_alu_tables(self.cache_file), self.tables)
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            os.chmod(directory, 0o755)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# test_banks.py
+
+# Bank-switched RAM: SYS_BANK from guest code, on every engine.
+
+import unittest
+
+from emulator.emulator import Emulator, INPUT_BANK
+from emulator.lockstep import LockstepMachines, np
+from tests.support import load_words
+
+# li r1, #0x80; li r2, #0x11; st r2, [r1]; li r0, #1; syscall SYS_BANK; li r2, #0x22;
+# st r2, [r1]; li r0, #0; syscall SYS_BANK; ld r3, [r1]; li r0, #5; syscall SYS_BANK; jmp #0xFF
+SWITCHER = [0x1480, 0x1811, 0x2900, 0x1001, 0xF08C, 0x1822, 0x2900, 0x1000, 0xF08C, 0x0D00, 0x1005, 0xF08C,
+            0x50FF]
+
+
+class BankTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = self.machine()
+
+    def machine(self):
+        # Loaded into both banks: a switch carries on at the next address of the other one
+        emulator = Emulator(None, trace_size=0)
+        emulator.select_ram_bank(1)
+        load_words(emulator, SWITCHER)
+        emulator.select_ram_bank(0)
+        load_words(emulator, SWITCHER)
+        return emulator
+
+    def check(self, emulator):
+        self.assertTrue(emulator.interrupt_flag)
+        self.assertEqual(emulator.current_ram_bank, 0)
+        self.assertEqual([bank.memory[0x80] for bank in emulator.ram_banks], [0x11, 0x22, 0])
+        self.assertEqual(emulator.registers[3], 0x11)  # Read back from bank 0
+        self.assertEqual(emulator.registers[0], 0xFF)  # There is no bank 5
+
+    def test_turbo(self):
+        self.emulator.run_until(max_instructions=100)
+        self.check(self.emulator)
+
+    def test_block_engine(self):
+        emulator = self.emulator
+        while not emulator.interrupt_flag:
+            emulator.execute_block()
+        self.check(emulator)
+
+    def test_debug_and_profiled(self):
+        for run in ('run_debug', 'run_profiled'):
+            with self.subTest(run=run):
+                emulator = self.machine()
+                if run == 'run_debug':
+                    emulator.breakpoints.add(0xFE)
+                else:
+                    emulator.enable_profiler()
+                getattr(emulator, run)(max_instructions=100)
+                self.check(emulator)
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_lockstep(self):
+        machines = LockstepMachines.from_emulator(self.emulator, 2)
+        machines.run(max_steps=100)
+        self.assertEqual(machines.bank.tolist(), [0, 0])
+        for index in range(2):
+            with self.subTest(machine=index):
+                emulator = Emulator(None, trace_size=0)
+                machines.copy_to_emulator(index, emulator)
+                self.check(emulator)
+        # The same state as the turbo engine, in every bank
+        self.emulator.run_until(max_instructions=100)
+        self.assertEqual([bank.memory.tolist() for bank in emulator.ram_banks],
+                         [bank.memory.tolist() for bank in self.emulator.ram_banks])
+
+    def test_switch_keeps_each_banks_state(self):
+        emulator = self.emulator
+        emulator.heap.allocate(4, 0)
+        emulator.apply_input(INPUT_BANK, 2, 0)
+        self.assertEqual(emulator.current_ram_bank, 2)
+        self.assertEqual(emulator.heap.blocks, {})
+        self.assertEqual(emulator.programs, {})
+        self.assertEqual(emulator.ram_memory[0], 0)
+        emulator.select_ram_bank(0)
+        self.assertEqual(len(emulator.heap.blocks), 1)
+        self.assertEqual(emulator.ram_memory[0], SWITCHER[0])
+        self.assertEqual(emulator.predecoded[4], emulator.turbo_table[SWITCHER[4]])
+        with self.assertRaises(ValueError):
+            emulator.select_ram_bank(3)
+
+
+if __name__ == '__main__':
+    unittest.main()
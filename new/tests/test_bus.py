@@ -0,0 +1,96 @@
+# test_bus.py
+
+# Stores through the page table: RAM pages, the program area and mapped devices.
+
+import pickle
+import unittest
+
+from emulator.bus import PAGE_WORDS, RomPages, write_code, write_ram
+from emulator.devices import SerialPort, SERIAL_STATUS, SERIAL_READY
+from emulator.emulator import Emulator
+from emulator.turbo import store
+from tests.support import load_words
+
+SERIAL_PAGE = 0x50
+SEND_A = [0x1841, 0x2900, 0x50FF]  # li r2, #0x41; st r2, [r1]; jmp #0xFF
+
+
+class RecordingDevice(RomPages):
+    # A one-page device that remembers what the guest wrote to it
+    name = "recorder"
+
+    def __init__(self):
+        super().__init__([], 0)
+        self.writes = []
+
+    def write(self, offset, value):
+        self.writes.append((offset, value))
+
+
+class MemoryBusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+
+    def test_ram_handlers(self):
+        pages = self.emulator.bus.pages
+        self.assertIs(pages[0], write_code)
+        self.assertIs(pages[0xFF // PAGE_WORDS], write_code)
+        self.assertIs(pages[0x100 // PAGE_WORDS], write_ram)
+        store(self.emulator, 0x1234, 0x1FF)
+        self.assertEqual(self.emulator.ram_memory[0x1234], 0xFF)
+        # Out of range stores are ignored
+        store(self.emulator, 0x10000, 1)
+        store(self.emulator, -1, 1)
+
+    def test_store_to_code_is_decoded_again(self):
+        emulator = self.emulator
+        store(emulator, 0x10, 0x05)  # 0x0005: LD R0, [R0]
+        self.assertEqual(emulator.predecoded[0x10], emulator.turbo_table[0x0005])
+
+    def test_device_pages(self):
+        emulator = self.emulator
+        device = RecordingDevice()
+        emulator.bus.map(0x50, device)
+        base = 0x50 * PAGE_WORDS
+        store(emulator, base + 3, 0x41)
+        self.assertEqual(device.writes, [(3, 0x41)])
+        # ROM pages read as 0 past the end of the image, and stores leave RAM alone
+        self.assertEqual(emulator.ram_memory[base + 3], 0)
+        with self.assertRaises(ValueError):
+            emulator.bus.map(0x50, RecordingDevice())
+        self.assertIs(emulator.bus.unmap(0x50), device)
+        self.assertIs(emulator.bus.pages[0x50], write_ram)
+        store(emulator, base + 3, 0x41)
+        self.assertEqual(emulator.ram_memory[base + 3], 0x41)
+        self.assertEqual(device.writes, [(3, 0x41)])
+        self.assertIsNone(emulator.bus.unmap(0x50))
+
+
+class SerialPortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+        self.emulator.bus.map(SERIAL_PAGE, SerialPort())
+        load_words(self.emulator, SEND_A)
+        self.emulator.registers[1] = SERIAL_PAGE * PAGE_WORDS
+
+    def run_and_collect(self, emulator):
+        emulator.run_until(max_instructions=10)
+        emulator.cli.service_syscalls()
+        return emulator.cli.output
+
+    def test_status_and_output(self):
+        self.assertEqual(self.emulator.ram_memory[SERIAL_PAGE * PAGE_WORDS + SERIAL_STATUS], SERIAL_READY)
+        self.assertEqual(self.run_and_collect(self.emulator), ["A"])
+
+    def test_forked_and_unpickled_machines_have_a_host(self):
+        child = self.emulator.fork()
+        self.assertEqual(self.run_and_collect(child), ["A"])
+        copy = pickle.loads(pickle.dumps(self.emulator))
+        self.assertEqual(self.run_and_collect(copy), ["A"])
+        self.assertEqual(self.emulator.cli.output, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# test_callgraph.py
+
+# The profiler's shadow call stack and its collapsed-stack output.
+
+import os
+import tempfile
+import unittest
+
+from emulator.callgraph import CallGraph, MAX_DEPTH
+from emulator.emulator import Emulator
+from tests.support import load_words
+
+# main calls 'twice' two times; each call pushes its own address twice, for the
+# POP that returns through LR (it pops LR, then LR again):
+#        li r0, #3; push r0; push r0; jmp twice
+#        li r0, #7; push r0; push r0; jmp twice
+#        jmp #0xFF
+#        (word 9)
+# twice: li r1, #1; add r1, r1, #1; pop lr
+CALLS = [0x1003, 0xE000, 0xE000, 0x5009, 0x1007, 0xE000, 0xE000, 0x5009, 0x50FF, 0x0000, 0x1401, 0x3501, 0xF010]
+SYMBOLS = {0: "main", 10: "twice"}
+COLLAPSED = ["main 9", "main;twice 6"]
+
+
+def profiled(run, symbols=SYMBOLS):
+    emulator = Emulator(None, trace_size=0)
+    load_words(emulator, CALLS)
+    emulator.symbols.update(symbols)
+    emulator.enable_profiler()
+    if run == 'run_profiled':
+        emulator.run_profiled()
+    else:
+        while not emulator.interrupt_flag:
+            emulator.fetch_and_execute()
+    return emulator.profiler.call_graph
+
+
+class CallGraphTest(unittest.TestCase):
+
+    def test_collapsed_stacks(self):
+        for run in ('run_profiled', 'fetch_and_execute'):
+            with self.subTest(run=run):
+                call_graph = profiled(run)
+                self.assertEqual(call_graph.collapsed(), COLLAPSED)
+                self.assertEqual(call_graph.routines(), {"main": (15, 9), "twice": (6, 6)})
+
+    def test_unlabelled_routines_are_named_by_address(self):
+        self.assertEqual(profiled('run_profiled', symbols={}).collapsed(), ["0x0000 9", "0x0000;0x000A 6"])
+
+    def test_export(self):
+        call_graph = profiled('run_profiled')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "stacks.txt")
+            self.assertEqual(call_graph.export(filename), len(COLLAPSED))
+            with open(filename) as f:
+                self.assertEqual(f.read().splitlines(), COLLAPSED)
+
+    def test_loops_and_recursion_keep_the_stack_bounded(self):
+        call_graph = CallGraph()
+        call_graph.start(0)
+        call_graph.call(0x0F, 1)  # Into 0x10
+        call_graph.call(0x1F, 0x11)  # Into 0x20
+        call_graph.call(0x0F, 0x21)  # Back to 0x10: unwinds instead of nesting
+        self.assertEqual(call_graph.path, (0, 0x10))
+        call_graph.add(2)
+        # A return that matches no frame pops the top one
+        call_graph.ret(0x77)
+        self.assertEqual(call_graph.path, (0,))
+        for entry in range(MAX_DEPTH + 10):
+            call_graph.call(0x100 + 2 * entry, 0)
+        self.assertEqual(len(call_graph.path), MAX_DEPTH)
+        self.assertEqual(call_graph.collapsed(), ["0x0000;0x0010 2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# test_eprom.py
+
+# Booting from a mapped EPROM image, and loading programs after the boot.
+
+import mmap
+import os
+import pickle
+import tempfile
+import unittest
+from array import array
+
+from emulator.emulator import Emulator, END_MARKER_ADDRESS
+from emulator.eprom import open_eprom_image
+from emulator.hexfile import load_hex_file
+from tests.test_hexfile import IRC
+
+
+class BootTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # A 1K-word image whose boot block starts with SYS_EXIT
+        self.image = os.path.join(directory.name, 'boot.rom')
+        words = array('H', range(1024))
+        words[0] = 0xF080
+        with open(self.image, 'wb') as f:
+            f.write(words.tobytes())
+        self.emulator = Emulator(None, trace_size=0)
+        self.emulator.attach_eprom(open_eprom_image(self.image), self.image)
+
+    def test_boot_copies_the_boot_block(self):
+        emulator = self.emulator
+        emulator.boot()
+        self.assertEqual(emulator.pc_register, 0)
+        self.assertFalse(emulator.interrupt_flag)
+        self.assertEqual(emulator.ram_memory[0], 0xF080)
+        self.assertEqual(list(emulator.ram_memory[1:END_MARKER_ADDRESS + 1]), list(range(1, END_MARKER_ADDRESS + 1)))
+        self.assertEqual(emulator.ram_memory[END_MARKER_ADDRESS + 1], 0)
+        self.assertEqual(emulator.extents.extents()[0][0], END_MARKER_ADDRESS + 1)
+
+    def test_load_after_boot_takes_the_program_area(self):
+        emulator = self.emulator
+        emulator.boot()
+        self.assertEqual(load_hex_file(emulator, IRC), 0)
+        self.assertEqual(list(emulator.programs), [0])
+        self.assertEqual(emulator.ram_memory[1], 0xF081)
+        # A second image goes after the first, still in the program area
+        self.assertEqual(load_hex_file(emulator, IRC), 5)
+
+
+class PickledEpromTest(unittest.TestCase):
+
+    def test_image_file_is_mapped_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            image = os.path.join(directory, 'big.rom')
+            words = array('H', range(65536)) * 4  # 512KB
+            with open(image, 'wb') as f:
+                f.write(words.tobytes())
+            emulator = Emulator(None, trace_size=0)
+            emulator.attach_eprom(open_eprom_image(image), image)
+            emulator.boot()
+            data = pickle.dumps(emulator)
+            # The path travels, not the words
+            self.assertLess(len(data), len(words))
+            copy = pickle.loads(data)
+            self.assertEqual(copy.eprom_file, os.path.abspath(image))
+            self.assertIsInstance(copy.eprom_memory.obj, mmap.mmap)
+            self.assertEqual(copy.eprom_memory, emulator.eprom_memory)
+            self.assertEqual(copy.ram_memory[:256], emulator.ram_memory[:256])
+
+    def test_image_without_a_file_travels_as_words(self):
+        emulator = Emulator(None, trace_size=0)
+        emulator.attach_eprom(memoryview(array('H', [0xF080, 1, 2])))
+        copy = pickle.loads(pickle.dumps(emulator))
+        self.assertIsNone(copy.eprom_file)
+        self.assertEqual(copy.eprom_memory.tolist(), [0xF080, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
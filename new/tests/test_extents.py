@@ -0,0 +1,121 @@
+# test_extents.py
+
+# The free-extent index against a word-by-word model, and program placement.
+
+import random
+import unittest
+
+from emulator.bus import PAGE_WORDS
+from emulator.devices import SerialPort
+from emulator.emulator import Emulator, END_MARKER_ADDRESS
+from emulator.extents import FreeExtents
+from emulator.hexfile import load_hex_file
+from tests.test_hexfile import IRC
+
+SIZE = 300
+
+
+def free_runs(used):
+    # (start, end) of every run of free words in a list of booleans
+    runs = []
+    start = None
+    for address, in_use in enumerate(used + [True]):
+        if not in_use and start is None:
+            start = address
+        elif in_use and start is not None:
+            runs.append((start, address))
+            start = None
+    return runs
+
+
+class FreeExtentsTest(unittest.TestCase):
+
+    def test_allocate_free_and_coalesce(self):
+        extents = FreeExtents(100)
+        self.assertEqual([extents.allocate(10) for _ in range(3)], [0, 10, 20])
+        extents.free(10, 10)
+        self.assertEqual(extents.extents(), [(10, 20), (30, 100)])
+        # Best fit: the hole, not the start of the big extent
+        self.assertEqual(extents.allocate(5), 10)
+        extents.free(0, 10)
+        self.assertEqual(extents.extents(), [(0, 10), (15, 20), (30, 100)])
+        extents.free(10, 5)
+        extents.free(20, 10)
+        self.assertEqual(extents.extents(), [(0, 100)])
+        self.assertEqual(extents.free_words(), 100)
+        self.assertEqual(extents.allocate(101), -1)
+
+    def test_prefix_tried_first(self):
+        extents = FreeExtents(100)
+        extents.reserve(20, 40)
+        # [0, 20) is the lowest below 50; the best fit would have been [60, 100) for 30
+        self.assertEqual(extents.allocate(15, 50), 0)
+        self.assertEqual(extents.allocate(30, 50), 60)
+        self.assertEqual(extents.allocate(5, 50), 15)
+
+    def test_against_model(self):
+        rng = random.Random(1)
+        for _ in range(100):
+            extents = FreeExtents(SIZE)
+            used = [False] * SIZE
+            for _ in range(200):
+                operation = rng.random()
+                address = rng.randrange(SIZE)
+                size = rng.randrange(1, 40)
+                if operation < 0.4:
+                    below = rng.choice((0, 100, SIZE))
+                    runs = free_runs(used)
+                    low = [start for start, end in runs if start < below and end - start >= size]
+                    fits = sorted((end - start, start) for start, end in runs if end - start >= size)
+                    expected = low[0] if low else fits[0][1] if fits else -1
+                    self.assertEqual(extents.allocate(size, below), expected)
+                    if expected >= 0:
+                        used[expected:expected + size] = [True] * size
+                elif operation < 0.7:
+                    extents.reserve(address, size)
+                    used[address:address + size] = [True] * len(used[address:address + size])
+                else:
+                    extents.free(address, size)
+                    used[address:address + size] = [False] * len(used[address:address + size])
+                self.assertEqual(extents.extents(), free_runs(used))
+                self.assertEqual(extents.by_size, sorted((end - start, start) for start, end in free_runs(used)))
+
+    def test_copy_and_array_round_trip(self):
+        extents = FreeExtents(SIZE)
+        extents.reserve(10, 20)
+        extents.reserve(100, 1)
+        copy = extents.copy()
+        copy.allocate(5)
+        self.assertEqual(extents.extents(), [(0, 10), (30, 100), (101, SIZE)])
+        loaded = FreeExtents(SIZE)
+        loaded.load(extents.to_array())
+        self.assertEqual(loaded.extents(), extents.extents())
+        self.assertEqual(loaded.by_size, extents.by_size)
+
+
+class PlacementTest(unittest.TestCase):
+
+    def test_programs_packed_into_the_program_area(self):
+        emulator = Emulator(None, trace_size=0)
+        addresses = [load_hex_file(emulator, IRC) for _ in range(3)]
+        self.assertEqual(addresses, [0, 5, 10])
+        # Freed words are reused, loaded ones are kept whatever they hold
+        emulator.free_memory(5, 5)
+        self.assertEqual(list(emulator.programs), [0, 10])
+        self.assertEqual(load_hex_file(emulator, IRC), 5)
+        self.assertEqual(emulator.program_at(7), 5)
+
+    def test_mapped_pages_are_not_free(self):
+        emulator = Emulator(None, trace_size=0)
+        page = 0x50
+        emulator.bus.map(page, SerialPort())
+        base = page * PAGE_WORDS
+        for bank in emulator.ram_banks:
+            self.assertFalse(any(start <= base < end for start, end in bank.extents.extents()))
+        emulator.bus.unmap(page)
+        self.assertTrue(any(start <= base < end for start, end in emulator.extents.extents()))
+        self.assertLess(load_hex_file(emulator, IRC), END_MARKER_ADDRESS + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
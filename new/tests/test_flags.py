@@ -0,0 +1,190 @@
+# test_flags.py
+
+# Lazily materialised flags (see flags.py) against the eager flag updates the
+# handlers made before, over every 8-bit operand pair; and the flag records the
+# block translator leaves out.
+
+import unittest
+
+from emulator import turbo
+from emulator.alu import get_alu_tables, make_alu_handlers
+from emulator.emulator import Emulator
+from emulator.translator import generate_block_source, live_flag_records
+from tests.support import load_words
+
+BYTES = range(256)
+
+# The carry and zero flags of an add in one block, read in the next:
+#       li r1, #0xFF; add r1, r1, #1; li r2, #5; jmp next
+#       (word 4)
+# next: beq zero; li r3, #1; jmp #0xFF
+# zero: li r3, #2; jmp #0xFF
+ACROSS_BLOCKS = [0x14FF, 0x3501, 0x1805, 0x5004, 0x0000, 0x6007, 0x1C01, 0x50FF, 0x1C02, 0x50FF]
+# A carry overwritten in the same block before anything can see it:
+# li r1, #0xFF; add r2, r1, #1; add r2, r2, #1; jmp #0xFF
+OVERWRITTEN = [0x14FF, 0x3901, 0x3A01, 0x50FF]
+
+
+# The eager semantics: (Rd or R0 after the operation, zero, carry, overflow),
+# with None for a flag the operation leaves alone
+
+def eager_add(a, b):
+    result = a + b
+    return result & 0xFF, result & 0xFF == 0, result > 255, result > 127 or result < -128
+
+
+def eager_subtract(a, b, same_register=False):
+    result = a - b
+    stored = result & 0xFF
+    # The borrow compares the stored result with Rn after the write
+    rn = stored if same_register else a
+    return stored, stored == 0, stored < rn, result > 127 or result < -128
+
+
+def eager_compare(a, b):
+    result = a - b
+    return a, result == 0, a < b, result > 32767 or result < -32768
+
+
+def eager_shift_left(a, b):
+    result = a << b
+    return result & 0xFF, result & 0xFF == 0, False, result & 0x100 != 0
+
+
+def eager_shift_right(a, b):
+    result = (a >> b) & 0xFF
+    return result, result == 0, False, a & 0x80 != 0
+
+
+def eager_logical(operation):
+    def logical(a, b):
+        result = operation(a, b)
+        return result, result == 0, None, None
+    return logical
+
+
+class LazyFlagsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+        alu = make_alu_handlers(get_alu_tables())
+        emulator = self.emulator
+        # name -> [(engine, handler(Rd, Rn, operands))]
+        self.engines = {}
+        for name, opcode in (('add', 0x3), ('subtract', 0x4), ('compare', None),
+                             ('logical_and', 0x9), ('logical_or', 0xA), ('logical_xor', 0xB),
+                             ('shift_left', 0xC), ('shift_right', 0xD)):
+            handlers = [('instrumented', getattr(emulator, name)),
+                        ('turbo', self.bind(getattr(turbo, name)))]
+            if opcode is not None:
+                handlers.append(('alu', self.bind(alu[opcode])))
+            self.engines[name] = handlers
+
+    def bind(self, handler):
+        emulator = self.emulator
+        return lambda Rd, Rn, operands: handler(emulator, Rd, Rn, operands)
+
+    def check(self, name, eager, Rd, Rn, immediate, result_register):
+        # Run name on every (a, b) pair and compare the register and all three flags with eager(a, b)
+        cpu = self.emulator.cpu
+        registers = cpu.registers
+        for engine, handler in self.engines[name]:
+            mismatches = []
+            for a in BYTES:
+                for b in BYTES:
+                    registers[:4] = [0, 0, 0, 0]
+                    registers[Rn if immediate else Rd] = a
+                    if not immediate:
+                        registers[Rn] = b
+                    # Flags an operation leaves alone must survive it
+                    cpu.carry_flag = True
+                    cpu.overflow_flag = False
+                    handler(Rd, Rn, b)
+                    expected = eager(a, b)
+                    carry = True if expected[2] is None else expected[2]
+                    overflow = False if expected[3] is None else expected[3]
+                    actual = (registers[result_register], cpu.zero_flag, cpu.carry_flag, cpu.overflow_flag)
+                    if actual != (expected[0], expected[1], carry, overflow):
+                        mismatches.append((a, b, actual, expected))
+            self.assertEqual(mismatches[:5], [], f"{name} on the {engine} engine")
+
+    def test_add(self):
+        self.check('add', eager_add, 1, 2, True, 1)
+
+    def test_subtract(self):
+        self.check('subtract', eager_subtract, 1, 2, True, 1)
+
+    def test_subtract_into_source(self):
+        self.check('subtract', lambda a, b: eager_subtract(a, b, True), 1, 1, True, 1)
+
+    def test_compare_registers(self):
+        self.check('compare', eager_compare, 1, 2, False, 1)
+
+    def test_compare_immediate(self):
+        self.check('compare', eager_compare, 0, 0, True, 0)
+
+    def test_logical(self):
+        for name, operation in (('logical_and', int.__and__), ('logical_or', int.__or__),
+                                ('logical_xor', int.__xor__)):
+            with self.subTest(name=name):
+                # Rn 0 takes the immediate, the result always goes to R0
+                self.check(name, eager_logical(operation), 1, 0, False, 0)
+
+    def test_logical_registers(self):
+        for name, operation in (('logical_and', int.__and__), ('logical_or', int.__or__),
+                                ('logical_xor', int.__xor__)):
+            with self.subTest(name=name):
+                self.check(name, eager_logical(operation), 1, 2, False, 0)
+
+    def test_shifts(self):
+        self.check('shift_left', eager_shift_left, 1, 2, True, 1)
+        self.check('shift_right', eager_shift_right, 1, 2, True, 1)
+
+
+class FlagElisionTest(unittest.TestCase):
+    # Carry/overflow records the block translator leaves out (live_flag_records)
+
+    def block(self, words):
+        return list(enumerate(words))
+
+    def test_live_records(self):
+        # Overwritten by the next add: dead; the last one reaches the end of the block
+        self.assertEqual(live_flag_records(self.block([0x3901, 0x3A01, 0x50FF])), [False, True, False])
+        # A store may leave the block, so the add before it is live
+        self.assertEqual(live_flag_records(self.block([0x3901, 0x2900, 0x3A01, 0x50FF])), [True, False, True, False])
+        # Instructions that leave the flags alone do not end a record's life
+        self.assertEqual(live_flag_records(self.block([0x3901, 0x1805, 0x8800, 0x7001])), [False, False, True, False])
+        self.assertEqual(live_flag_records(self.block([0x3901, 0x1805, 0x50FF])), [True, False, False])
+
+    def run_blocks(self, words, alu_tables):
+        emulator = Emulator(None, trace_size=0, alu_tables=alu_tables)
+        load_words(emulator, words)
+        while not emulator.interrupt_flag:
+            emulator.execute_block()
+        reference = Emulator(None, trace_size=0)
+        load_words(reference, words)
+        reference.run_until()
+        state = lambda machine: (list(machine.registers), machine.zero_flag, machine.carry_flag, machine.overflow_flag)
+        self.assertEqual(state(emulator), state(reference))
+        return emulator
+
+    def test_flags_read_in_the_next_block(self):
+        for alu_tables in (False, True):
+            with self.subTest(alu_tables=alu_tables):
+                emulator = self.run_blocks(ACROSS_BLOCKS, alu_tables)
+                self.assertEqual(emulator.registers[3], 2)  # The branch saw the zero flag
+                self.assertEqual((emulator.carry_flag, emulator.overflow_flag), eager_add(0xFF, 1)[2:])
+
+    def test_flags_overwritten_before_they_are_read(self):
+        for alu_tables in (False, True):
+            with self.subTest(alu_tables=alu_tables):
+                source = generate_block_source(self.block(OVERWRITTEN), alu_tables=alu_tables)
+                # Only the second add records its flags, on each path it has
+                self.assertEqual(source.count("cv = ("), 2 if alu_tables else 1)
+                emulator = self.run_blocks(OVERWRITTEN, alu_tables)
+                self.assertEqual(emulator.registers[2], 1)
+                self.assertEqual((emulator.carry_flag, emulator.overflow_flag), eager_add(0, 1)[2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
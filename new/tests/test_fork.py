@@ -0,0 +1,104 @@
+# test_fork.py
+
+# Forked machines: RAM shared page by page, copy-on-write, and kept apart.
+
+import pickle
+import unittest
+
+from emulator.bus import PAGE_SHIFT, write_ram, write_shared
+from emulator.emulator import Emulator
+from emulator.snapshot import take_snapshot
+from emulator.turbo import store
+from tests.support import load_words
+
+STORE_A = [0x1841, 0x2900, 0x50FF]  # li r2, #0x41; st r2, [r1]; jmp #0xFF
+ADDRESS = 0x1234
+PAGE = ADDRESS >> PAGE_SHIFT
+
+
+class ForkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = Emulator(None, trace_size=0)
+        load_words(self.parent, STORE_A)
+        self.parent.registers[1] = ADDRESS
+
+    def test_child_starts_in_the_parents_state(self):
+        child = self.parent.fork()
+        self.assertEqual(take_snapshot(child), take_snapshot(self.parent))
+        self.assertEqual(child.pc_register, self.parent.pc_register)
+
+    def test_child_stores_stay_in_the_child(self):
+        child = self.parent.fork()
+        child.run_until(max_instructions=10)
+        self.assertEqual(child.ram_memory[ADDRESS], 0x41)
+        self.assertEqual(self.parent.ram_memory[ADDRESS], 0)
+        self.assertEqual(self.parent.pc_register, 0)
+
+    def test_parent_stores_stay_in_the_parent(self):
+        child = self.parent.fork()
+        store(self.parent, ADDRESS, 0x7F)
+        # Another bank, written after switching to it
+        self.parent.select_ram_bank(1)
+        store(self.parent, ADDRESS, 0x7E)
+        self.assertEqual(child.ram_memory[ADDRESS], 0)
+        self.assertEqual(child.ram_banks[1].memory[ADDRESS], 0)
+        self.assertEqual(self.parent.ram_banks[0].memory[ADDRESS], 0x7F)
+        self.assertEqual(self.parent.ram_memory[ADDRESS], 0x7E)
+
+    def test_pages_are_unshared_on_first_write(self):
+        parent = self.parent
+        child = parent.fork()
+        for machine in (parent, child):
+            self.assertIs(machine.bus.pages[PAGE], write_shared)
+            self.assertTrue(all(bank.shared_pages[PAGE] for bank in machine.ram_banks))
+        store(child, ADDRESS, 1)
+        self.assertEqual(child.ram_banks[0].shared_pages[PAGE], 0)
+        self.assertEqual(child.ram_banks[0].shared_pages[PAGE + 1], 1)
+        # Bank 1 still shares the page
+        self.assertIs(child.bus.pages[PAGE], write_shared)
+        child.select_ram_bank(1)
+        store(child, ADDRESS, 2)
+        child.select_ram_bank(2)
+        store(child, ADDRESS, 3)
+        self.assertIs(child.bus.pages[PAGE], write_ram)
+        self.assertEqual([bank.memory[ADDRESS] for bank in child.ram_banks], [1, 2, 3])
+        self.assertEqual([bank.memory[ADDRESS] for bank in parent.ram_banks], [0, 0, 0])
+
+    def test_image_is_reused_until_the_parent_writes(self):
+        parent = self.parent
+        first = parent.fork()
+        second = parent.fork()
+        self.assertIs(second.ram_banks[0].image, first.ram_banks[0].image)
+        store(first, ADDRESS, 1)  # Only the child's own pages
+        self.assertIs(parent.fork().ram_banks[0].image, first.ram_banks[0].image)
+        store(parent, ADDRESS, 2)
+        third = parent.fork()
+        self.assertIsNot(third.ram_banks[0].image, first.ram_banks[0].image)
+        self.assertEqual(third.ram_memory[ADDRESS], 2)
+        self.assertEqual(second.ram_memory[ADDRESS], 0)
+
+    def test_grandchild(self):
+        child = self.parent.fork()
+        store(child, ADDRESS, 5)
+        grandchild = child.fork()
+        store(grandchild, ADDRESS, 6)
+        self.assertEqual(child.ram_memory[ADDRESS], 5)
+        self.assertEqual(grandchild.ram_memory[ADDRESS], 6)
+        self.assertEqual(self.parent.ram_memory[ADDRESS], 0)
+
+    def test_strings_in_a_mapped_bank(self):
+        for offset, character in enumerate(b"Hi"):
+            store(self.parent, 0x2000 + offset, character)
+        child = self.parent.fork()
+        self.assertEqual(child.get_string_from_memory(0x2000), "Hi")
+
+    def test_pickled_child(self):
+        child = self.parent.fork()
+        store(child, ADDRESS, 9)
+        copy = pickle.loads(pickle.dumps(child))
+        self.assertEqual(take_snapshot(copy), take_snapshot(child))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# test_fusion.py
+
+# Superinstructions: fused pairs leave exactly the state of the two instructions run apart.
+
+import unittest
+
+from emulator.emulator import Emulator
+from emulator.snapshot import take_snapshot
+from tests.support import load_words
+
+# Every kind of pair, round a loop five times:
+#       li r1, #0x80; li r2, #5
+# loop: st r2, [r1]; add r1, r1, #1       st+add
+#       ld r3, [r1]; add r3, r3, #2       ld+add
+#       li r0, #0; add r2, r2, #0xFF      li+add
+#       cmp r2, r0; bne loop              cmp+bne
+#       jmp #0xFF
+PAIRS = [0x1480, 0x1805, 0x2900, 0x3501, 0x0D00, 0x3F02, 0x1000, 0x3AFF, 0x8800, 0x7001, 0x50FF]
+# A store over the ADD it is fused with (stores keep the low byte: 'ld r0, [r0]'):
+# li r1, #3; li r2, #0; st r2, [r1]; add r3, r3, #1; jmp #0xFF
+STORE_OVER_ADD = [0x1403, 0x1800, 0x2900, 0x3F01, 0x50FF]
+
+
+def machine_state(emulator):
+    return (take_snapshot(emulator), list(emulator.registers), emulator.pc_register, emulator.zero_flag,
+            emulator.carry_flag, emulator.overflow_flag, emulator.interrupt_flag)
+
+
+def machine(words, fused):
+    emulator = Emulator(None, trace_size=0)
+    load_words(emulator, words)
+    if not fused:
+        emulator.fusions.clear()
+        emulator.predecode()
+    return emulator
+
+
+class FusionTest(unittest.TestCase):
+
+    def assertSameRuns(self, words, total):
+        # Stopped after every instruction count, with the limit inside a pair as often as not
+        for count in range(total + 1):
+            with self.subTest(count=count):
+                fused = machine(words, True)
+                unfused = machine(words, False)
+                self.assertEqual(fused.run_until(max_instructions=count), unfused.run_until(max_instructions=count))
+                self.assertEqual(machine_state(fused), machine_state(unfused))
+
+    def test_pairs_found(self):
+        self.assertEqual(machine(PAIRS, True).fusions.stats(),
+                         {"st+add": [2], "ld+add": [4], "li+add": [6], "cmp+bne": [8]})
+
+    def test_fused_and_unfused_runs_match(self):
+        total = machine(PAIRS, False).run_until()
+        self.assertEqual(total, 2 + 5 * 8 + 1)
+        self.assertSameRuns(PAIRS, total)
+
+    def test_store_over_the_fused_add(self):
+        emulator = machine(STORE_OVER_ADD, True)
+        self.assertEqual(emulator.fusions.stats(), {"st+add": [2]})
+        emulator.run_until()
+        self.assertEqual(emulator.ram_memory[3], 0)
+        self.assertEqual(emulator.registers[3], 0)  # The add never ran
+        self.assertEqual(emulator.fusions.stats(), {})
+        self.assertSameRuns(STORE_OVER_ADD, len(STORE_OVER_ADD))
+
+    def test_stop_pc_between_the_halves(self):
+        fused = machine(PAIRS, True)
+        unfused = machine(PAIRS, False)
+        for emulator in (fused, unfused):
+            emulator.run_until(stop_pc=9)
+        self.assertEqual(fused.pc_register, 9)
+        self.assertEqual(machine_state(fused), machine_state(unfused))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# test_heap.py
+
+# The buddy heap behind SYS_MALLOC and SYS_FREE, driven by a guest program.
+
+import random
+import unittest
+
+from emulator.emulator import Emulator
+from emulator.heap import Heap
+from emulator.snapshot import take_snapshot, restore_snapshot
+from tests.support import load_words
+
+HEAP_BASE = 0x40  # Below 0x100, so ADD keeps the addresses whole
+
+MALLOC_FREE = [
+    0x1005, 0xF0DC,  # li r0, #5; SYS_MALLOC -> 8-word block
+    0x3400,          # add r1, r0, #0
+    0x1003, 0xF0DC,  # li r0, #3; SYS_MALLOC -> 4-word block
+    0x3C00,          # add r3, r0, #0
+    0x1002, 0xF0DC,  # li r0, #2; SYS_MALLOC -> 2-word block
+    0x3800,          # add r2, r0, #0
+    # 9: free all three, then a block that is not allocated
+    0x3100, 0xF0DD,  # add r0, r1, #0; SYS_FREE
+    0x3300, 0xF0DD,  # add r0, r3, #0; SYS_FREE
+    0x3200, 0xF0DD,  # add r0, r2, #0; SYS_FREE
+    0xF0DD,          # SYS_FREE of 0
+    0x3400,          # add r1, r0, #0
+    0x1040, 0xF0DC,  # li r0, #64; SYS_MALLOC -> the whole heap again
+    0x50FF,          # jmp #0xFF
+]
+FREES = 9
+
+
+class HeapSyscallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+        self.emulator.set_heap(HEAP_BASE, 64)
+        self.address = load_words(self.emulator, MALLOC_FREE, "malloc.hex")
+
+    def test_split_on_malloc(self):
+        emulator = self.emulator
+        emulator.run_until(stop_pc=FREES)
+        registers = emulator.registers
+        self.assertEqual((registers[1], registers[3], registers[2]), (0x40, 0x48, 0x4C))
+        heap = emulator.heap
+        # 64 -> 32 + 16 + 8 + [8: 4 + [4: 2 + 2]]
+        self.assertEqual([sorted(blocks) for blocks in heap.free],
+                         [[], [0x0E], [], [], [0x10], [0x20], []])
+        self.assertEqual(heap.used_words(), 8 + 4 + 2)
+        stats = heap.stats[self.address]
+        self.assertEqual((stats.allocations, stats.in_use, stats.peak), (3, 10, 10))
+
+    def test_merge_on_free(self):
+        emulator = self.emulator
+        emulator.run_until(max_instructions=1000)
+        registers = emulator.registers
+        # Freeing 0 fails, then the merged heap hands out all 64 words at once
+        self.assertEqual((registers[1], registers[0]), (0xFF, HEAP_BASE))
+        heap = emulator.heap
+        self.assertEqual(heap.blocks, {0: (6, 64, self.address)})
+        self.assertEqual(heap.largest_free(), 0)
+        stats = heap.stats[self.address]
+        self.assertEqual((stats.allocations, stats.frees, stats.in_use), (4, 3, 64))
+
+    def test_failure_returns_null(self):
+        emulator = self.emulator
+        emulator.run_until(max_instructions=1000)
+        self.assertEqual(emulator.heap.allocate(1, 0), 0)
+        self.assertEqual(emulator.heap.stats[0].failures, 1)
+
+    def test_snapshot_keeps_the_heap(self):
+        emulator = self.emulator
+        emulator.run_until(stop_pc=FREES)
+        snapshot = take_snapshot(emulator)
+        emulator.run_until(max_instructions=1000)
+        restore_snapshot(emulator, snapshot)
+        self.assertEqual(emulator.heap.used_words(), 14)
+        self.assertEqual(emulator.heap.allocate(2, 0), HEAP_BASE + 0x0E)
+
+
+class HeapModelTest(unittest.TestCase):
+
+    def test_lowest_block_first_and_full_merge(self):
+        rng = random.Random(2)
+        heap = Heap(0x1000, 1000)  # Not a power of two: several initial blocks
+        live = {}
+        for _ in range(3000):
+            if live and rng.random() < 0.45:
+                address = rng.choice(sorted(live))
+                self.assertEqual(heap.release(address), 0)
+                del live[address]
+                continue
+            size = rng.randrange(1, 40)
+            order = (size - 1).bit_length()
+            # The lowest free block of the smallest order that fits
+            candidates = [(order_, offset) for order_ in range(order, len(heap.free)) for offset in heap.free[order_]]
+            expected = min(candidates)[1] + heap.base if candidates else 0
+            address = heap.allocate(size, 0)
+            self.assertEqual(address, expected)
+            if address:
+                for other, other_size in live.items():
+                    self.assertTrue(address + size <= other or other + other_size <= address)
+                live[address] = size
+        for address in list(live):
+            heap.release(address)
+        fresh = Heap(0x1000, 1000)
+        self.assertEqual(heap.free, fresh.free)
+        self.assertEqual(heap.release(0x1000), 0xFF)
+
+    def test_copy_and_array_round_trip(self):
+        heap = Heap(0x1000, 256)
+        addresses = [heap.allocate(size, 7) for size in (3, 17, 1, 64)]
+        heap.release(addresses[1])
+        free = [set(blocks) for blocks in heap.free]
+        copy = heap.copy()
+        copy.allocate(5, 7)
+        self.assertEqual(heap.free, free)
+        loaded = Heap(0, 1)
+        loaded.load(heap.to_array())
+        self.assertEqual((loaded.free, loaded.blocks), (heap.free, heap.blocks))
+        self.assertEqual([loaded.allocate(size, 7) for size in (16, 2, 9)],
+                         [heap.allocate(size, 7) for size in (16, 2, 9)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# test_hexfile.py
+
+# Loading .hex images with data records and running them headless.
+
+import os
+import tempfile
+import unittest
+
+from emulator.batch import run_image
+from emulator.emulator import Emulator, VERSION
+from emulator.hexfile import HexImage, load_hex_file, load_hex_image, read_hex_file
+from emulator.snapshot import take_snapshot
+from tests.support import write_image
+
+IMAGES = os.path.join(os.path.dirname(__file__), '..', '..', 'tests')
+IRC = os.path.join(IMAGES, 'irc.hex')
+
+
+class LoadHexFileTest(unittest.TestCase):
+
+    def test_data_records_store_one_byte_per_word(self):
+        emulator = Emulator(None, trace_size=0)
+        self.assertEqual(load_hex_file(emulator, IRC), 0)
+        # 'Hello World\n' is 13 bytes, an odd-length record
+        text = b"Hello World\\n"
+        self.assertEqual(list(emulator.ram_memory[0xAD:0xAD + len(text)]), list(text))
+        self.assertEqual(emulator.ram_memory[0xAD + len(text)], 0)
+        self.assertEqual(emulator.get_string_from_memory(0xBB), "Goodbye Cruel World\\n")
+
+    def test_image_with_data_records_runs(self):
+        for engine in ('block', 'turbo'):
+            with self.subTest(engine=engine):
+                report = run_image(IRC, engine=engine)
+                self.assertEqual(report['status'], 'exit')
+                self.assertEqual(report['output'], "Hello World\n")
+
+    def test_run_starts_at_the_load_address(self):
+        # A data record at 0 pushes the instructions (SYS_UNAME, SYS_EXIT) up to 4
+        with tempfile.TemporaryDirectory() as directory:
+            image = os.path.join(directory, 'uname.hex')
+            with open(image, 'w') as hex_file:
+                hex_file.write(":0400000041424300\n:04000011F0BFF080\n:00000001FF\n")
+            emulator = Emulator(None, trace_size=0)
+            self.assertEqual(load_hex_file(emulator, image), 4)
+            report = run_image(image)
+        self.assertEqual(report['status'], 'exit')
+        self.assertEqual(report['instructions'], 2)
+        self.assertEqual(report['output'], f"Rick's Amazing Emulator version: {VERSION}\n")
+
+
+class ReadHexFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'image.hex')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_bad_file_changes_nothing(self):
+        # The data record before the bad line is not written either
+        with open(self.filename, 'w') as hex_file:
+            hex_file.write(":0200800041420000\n:04000011F0BFZZ80\n:00000001FF\n")
+        emulator = Emulator(None, trace_size=0)
+        before = take_snapshot(emulator)
+        with self.assertRaisesRegex(ValueError, "Line 2"):
+            load_hex_file(emulator, self.filename)
+        self.assertEqual(take_snapshot(emulator), before)
+
+    def test_image_that_does_not_fit_changes_nothing(self):
+        emulator = Emulator(None, trace_size=0)
+        write_image(self.filename, [0x50FF] * 16, data=[(0x40, b"AB")])
+        image = read_hex_file(self.filename)
+        emulator.extents.reserve(0x100, len(emulator.ram_memory) - 0x100)
+        before = take_snapshot(emulator)
+        image.instructions *= 0x10
+        with self.assertRaisesRegex(ValueError, "No free extent"):
+            load_hex_image(emulator, image)
+        self.assertEqual(take_snapshot(emulator), before)
+        self.assertEqual(emulator.programs, {})
+
+    def test_record_past_the_end_of_memory(self):
+        with open(self.filename, 'w') as hex_file:
+            hex_file.write(":02FFFF004142\n:00000001FF\n")
+        with self.assertRaisesRegex(ValueError, "does not fit"):
+            read_hex_file(self.filename)
+
+    def test_image_bytes_round_trip(self):
+        write_image(self.filename, [0x1480, 0x50FF], data=[(0x80, b"Hi"), (0x90, b"!")])
+        image = read_hex_file(self.filename)
+        self.assertEqual(image.name, 'image.hex')
+        data = image.to_bytes()
+        copy = HexImage.from_bytes(data)
+        self.assertEqual((copy.name, copy.data_records, copy.instructions),
+                         (image.name, image.data_records, image.instructions))
+        for bad in (data[:-1], data + b"\0", data[:5]):
+            with self.subTest(size=len(bad)), self.assertRaises(ValueError):
+                HexImage.from_bytes(bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
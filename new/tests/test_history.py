@@ -0,0 +1,101 @@
+# test_history.py
+
+# Going backwards: 'back' and reverse-continue land on the right instruction.
+
+import threading
+import unittest
+
+from emulator.devices import MAP_SERIAL
+from emulator.emulator import Emulator, INPUT_BACK, INPUT_MAP, INPUT_REVERSE, INPUT_STEP
+from emulator.history import History
+from emulator.snapshot import take_snapshot
+from tests.support import load_words
+
+# Three nested countdown loops, about 400K instructions:
+#       li r0, #0; li r3, #8
+# top:   li r1, #0x40
+# outer: li r2, #0xFF
+# inner: sub r2, r2, #1; cmp r2, r0; bne inner
+#        sub r1, r1, #1; cmp r1, r0; bne outer
+#        sub r3, r3, #1; cmp r3, r0; bne top
+#        jmp #0xFF
+LOOPS = [0x1000, 0x1C08, 0x1440, 0x18FF, 0x4A01, 0x8800, 0x7003, 0x4501, 0x8400, 0x7002, 0x4F01, 0x8C00,
+         0x7001, 0x50FF]
+OUTER = 7  # Address of 'sub r1, r1, #1'
+
+
+def reference(count):
+    # A machine that ran the first count instructions straight, with no history
+    emulator = Emulator(None, trace_size=0)
+    load_words(emulator, LOOPS)
+    emulator.run_until(max_instructions=count)
+    emulator.interrupt_flag = True
+    return emulator
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, quantum=997, trace_size=0)
+        load_words(self.emulator, LOOPS)
+        self.emulator.interrupt_flag = True
+        self.emulator.history = History(self.emulator, interval=5000)
+        self.thread = threading.Thread(target=self.emulator.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        self.thread.join()
+
+    def do(self, kind, a=0):
+        self.emulator.post_input(kind, a)
+        self.assertTrue(self.emulator.wait_until_halted(30))
+
+    def assertAt(self, count):
+        self.assertEqual(self.emulator.instruction_count, count)
+        self.assertEqual(take_snapshot(self.emulator), take_snapshot(reference(count)))
+
+    def test_back(self):
+        self.do(INPUT_STEP, 20000)
+        self.assertAt(20000)
+        self.do(INPUT_BACK, 1234)
+        self.assertAt(18766)
+        self.do(INPUT_BACK, 1)
+        self.assertAt(18765)
+        # Stepping on from there is a new timeline, and can be gone back over too
+        self.do(INPUT_STEP, 10)
+        self.assertAt(18775)
+        self.do(INPUT_BACK, 10 ** 9)
+        self.assertAt(0)
+        self.assertIn("does not reach any further", self.emulator.history.status)
+
+    def test_reverse_continue(self):
+        self.do(INPUT_STEP, 20000)
+        # Where 'sub r1' was about to run, from a machine stepped one instruction at a time
+        stepper = reference(0)
+        stepper.interrupt_flag = False
+        hits = []
+        for count in range(20000):
+            if stepper.pc_register == OUTER:
+                hits.append(count)
+            stepper.run_until(max_instructions=1)
+        self.emulator.breakpoints.add(OUTER)
+        self.do(INPUT_REVERSE)
+        self.assertAt(hits[-1])
+        self.assertEqual(self.emulator.pc_register, OUTER)
+        self.do(INPUT_REVERSE)
+        self.assertAt(hits[-2])
+        self.emulator.breakpoints.clear()
+        self.do(INPUT_REVERSE)
+        self.assertAt(0)
+
+    def test_map_starts_the_history_again(self):
+        self.do(INPUT_STEP, 20000)
+        self.emulator.post_input(INPUT_MAP, 0x50, MAP_SERIAL).result(30)
+        self.do(INPUT_BACK, 1234)
+        self.assertEqual(self.emulator.instruction_count, 20000)
+        self.assertEqual(self.emulator.history.status, "No history yet.")
+
+
+if __name__ == '__main__':
+    unittest.main()
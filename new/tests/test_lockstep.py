@@ -0,0 +1,81 @@
+# test_lockstep.py
+
+# The NumPy lockstep engine against Emulator.run_until() on the same images.
+
+import unittest
+
+from emulator.emulator import Emulator
+from emulator.lockstep import LockstepMachines, np
+from tests.support import load_words
+from tests.test_fusion import PAIRS
+
+# The ALU, the stack and both flag records:
+# li r0, #0x35; li r1, #0x0F; and r0, r1; or r0, #0xC0; xor r0, r1; shl r2, r0, #3;
+# shr r3, r2, #1; sub r3, r3, #0x90; push r3, r2; pop r0, r1; cmp r0, r1; jmp #0xFF
+ALU = [0x1035, 0x140F, 0x9100, 0xA0C0, 0xB100, 0xC803, 0xDE01, 0x4F90, 0xEE01, 0xF103, 0x8100, 0x50FF]
+# Depends on R0, which every machine starts with a different value of:
+# add r1, r0, #0x90; sub r2, r0, #0x81; cmp r0, #0x80; beq 6; li r3, #1; jmp #0xFF; li r3, #2; jmp #0xFF
+BRANCHY = [0x3490, 0x4881, 0x8080, 0x6005, 0x1C01, 0x50FF, 0x1C02, 0x50FF]
+MACHINES = 8
+
+
+def machine_state(emulator):
+    return (emulator.ram_memory.tolist(), list(emulator.registers), emulator.sp_register, emulator.pc_register,
+            emulator.zero_flag, emulator.carry_flag, emulator.overflow_flag, emulator.interrupt_flag)
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class LockstepTest(unittest.TestCase):
+
+    def start(self, words, r0=None):
+        # A machine ready to run words, with R0 set if r0 is given
+        emulator = Emulator(None, trace_size=0)
+        load_words(emulator, words)
+        if r0 is not None:
+            emulator.registers[0] = r0
+        return emulator
+
+    def assertMatches(self, machines, index, emulator):
+        copy = Emulator(None, trace_size=0)
+        machines.copy_to_emulator(index, copy)
+        self.assertEqual(machine_state(copy), machine_state(emulator))
+
+    def test_same_image(self):
+        for name, words in (("pairs", PAIRS), ("alu", ALU)):
+            with self.subTest(image=name):
+                emulator = self.start(words)
+                machines = LockstepMachines.from_emulator(emulator, MACHINES)
+                executed = machines.run()
+                self.assertEqual(executed, MACHINES * emulator.run_until())
+                self.assertTrue(machines.halted.all())
+                for index in (0, MACHINES - 1):
+                    self.assertMatches(machines, index, emulator)
+
+    def test_machines_that_branch_apart(self):
+        starts = [0, 1, 0x7F, 0x80, 0x81, 0xC0, 0xFE, 0xFF]
+        machines = LockstepMachines(len(starts))
+        emulators = []
+        for index, r0 in enumerate(starts):
+            emulator = self.start(BRANCHY, r0)
+            machines.copy_from_emulator(index, emulator)
+            emulators.append(emulator)
+        machines.run()
+        for index, emulator in enumerate(emulators):
+            with self.subTest(r0=starts[index]):
+                emulator.run_until()
+                self.assertMatches(machines, index, emulator)
+        self.assertEqual(machines.registers[:, 3].tolist(), [2 if r0 == 0x80 else 1 for r0 in starts])
+
+    def test_partial_runs(self):
+        # Stopped part way, both engines are at the same instruction
+        emulator = self.start(PAIRS)
+        machines = LockstepMachines.from_emulator(emulator, 2)
+        for steps in (1, 4, 9):
+            machines.run(max_steps=steps)
+            emulator.run_until(max_instructions=steps)
+            with self.subTest(steps=steps):
+                self.assertMatches(machines, 1, emulator)
+
+
+if __name__ == '__main__':
+    unittest.main()
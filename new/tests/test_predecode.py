@@ -0,0 +1,50 @@
+# test_predecode.py
+
+# The predecoded program area: kept in step with RAM as it is loaded and written.
+
+import unittest
+
+from emulator.emulator import Emulator, END_MARKER_ADDRESS
+from emulator.fusion import FUSED
+from emulator.turbo import store
+from tests.support import load_words
+from tests.test_fusion import PAIRS
+
+
+class PredecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+        load_words(self.emulator, PAIRS)
+
+    def assertDecoded(self, emulator):
+        # Every entry is the decode of its word, or a fused pair starting there
+        table = emulator.turbo_table
+        for address, entry in enumerate(emulator.predecoded):
+            if address in emulator.fusions.handlers:
+                self.assertEqual(entry, (emulator.fusions.handlers[address], FUSED, 0, 0))
+            else:
+                self.assertEqual(entry, table[emulator.ram_memory[address]], f"0x{address:04X}")
+
+    def test_loaded_image(self):
+        self.assertEqual(len(self.emulator.predecoded), END_MARKER_ADDRESS + 1)
+        self.assertDecoded(self.emulator)
+
+    def test_stores_decode_again(self):
+        emulator = self.emulator
+        store(emulator, 5, 0x12)  # The ADD of the ld+add pair at 4
+        store(emulator, 0x40, 0x34)
+        store(emulator, END_MARKER_ADDRESS + 1, 0x56)  # Above the program area: not predecoded
+        self.assertNotIn(4, emulator.fusions.handlers)
+        self.assertEqual(len(emulator.predecoded), END_MARKER_ADDRESS + 1)
+        self.assertDecoded(emulator)
+
+    def test_write_memory_decodes_again(self):
+        emulator = self.emulator
+        emulator.write_memory(8, 0x0001)  # The CMP of the cmp+bne pair
+        self.assertNotIn(8, emulator.fusions.handlers)
+        self.assertDecoded(emulator)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# test_profiler.py
+
+# Execution profiles: per-address, per-opcode and per-branch counts.
+
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from emulator.emulator import Emulator
+from tests.support import load_words
+from tests.test_fusion import PAIRS
+
+# PAIRS runs its set-up once, its eight-instruction loop five times, then the final jump
+ADDRESS_COUNTS = [1, 1, 5, 5, 5, 5, 5, 5, 5, 5, 1]
+OPCODES = {'ld': 5, 'li': 7, 'st': 5, 'add': 15, 'jmp': 1, 'bne': 5, 'cmp': 5}
+LOOP_BRANCH = 9
+
+
+def profiled(run):
+    # A machine that ran PAIRS with the profiler on, through run_profiled() or the logging interpreter
+    emulator = Emulator(None, trace_size=0)
+    load_words(emulator, PAIRS)
+    emulator.enable_profiler()
+    if run == 'run_profiled':
+        emulator.run_profiled()
+    else:
+        while not emulator.interrupt_flag:
+            emulator.fetch_and_execute()
+    return emulator
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def test_counts(self):
+        for run in ('run_profiled', 'fetch_and_execute'):
+            with self.subTest(run=run):
+                profiler = profiled(run).profiler
+                self.assertEqual(profiler.address_counts[:len(PAIRS)].tolist(), ADDRESS_COUNTS)
+                self.assertEqual(sum(profiler.address_counts), sum(ADDRESS_COUNTS))
+                self.assertEqual(profiler.opcode_profile(), OPCODES)
+                self.assertEqual(profiler.total(), sum(ADDRESS_COUNTS))
+                # The loop branch is taken four times, then falls through
+                self.assertEqual((profiler.branch_taken[LOOP_BRANCH], profiler.branch_not_taken[LOOP_BRANCH]),
+                                 (4, 1))
+                self.assertEqual(sum(profiler.branch_taken) + sum(profiler.branch_not_taken), 5)
+
+    def test_hot_spots_and_reset(self):
+        emulator = profiled('run_profiled')
+        profiler = emulator.profiler
+        spots = profiler.hot_spots(emulator.ram_memory, count=2)
+        self.assertEqual([spot['count'] for spot in spots], [5, 5])
+        self.assertAlmostEqual(spots[0]['percent'], 500 / sum(ADDRESS_COUNTS))
+        profiler.reset()
+        self.assertEqual(profiler.total(), 0)
+        self.assertEqual(profiler.hot_spots(emulator.ram_memory), [])
+        self.assertEqual(profiler.call_graph.counts, {})
+
+    def test_export(self):
+        emulator = profiled('run_profiled')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "profile.csv")
+            self.assertEqual(emulator.profiler.export(filename, emulator.ram_memory), len(PAIRS))
+            with open(filename, newline="") as f:
+                rows = {int(row['address']): row for row in csv.DictReader(f)}
+            filename = os.path.join(directory, "profile.json")
+            emulator.profiler.export(filename, emulator.ram_memory)
+            with open(filename) as f:
+                report = json.load(f)
+        self.assertEqual([int(rows[address]['count']) for address in range(len(PAIRS))], ADDRESS_COUNTS)
+        self.assertEqual((rows[LOOP_BRANCH]['taken'], rows[LOOP_BRANCH]['not_taken']), ("4", "1"))
+        self.assertEqual(report['instructions'], sum(ADDRESS_COUNTS))
+        self.assertEqual(report['opcodes'], OPCODES)
+        self.assertEqual(len(report['addresses']), len(PAIRS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+# test_quantum.py
+
+# Scheduling quanta: the emulator thread runs at most `quantum` instructions between input checks.
+
+import unittest
+
+from emulator.emulator import Emulator
+from tests.support import load_words
+from tests.test_fusion import PAIRS
+
+
+class QuantumTest(unittest.TestCase):
+
+    def test_quantum_must_be_positive(self):
+        for quantum in (0, -1):
+            with self.subTest(quantum=quantum), self.assertRaises(ValueError):
+                Emulator(None, quantum=quantum, trace_size=0)
+
+    def test_smallest_quantum(self):
+        emulator = Emulator(None, quantum=1, trace_size=0)
+        load_words(emulator, PAIRS)
+        quanta = 0
+        while not emulator.interrupt_flag:
+            self.assertEqual(emulator.run_quantum(), 1)
+            quanta += 1
+        self.assertEqual(quanta, 2 + 5 * 8 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# test_replay.py
+
+# Record and replay: a recording re-run headless ends in the recorded state.
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+from emulator.bus import PAGE_SHIFT
+from emulator.devices import MAP_RAM, MAP_ROM, MAP_SERIAL
+from emulator.emulator import (Emulator, INPUT_BANK, INPUT_FREE, INPUT_HEAP, INPUT_LOAD, INPUT_MAP, INPUT_PC, INPUT_RECORD,
+                               INPUT_RESUME, INPUT_STORE)
+from emulator.hexfile import read_hex_file
+from emulator.replay import EVENT, Recorder, read_recording, replay_recording
+from emulator.snapshot import SnapshotError, take_snapshot
+from tests.support import load_words, write_image
+
+# Poll 0x80 until it is non-zero, then copy it plus one into R2 and halt:
+# li r1, #0x80; ld r0, [r1]; cmp r0, #0; beq 0; add r2, r0, #1; jmp #0xFF
+POLL = [0x1480, 0x0100, 0x8000, 0x6000, 0x3801, 0x50FF]
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "run.rec")
+        self.emulator = Emulator(None, quantum=997, trace_size=0)
+        load_words(self.emulator, POLL)
+        self.emulator.interrupt_flag = True  # Started by the recording below
+        self.thread = threading.Thread(target=self.emulator.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        self.thread.join()
+        self.directory.cleanup()
+
+    def post(self, kind, a=0, b=0):
+        self.emulator.post_input(kind, a, b)
+
+    def record(self):
+        # Poke the polled word twice while the program spins, with a restart in between
+        emulator = self.emulator
+        self.post(INPUT_RECORD, Recorder(self.filename))
+        emulator.resume()
+        time.sleep(0.02)
+        self.post(INPUT_STORE, 0x80, 7)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.post(INPUT_STORE, 0x80, 0)
+        self.post(INPUT_PC, 0)
+        emulator.resume()
+        time.sleep(0.02)
+        self.post(INPUT_STORE, 0x80, 9)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.post(INPUT_RECORD, None)
+        self.assertTrue(emulator.wait_until_halted(30))
+
+    def test_replay_matches(self):
+        self.record()
+        _, events, (count, final_state) = read_recording(self.filename)
+        self.assertEqual(sum(event[1] == INPUT_STORE for event in events), 3)
+        copy = Emulator(None, trace_size=0)
+        result = replay_recording(copy, self.filename)
+        self.assertTrue(result['matched'])
+        self.assertEqual(result['instructions'], count)
+        self.assertEqual(result['events'], len(events))
+        self.assertEqual(zlib.crc32(take_snapshot(copy)), final_state)
+        self.assertEqual(take_snapshot(copy), take_snapshot(self.emulator))
+        self.assertEqual(copy.registers[2], 10)
+
+    def test_bad_inputs_keep_the_thread_alive(self):
+        emulator = self.emulator
+        self.post(INPUT_RECORD, Recorder(self.filename))
+        self.post(INPUT_STORE, 0x90, -1)
+        self.post(INPUT_STORE, 0x91, 1 << 32 | 0x12)
+        self.post(INPUT_BANK, 7)  # No such bank: dropped, and not recorded
+        self.post(INPUT_RECORD, None)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.assertTrue(self.thread.is_alive())
+        # Stores keep the byte a guest store would
+        self.assertEqual(emulator.ram_memory[0x90:0x92].tolist(), [0xFF, 0x12])
+        self.assertEqual(emulator.current_ram_bank, 0)
+        _, events, _ = read_recording(self.filename)
+        self.assertEqual([event[1:] for event in events], [(INPUT_STORE, 0x90, 0xFFFF), (INPUT_STORE, 0x91, 0x12)])
+        self.assertTrue(replay_recording(Emulator(None, trace_size=0), self.filename)['matched'])
+
+    def test_loads_and_frees_are_replayed(self):
+        emulator = self.emulator
+        image = os.path.join(self.directory.name, "store.hex")
+        write_image(image, [0x1890, 0x1C42, 0x2E00, 0x50FF], data=[(0x30, b"Hi")])  # st #0x42 to 0x90
+        self.post(INPUT_RECORD, Recorder(self.filename))
+        address = emulator.post_input(INPUT_LOAD, read_hex_file(image)).result(30)
+        self.post(INPUT_PC, address)
+        emulator.resume()
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.post(INPUT_FREE, address, 4)
+        self.post(INPUT_RECORD, None)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.assertEqual(emulator.ram_memory[0x90], 0x42)
+        self.assertNotIn(address, emulator.programs)
+        # The image travels in the recording: the copy never reads the file
+        os.remove(image)
+        _, events, _ = read_recording(self.filename)
+        self.assertEqual([event[1] for event in events], [INPUT_LOAD, INPUT_PC, INPUT_RESUME, INPUT_FREE])
+        copy = Emulator(None, trace_size=0)
+        self.assertTrue(replay_recording(copy, self.filename)['matched'])
+        self.assertEqual(take_snapshot(copy), take_snapshot(emulator))
+        self.assertEqual(copy.ram_memory[0x30:0x32].tolist(), list(b"Hi"))
+
+    def test_memory_map_changes_are_replayed(self):
+        emulator = self.emulator
+        self.post(INPUT_RECORD, Recorder(self.filename))
+        self.assertEqual(emulator.post_input(INPUT_MAP, 0x50, MAP_SERIAL).result(30).name, "serial")
+        self.post(INPUT_MAP, 0x60, MAP_ROM + 1)
+        with self.assertRaises(ValueError):
+            emulator.post_input(INPUT_MAP, 0x60, MAP_SERIAL).result(30)  # Already mapped: not recorded
+        self.assertEqual(emulator.post_input(INPUT_MAP, 0x50, MAP_RAM).result(30).name, "serial")
+        self.post(INPUT_RECORD, None)
+        self.assertTrue(emulator.wait_until_halted(30))
+        _, events, _ = read_recording(self.filename)
+        self.assertEqual([event[1:] for event in events],
+                         [(INPUT_MAP, 0x50, MAP_SERIAL), (INPUT_MAP, 0x60, MAP_ROM + 1), (INPUT_MAP, 0x50, MAP_RAM)])
+        copy = Emulator(None, trace_size=0)
+        self.assertTrue(replay_recording(copy, self.filename)['matched'])
+        self.assertEqual([(device.name, device.base, device.first_word) for device in copy.bus.devices()],
+                         [("rom", 0x60 << PAGE_SHIFT, 1 << PAGE_SHIFT)])
+        self.assertEqual(copy.extents.extents(), emulator.extents.extents())
+
+    def test_heap_moves_are_replayed(self):
+        emulator = self.emulator
+        self.post(INPUT_RECORD, Recorder(self.filename))
+        self.post(INPUT_HEAP, 0x4000, 0x100)
+        with self.assertRaises(ValueError):
+            emulator.post_input(INPUT_HEAP, 0, 0x100).result(30)  # Not recorded
+        self.post(INPUT_RECORD, None)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.assertEqual((emulator.heap.base, emulator.heap.words), (0x4000, 0x100))
+        _, events, _ = read_recording(self.filename)
+        self.assertEqual([event[1:] for event in events], [(INPUT_HEAP, 0x4000, 0x100)])
+        copy = Emulator(None, trace_size=0)
+        self.assertTrue(replay_recording(copy, self.filename)['matched'])
+        self.assertEqual((copy.heap.base, copy.heap.words), (0x4000, 0x100))
+        self.assertEqual(copy.extents.extents(), emulator.extents.extents())
+
+    def test_damaged_recordings(self):
+        self.record()
+        with open(self.filename, "rb") as recording:
+            data = bytearray(recording.read())
+        # A different final state no longer matches
+        data[-EVENT.size + 9] ^= 1
+        with open(self.filename, "wb") as recording:
+            recording.write(data)
+        self.assertFalse(replay_recording(Emulator(None, trace_size=0), self.filename)['matched'])
+        # Without its end record it is not a complete recording
+        with open(self.filename, "wb") as recording:
+            recording.write(data[:-EVENT.size])
+        with self.assertRaises(SnapshotError):
+            read_recording(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# test_snapshot.py
+
+# Full-machine save states: taking, restoring and saving them.
+
+import os
+import tempfile
+import threading
+import unittest
+
+from emulator.emulator import Emulator, INPUT_RESTORE, INPUT_SAVE
+from emulator.snapshot import (SnapshotError, load_snapshot, read_snapshot_file, restore_snapshot, save_snapshot,
+                               take_snapshot)
+from tests.support import load_words
+
+# li r0, #3; syscall SYS_MALLOC; li r1, #0x80; li r2, #0x41; st r2, [r1]; li r0, #1;
+# syscall SYS_BANK; li r2, #0x42; st r2, [r1]; jmp #0xFF
+PROGRAM = [0x1003, 0xF0DC, 0x1480, 0x1841, 0x2900, 0x1001, 0xF08C, 0x1842, 0x2900, 0x50FF]
+# Count R2 down from 0xFF, 0xFF times over, then halt:
+#        li r0, #0; li r1, #0xFF
+# outer: li r2, #0xFF
+# inner: sub r2, r2, #1; cmp r2, r0; bne inner
+#        sub r1, r1, #1; cmp r1, r0; bne outer
+#        jmp #0xFF
+LOOPS = [0x1000, 0x14FF, 0x18FF, 0x4A01, 0x8800, 0x7002, 0x4501, 0x8400, 0x7001, 0x50FF]
+
+
+def machine_state(emulator):
+    # What a restore has to bring back, beyond the snapshot bytes themselves
+    return (list(emulator.registers), emulator.pc_register, emulator.current_ram_bank,
+            emulator.zero_flag, emulator.carry_flag, emulator.overflow_flag, emulator.interrupt_flag)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+        # Loaded into both banks: SYS_BANK carries on at the next address of the other one
+        self.emulator.select_ram_bank(1)
+        load_words(self.emulator, PROGRAM)
+        self.emulator.select_ram_bank(0)
+        load_words(self.emulator, PROGRAM)
+
+    def test_round_trip(self):
+        emulator = self.emulator
+        emulator.run_until(max_instructions=5)
+        data = take_snapshot(emulator)
+        copy = Emulator(None, trace_size=0)
+        restore_snapshot(copy, data)
+        self.assertEqual(take_snapshot(copy), data)
+        self.assertEqual(machine_state(copy), machine_state(emulator))
+        self.assertEqual(copy.heap.blocks, emulator.heap.blocks)
+        self.assertEqual(copy.extents.extents(), emulator.extents.extents())
+        # Both run on to the same state, across the bank switch
+        for machine in (emulator, copy):
+            machine.run_until(max_instructions=100)
+            machine.cli.service_syscalls()
+        self.assertEqual(take_snapshot(copy), take_snapshot(emulator))
+        self.assertEqual(copy.current_ram_bank, 1)
+        self.assertEqual([bank.memory[0x80] for bank in copy.ram_banks], [0x41, 0x42, 0])
+        self.assertEqual(copy.ram_banks[0].heap.used_words(), 4)
+
+    def test_restore_goes_back(self):
+        emulator = self.emulator
+        data = take_snapshot(emulator)
+        emulator.run_until(max_instructions=100)
+        restore_snapshot(emulator, data)
+        self.assertEqual(take_snapshot(emulator), data)
+        self.assertEqual(emulator.current_ram_bank, 0)
+        self.assertEqual(emulator.heap.blocks, {})
+        # The restored program area is decoded again
+        self.assertEqual(emulator.predecoded[1], emulator.turbo_table[PROGRAM[1]])
+
+    def test_programs(self):
+        emulator = self.emulator
+        data = take_snapshot(emulator)
+        self.assertEqual(emulator.programs, {0: (len(PROGRAM), "test.hex")})
+        # A program loaded and one freed after the snapshot are both undone by restoring it
+        load_words(emulator, [0x50FF], "later.ünï.hex")
+        emulator.select_ram_bank(1)
+        emulator.free_memory(0, len(PROGRAM))
+        self.assertEqual(emulator.programs, {})
+        restore_snapshot(emulator, data)
+        self.assertEqual([bank.programs for bank in emulator.ram_banks],
+                         [{0: (len(PROGRAM), "test.hex")}, {0: (len(PROGRAM), "test.hex")}, {}])
+        self.assertIs(emulator.programs, emulator.ram_banks[0].programs)
+        # Names of any length, through a restore onto another machine
+        load_words(emulator, [0x50FF], "later.ünï.hex")
+        copy = Emulator(None, trace_size=0)
+        restore_snapshot(copy, take_snapshot(emulator))
+        self.assertEqual(copy.programs, emulator.programs)
+        self.assertIn("later.ünï.hex", [name for _, name in copy.programs.values()])
+
+    def test_restore_into_a_fork(self):
+        emulator = self.emulator
+        child = emulator.fork()
+        emulator.run_until(max_instructions=100)
+        restore_snapshot(child, take_snapshot(emulator))
+        self.assertEqual(take_snapshot(child), take_snapshot(emulator))
+
+    def test_file(self):
+        self.emulator.run_until(max_instructions=5)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "state.snap")
+            save_snapshot(self.emulator, filename)
+            copy = Emulator(None, trace_size=0)
+            load_snapshot(copy, filename)
+        self.assertEqual(take_snapshot(copy), take_snapshot(self.emulator))
+
+    def test_bad_snapshots(self):
+        data = take_snapshot(self.emulator)
+        for bad in (b"", b"EMS0" + data[4:], data + b"\0", data[:-4]):
+            with self.subTest(size=len(bad)), self.assertRaises(SnapshotError):
+                restore_snapshot(self.emulator, bad)
+
+
+class RunningSnapshotTest(unittest.TestCase):
+    # Saves and restores posted to a running emulator thread
+
+    def setUp(self):
+        self.emulator = Emulator(None, quantum=97, trace_size=0)
+        load_words(self.emulator, LOOPS)
+        self.thread = threading.Thread(target=self.emulator.run)
+        self.thread.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        self.thread.join()
+
+    def final_state(self, data):
+        # Where a machine restored from data ends up
+        emulator = Emulator(None, trace_size=0)
+        restore_snapshot(emulator, data)
+        emulator.run_until(max_instructions=1 << 20)
+        return take_snapshot(emulator)
+
+    def test_save_and_restore_while_running(self):
+        emulator = self.emulator
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "state.snap")
+            emulator.post_input(INPUT_SAVE, filename).result(30)
+            data = read_snapshot_file(filename)
+        # Taken between quanta: a machine restored from it runs to the same end
+        final = self.final_state(data)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.assertEqual(take_snapshot(emulator), final)
+        # Restoring a running state runs on from there
+        emulator.post_input(INPUT_RESTORE, data).result(30)
+        self.assertTrue(emulator.wait_until_halted(30))
+        self.assertEqual(take_snapshot(emulator), final)
+
+    def test_bad_restore(self):
+        with self.assertRaises(SnapshotError):
+            self.emulator.post_input(INPUT_RESTORE, b"junk").result(30)
+        self.assertTrue(self.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# test_trace.py
+
+# The execution trace ring buffer and its binary and text dumps.
+
+import os
+import tempfile
+import unittest
+from array import array
+
+from emulator.emulator import Emulator
+from emulator.trace import DUMP_HEADER, DUMP_MAGIC, DUMP_WORDS, FLAG_CARRY, FLAG_OVERFLOW, FLAG_ZERO
+from tests.support import load_words
+from tests.test_fusion import PAIRS
+
+CAPACITY = 16  # Fewer than PAIRS runs, so the buffer wraps
+
+
+def stepped_records(words):
+    # What the trace should hold: the state before each instruction, from a machine run one at a time
+    emulator = Emulator(None, trace_size=0)
+    load_words(emulator, words)
+    records = []
+    while not emulator.interrupt_flag:
+        pc = emulator.pc_register
+        flags = ((FLAG_ZERO if emulator.zero_flag else 0) | (FLAG_CARRY if emulator.carry_flag else 0)
+                 | (FLAG_OVERFLOW if emulator.overflow_flag else 0))
+        records.append((pc, emulator.ram_memory[pc], *emulator.registers, emulator.sp_register, flags))
+        emulator.run_until(max_instructions=1)
+    return records
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=CAPACITY)
+        load_words(self.emulator, PAIRS)
+        self.executed = self.emulator.run_traced()
+        self.expected = stepped_records(PAIRS)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_records_are_the_last_instructions(self):
+        trace = self.emulator.trace
+        self.assertEqual(self.executed, len(self.expected))
+        self.assertEqual(trace.count, CAPACITY)
+        self.assertEqual(trace.records(), self.expected[-CAPACITY:])
+        self.assertEqual(trace.records(last=3), self.expected[-3:])
+        trace.clear()
+        self.assertEqual(trace.records(), [])
+
+    def test_binary_dump(self):
+        filename = os.path.join(self.directory.name, "trace.bin")
+        self.assertEqual(self.emulator.dump_trace(filename), CAPACITY)
+        with open(filename, "rb") as dump:
+            data = dump.read()
+        magic, words, count = DUMP_HEADER.unpack_from(data)
+        self.assertEqual((magic, words, count), (DUMP_MAGIC, DUMP_WORDS, CAPACITY))
+        values = array('q', data[DUMP_HEADER.size:])
+        self.assertEqual(len(values), DUMP_WORDS * CAPACITY)
+        records = [tuple(values[i:i + DUMP_WORDS]) for i in range(0, len(values), DUMP_WORDS)]
+        self.assertEqual(records, self.expected[-CAPACITY:])
+
+    def test_text_dump(self):
+        filename = os.path.join(self.directory.name, "trace.txt")
+        self.assertEqual(self.emulator.dump_trace(filename), CAPACITY)
+        with open(filename) as dump:
+            lines = dump.read().splitlines()
+        self.assertEqual(lines, self.emulator.trace.format_records())
+        self.assertEqual(len(lines), CAPACITY)
+        # The last instruction run: jmp #0xFF, after the loop's final compare set Z
+        self.assertTrue(lines[-1].startswith("PC 0x000A  0x50FF  R0 0x00 R1 0x85 R2 0x00 R3 0x02"))
+        self.assertTrue(lines[-1].endswith("Z1 C0 V0"))
+
+
+if __name__ == '__main__':
+    unittest.main()
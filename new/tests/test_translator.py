@@ -0,0 +1,85 @@
+# test_translator.py
+
+# The block engine: translated blocks are thrown away when guest code rewrites them.
+
+import unittest
+
+from emulator.emulator import Emulator
+from emulator.snapshot import take_snapshot
+from tests.support import load_words
+
+# Rewrite the loop's first instruction on the first pass (stores keep the low
+# byte, so 'add r3, r3, #1' becomes 'ld r0, [r0]'), then go round again:
+#       li r3, #0
+# top:  add r3, r3, #1; li r1, #1; li r2, #0; st r2, [r1]; jmp top
+REWRITE_LOOP = [0x1C00, 0x3F01, 0x1401, 0x1800, 0x2900, 0x5000]
+# Rewrite an instruction further on in the block that is running:
+# li r1, #4; li r2, #0; st r2, [r1]; li r3, #7; li r3, #9; jmp #0xFF
+REWRITE_AHEAD = [0x1404, 0x1800, 0x2900, 0x1C07, 0x1C09, 0x50FF]
+
+
+def run_blocks(emulator, instructions):
+    # Run translated blocks until at least `instructions` instructions ran, or the program halts
+    executed = 0
+    while executed < instructions and not emulator.interrupt_flag:
+        executed += emulator.execute_block()
+    return executed
+
+
+def reference(words, instructions):
+    # The same program run by the turbo engine
+    emulator = Emulator(None, trace_size=0)
+    load_words(emulator, words)
+    emulator.run_until(max_instructions=instructions)
+    return emulator
+
+
+class BlockCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = Emulator(None, trace_size=0)
+
+    def test_rewritten_block_is_translated_again(self):
+        emulator = self.emulator
+        load_words(emulator, REWRITE_LOOP)
+        cache = emulator.block_cache
+        # The first block rewrites itself, and is gone once it has run
+        executed = run_blocks(emulator, 1)
+        self.assertEqual(emulator.ram_memory[1], 0)
+        self.assertEqual(cache.blocks, {})
+        self.assertEqual(cache.generation, 1)
+        # Every later pass stores into its own block again
+        executed += run_blocks(emulator, 50 - executed)
+        self.assertGreater(cache.generation, 5)
+        # The add ran on the first pass only
+        self.assertEqual(emulator.registers[3], 1)
+        self.assertEqual(take_snapshot(emulator), take_snapshot(reference(REWRITE_LOOP, executed)))
+
+    def test_store_ahead_in_the_running_block(self):
+        emulator = self.emulator
+        load_words(emulator, REWRITE_AHEAD)
+        executed = run_blocks(emulator, 100)
+        self.assertTrue(emulator.interrupt_flag)
+        self.assertEqual(executed, len(REWRITE_AHEAD))
+        self.assertEqual(emulator.registers[3], 7)
+        self.assertEqual(take_snapshot(emulator), take_snapshot(reference(REWRITE_AHEAD, 100)))
+
+    def test_invalidate_drops_every_block_covering_the_address(self):
+        emulator = self.emulator
+        load_words(emulator, REWRITE_AHEAD)
+        cache = emulator.block_cache
+        cache.lookup(0)
+        cache.lookup(3)
+        self.assertEqual(cache.ranges, {0: (0, 5), 3: (3, 5)})
+        cache.invalidate(1)
+        self.assertEqual(list(cache.blocks), [3])
+        self.assertNotIn(1, cache.owners)
+        self.assertEqual(cache.owners[4], {3})
+        # An address no block covers changes nothing
+        generation = cache.generation
+        cache.invalidate(0x80)
+        self.assertEqual(cache.generation, generation)
+
+
+if __name__ == '__main__':
+    unittest.main()